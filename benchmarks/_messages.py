@@ -0,0 +1,119 @@
+"""
+Синтетические DNS-ответы для бенчмарков
+"""
+import struct
+
+
+def _name(name):
+    encoded = b''.join(struct.pack('!B', len(label)) + label.encode()
+                       for label in name.split('.'))
+    return encoded + b'\x00'
+
+
+def _header(identifier, qdcount, ancount, nscount, arcount, flags=0x8180):
+    return struct.pack('!HHHHHH', identifier, flags,
+                       qdcount, ancount, nscount, arcount)
+
+
+def _record(name, type_, ttl, rdata):
+    return name + struct.pack('!HHIH', type_, 1, ttl, len(rdata)) + rdata
+
+
+def a_response(hostname='example.com', count=1):
+    """
+    Ответ с count записями типа A на вопрос hostname
+    """
+    question = _name(hostname) + struct.pack('!HH', 1, 1)
+    records = b''.join(
+        _record(b'\xc0\x0c', 1, 300, struct.pack('!I', 0x0a000000 + i))
+        for i in range(count))
+    return _header(1, 1, count, 0, 0) + question + records
+
+
+def referral_response(hostname='www.example.com', zone='com', count=13):
+    """
+    Реферал от корневого сервера: count NS записей и count glue A записей
+    """
+    question = _name(hostname) + struct.pack('!HH', 2, 1)
+    zone_offset = 12 + len(_name(hostname)) - len(_name(zone))
+    zone_pointer = struct.pack('!H', 0xc000 | zone_offset)
+
+    authorities = []
+    name_server_offsets = []
+    offset = 12 + len(question)
+    for i in range(count):
+        rdata = struct.pack('!B', 1) + chr(ord('a') + i).encode() + \
+            b'\x0cgtld-servers\x03net\x00'
+        record = _record(zone_pointer, 2, 172800, rdata)
+        name_server_offsets.append(offset + len(record) - len(rdata))
+        authorities.append(record)
+        offset += len(record)
+
+    additions = [
+        _record(struct.pack('!H', 0xc000 | ns_offset), 1, 172800,
+                struct.pack('!I', 0xc0050000 + i))
+        for i, ns_offset in enumerate(name_server_offsets)]
+
+    return (_header(1, 1, 0, count, count, flags=0x8000) + question
+            + b''.join(authorities) + b''.join(additions))
+
+
+def axfr_responses(zone='example.com', count=100000, per_message=1000):
+    """
+    Синтетический AXFR: count записей (A, AAAA, MX, TXT, CNAME по кругу),
+    разбитых на сообщения по per_message записей
+
+    :return: список байтовых представлений сообщений
+    """
+    question = _name(zone) + struct.pack('!HH', 252, 1)
+    zone_pointer = b'\xc0\x0c'
+
+    messages = []
+    for start in range(0, count, per_message):
+        records = []
+        for i in range(start, min(start + per_message, count)):
+            label = f'host{i}'.encode()
+            owner = struct.pack('!B', len(label)) + label + zone_pointer
+            kind = i % 5
+            if kind == 0:
+                rdata, type_ = struct.pack('!I', 0x0a000000 + i), 1
+            elif kind == 1:
+                rdata, type_ = b'\x20\x01\x0d\xb8' + bytes(8) + \
+                    struct.pack('!I', i), 28
+            elif kind == 2:
+                rdata, type_ = struct.pack('!H', 10) + b'\x04mail' + \
+                    zone_pointer, 15
+            elif kind == 3:
+                text = f'v=spf1 include:{i}'.encode()
+                rdata, type_ = struct.pack('!B', len(text)) + text, 16
+            else:
+                rdata, type_ = b'\x03www' + zone_pointer, 5
+            records.append(_record(owner, type_, 3600, rdata))
+
+        messages.append(_header(1, 1, len(records), 0, 0, flags=0x8400)
+                        + question + b''.join(records))
+
+    return messages
+
+
+_RDATA = {
+    'A': (1, struct.pack('!I', 0x0a000001)),
+    'AAAA': (28, b'\x20\x01\x0d\xb8' + bytes(11) + b'\x01'),
+    'NS': (2, b'\x03ns1\xc0\x0c'),
+    'CNAME': (5, b'\x03www\xc0\x0c'),
+    'MX': (15, struct.pack('!H', 10) + b'\x04mail\xc0\x0c'),
+    'TXT': (16, b'\x0bhello world'),
+    'SOA': (6, b'\x03ns1\xc0\x0c\x0ahostmaster\xc0\x0c'
+               + struct.pack('!5I', 2024010101, 7200, 3600, 1209600, 300)),
+}
+
+
+def typed_response(type_name, count, hostname='example.com'):
+    """
+    Ответ с count записями одного типа type_name ('A', 'NS', 'MX', ...)
+    """
+    type_, rdata = _RDATA[type_name]
+    question = _name(hostname) + struct.pack('!HH', type_, 1)
+    records = b''.join(_record(b'\xc0\x0c', type_, 300, rdata)
+                       for _ in range(count))
+    return _header(1, 1, count, 0, 0) + question + records
@@ -0,0 +1,44 @@
+"""
+Бенчмарк извлечения A адресов из 20 000 ответов: decode_records со
+строками против векторизованного extract_addresses (нужен numpy; без
+него замеряется только decode_records)
+
+Запуск: python3 benchmarks/bench_addresses.py
+"""
+import os
+import sys
+import timeit
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+from benchmarks import _messages  # noqa: E402
+from dns.dns_addresses import extract_addresses  # noqa: E402
+from dns.dns_message import decode_records  # noqa: E402
+
+
+def main(count=20000, number=3):
+    messages = [_messages.a_response(f'host{i}.example.com', count=4)
+                for i in range(count)]
+
+    cases = {
+        'decode_records + set(ip)':
+            lambda: {data.ip for _, _, data in decode_records(messages)},
+    }
+    if np is not None:
+        cases['extract_addresses + unique'] = \
+            lambda: np.unique(extract_addresses(messages)[0])
+    for title, extract in cases.items():
+        seconds = min(timeit.repeat(extract, number=number, repeat=3))
+        print(f'{title:<28} {seconds / number / count * 1e6:8.2f} '
+              f'мкс/ответ')
+    if np is None:
+        print('extract_addresses пропущен: numpy не установлен')
+
+
+if __name__ == '__main__':
+    main()
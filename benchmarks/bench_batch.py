@@ -0,0 +1,43 @@
+"""
+Бенчмарк пакетного декодирования 10 000 ответов: Answer.from_bytes в
+цикле против decode_records
+
+Запуск: python3 benchmarks/bench_batch.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+from benchmarks import _messages  # noqa: E402
+from dns.dns_message import (  # noqa: E402
+    Answer, decode_records)
+
+
+def main(count=10000, number=3):
+    messages = [_messages.a_response(f'host{i}.example.com', count=2)
+                for i in range(count)]
+    buffer = b''.join(messages)
+    offsets = []
+    position = 0
+    for message in messages:
+        offsets.append(position)
+        position += len(message)
+
+    cases = {
+        'Answer.from_bytes в цикле':
+            lambda: [Answer.from_bytes(m) for m in messages],
+        'decode_records':
+            lambda: decode_records(messages),
+        'decode_records, буфер':
+            lambda: decode_records(buffer, offsets),
+    }
+    for title, decode in cases.items():
+        seconds = min(timeit.repeat(decode, number=number, repeat=3))
+        print(f'{title:<28} {seconds / number / count * 1e6:8.2f} '
+              f'мкс/ответ')
+
+
+if __name__ == '__main__':
+    main()
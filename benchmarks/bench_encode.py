@@ -0,0 +1,38 @@
+"""
+Бенчмарк кодирования сообщений: пропускная способность и размер для
+сообщений из 1, 10 и 100 имён со сжатием имён и без него
+
+Запуск: python3 benchmarks/bench_encode.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+from dns.dns_enums import RRType  # noqa: E402
+from dns.dns_message import Query  # noqa: E402
+
+
+def _query(count):
+    query = Query('host0.zone.example.com')
+    for i in range(1, count):
+        query.add_question(f'host{i}.zone.example.com', RRType.A)
+    return query
+
+
+def main(number=500):
+    for count in (1, 10, 100):
+        query = _query(count)
+        for compress in (False, True):
+            size = len(query.to_bytes(compress=compress))
+            seconds = min(timeit.repeat(
+                lambda: query.to_bytes(compress=compress),
+                number=number, repeat=5)) / number
+            title = f'{count} имён, {"сжатие" if compress else "без сжатия"}'
+            print(f'{title:<24} {size:6d} байт {seconds * 1e6:10.2f} мкс '
+                  f'{1 / seconds:10.0f} сообщ/с')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""
+Бенчмарк памяти: разбор синтетического AXFR ответа на 100 000 записей
+
+Запуск: python3 benchmarks/bench_memory.py
+"""
+import os
+import sys
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+from benchmarks import _messages  # noqa: E402
+from dns.dns_message import Answer  # noqa: E402
+
+
+def main(count=100000):
+    messages = _messages.axfr_responses(count=count)
+
+    tracemalloc.start()
+    answers = [Answer.from_bytes(message) for message in messages]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    records = sum(len(answer.answers) for answer in answers)
+    print(f'записей: {records}')
+    print(f'занято после разбора: {current / 2 ** 20:8.2f} МиБ '
+          f'({current / records:.0f} байт/запись)')
+    print(f'пик: {peak / 2 ** 20:8.2f} МиБ')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Бенчмарк пропускной способности UDP к локальному эхо-серверу:
+последовательные запросы через UDPTransport против одновременных через
+UDPMultiplexer. Сервер отвечает с задержкой delay, имитируя RTT
+
+Запуск: python3 benchmarks/bench_multiplexer.py
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+from benchmarks.bench_udp import _echo_server  # noqa: E402
+from dns.dns_message import get_query_template  # noqa: E402
+from utils.transport import UDPMultiplexer, UDPTransport  # noqa: E402
+
+
+def main(count=2000, window=200, delay=0.005):
+    port = _echo_server(delay)
+    args = {'server': '127.0.0.1', 'port': port, 'timeout': 5}
+    queries = [get_query_template(f'host{i}.example.com').render()
+               for i in range(count)]
+
+    transport = UDPTransport()
+    started = time.perf_counter()
+    for query in queries:
+        transport.query(query, **args)
+    elapsed = time.perf_counter() - started
+    print(f'{"UDPTransport":<32} {count / elapsed:10.0f} запросов/с')
+
+    multiplexer = UDPMultiplexer()
+    started = time.perf_counter()
+    for start in range(0, count, window):
+        futures = [multiplexer.submit(query, **args)
+                   for query in queries[start:start + window]]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+    print(f'{f"UDPMultiplexer, {window} в полёте":<32} '
+          f'{count / elapsed:10.0f} запросов/с')
+    multiplexer.close()
+
+
+if __name__ == '__main__':
+    main()
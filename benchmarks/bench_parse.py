@@ -0,0 +1,42 @@
+"""
+Бенчмарк разбора ответов Answer.from_bytes
+
+Запуск: python3 benchmarks/bench_parse.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+from benchmarks import _messages  # noqa: E402
+from dns.dns_message import Answer  # noqa: E402
+
+
+CASES = {
+    'A, 1 запись': _messages.a_response(count=1),
+    'A, 200 записей': _messages.a_response(count=200),
+    'реферал, 13 NS + 13 glue': _messages.referral_response(),
+}
+
+
+def _lazy_referral(message):
+    answer = Answer.from_bytes(message, lazy=True)
+    return answer.header.answer_count, answer.authorities
+
+
+def main(number=2000):
+    for title, message in CASES.items():
+        seconds = min(timeit.repeat(lambda: Answer.from_bytes(message),
+                                    number=number, repeat=5))
+        print(f'{title:<28} {seconds / number * 1e6:10.2f} мкс/ответ')
+
+    message = CASES['реферал, 13 NS + 13 glue']
+    seconds = min(timeit.repeat(lambda: _lazy_referral(message),
+                                number=number, repeat=5))
+    print(f'{"реферал, lazy, только NS":<28} '
+          f'{seconds / number * 1e6:10.2f} мкс/ответ')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""
+Бенчмарк построения запроса: Query(...).to_bytes() против
+get_query_template(...).render()
+
+Запуск: python3 benchmarks/bench_query.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+from dns.dns_enums import RRType  # noqa: E402
+from dns.dns_message import Query, get_query_template  # noqa: E402
+
+
+def main(number=20000):
+    cases = {
+        'Query(...).to_bytes()':
+            lambda: Query('www.example.com', RRType.A).to_bytes(),
+        'get_query_template().render()':
+            lambda: get_query_template('www.example.com', RRType.A).render(),
+    }
+    for title, build in cases.items():
+        seconds = min(timeit.repeat(build, number=number, repeat=5))
+        print(f'{title:<32} {seconds / number * 1e6:8.2f} мкс/запрос')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""
+Микро-бенчмарк стоимости разбора одной записи в Answer.from_bytes
+
+Для каждого типа записи разбирается ответ из 1 и из 101 записи, разница
+делится на 100 - так из результата исключается разбор Header и вопроса
+
+Запуск: python3 benchmarks/bench_records.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+from benchmarks import _messages  # noqa: E402
+from dns.dns_message import Answer  # noqa: E402
+
+
+def _best(message, number):
+    return min(timeit.repeat(lambda: Answer.from_bytes(message),
+                             number=number, repeat=5)) / number
+
+
+def main(number=200):
+    base = _best(_messages.typed_response('A', 0), number * 100)
+    print(f'{"Header + Question":<18} {base * 1e6:10.2f} мкс')
+
+    for type_name in ('A', 'AAAA', 'NS', 'CNAME', 'MX', 'TXT', 'SOA'):
+        one = _best(_messages.typed_response(type_name, 1), number * 100)
+        many = _best(_messages.typed_response(type_name, 101), number)
+        print(f'{type_name:<18} {(many - one) / 100 * 1e6:10.2f} '
+              f'мкс/запись')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Бенчмарк TCP запросов к локальному эхо-серверу: новое соединение на каждый
+запрос против пула соединений TCPTransport
+
+Запуск: python3 benchmarks/bench_tcp.py
+"""
+import os
+import socket
+import struct
+import sys
+import threading
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+from utils.transport import TCPTransport, _FrameReader  # noqa: E402
+
+
+def _echo_server():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', 0))
+    server.listen(128)
+
+    def serve(connection):
+        with connection:
+            try:
+                for frame in _FrameReader(connection):
+                    connection.sendall(struct.pack('!H', len(frame))
+                                       + frame)
+            except OSError:
+                return
+
+    def accept():
+        while True:
+            connection, _ = server.accept()
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=serve, args=(connection,),
+                             daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def _connection_per_query(query, *, server, port, timeout):
+    with socket.create_connection((server, port), timeout) as s:
+        s.sendall(struct.pack('!H', len(query)) + query)
+        return _FrameReader(s).read_frame()
+
+
+def main(number=2000):
+    port = _echo_server()
+    args = {'server': '127.0.0.1', 'port': port, 'timeout': 2}
+    query = b'\x12\x34' + bytes(30)
+    transport = TCPTransport()
+
+    cases = {
+        'соединение на запрос': lambda: _connection_per_query(query, **args),
+        'TCPTransport': lambda: transport.query(query, **args),
+    }
+    for title, send in cases.items():
+        seconds = min(timeit.repeat(send, number=number, repeat=3))
+        print(f'{title:<22} {seconds / number * 1e6:8.2f} мкс/запрос')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Бенчмарк UDP запросов к локальному эхо-серверу: новый сокет на каждый
+запрос против переиспользуемого UDPTransport
+
+Запуск: python3 benchmarks/bench_udp.py
+"""
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+from utils.transport import UDPTransport  # noqa: E402
+
+
+def _echo_server(delay=0.0):
+    """
+    Локальный эхо-сервер; delay - искусственная задержка ответа (RTT)
+    """
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    server.bind(('127.0.0.1', 0))
+    delayed = queue.Queue()
+
+    def serve():
+        while True:
+            data, client = server.recvfrom(512)
+            if delay:
+                delayed.put((time.monotonic() + delay, data, client))
+            else:
+                server.sendto(data, client)
+
+    def send_delayed():
+        while True:
+            due, data, client = delayed.get()
+            time.sleep(max(0.0, due - time.monotonic()))
+            server.sendto(data, client)
+
+    threading.Thread(target=serve, daemon=True).start()
+    threading.Thread(target=send_delayed, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def _socket_per_query(query, *, server, port, timeout):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.settimeout(timeout)
+        s.sendto(query, (server, port))
+        return s.recv(1024)
+
+
+def main(number=5000):
+    port = _echo_server()
+    args = {'server': '127.0.0.1', 'port': port, 'timeout': 2}
+    query = b'\x12\x34' + bytes(30)
+    transport = UDPTransport()
+
+    cases = {
+        'сокет на запрос': lambda: _socket_per_query(query, **args),
+        'UDPTransport': lambda: transport.query(query, **args),
+    }
+    for title, send in cases.items():
+        seconds = min(timeit.repeat(send, number=number, repeat=3))
+        print(f'{title:<20} {seconds / number * 1e6:8.2f} мкс/запрос')
+
+
+if __name__ == '__main__':
+    main()
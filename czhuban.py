@@ -4,14 +4,54 @@ import sys  # pragma: no cover
 
 from utils import resolver  # pragma: no cover
 from utils import arg_parser  # pragma: no cover
-from utils.zhuban_exceptions import InvalidServerResponse  # pragma: no cover
+from utils.zhuban_exceptions import (  # pragma: no cover
+    InvalidServerResponse, ResolutionFailed, ZoneTransferRefused
+)
 from dns.dns_enums import RRType  # pragma: no cover
 
 
+def print_record(record):  # pragma: no cover
+    if record.type_ == RRType.A:
+        print('A', record.name, record.data.ip, sep='\t')
+    elif record.type_ == RRType.AAAA:
+        print('AAAA', record.name,
+              ipaddress.IPv6Address(record.data.ip).compressed, sep='\t')
+    elif record.type_ == RRType.PTR:
+        ip = record.name.strip('.in-addr.arpa').split('.')
+        print('PTR', '.'.join(reversed(ip)), record.data.name, sep='\t')
+    elif record.type_ == RRType.NS:
+        print('NS', record.data.name, sep='\t')
+    elif record.type_ == RRType.SOA:
+        print('SOA',
+              record.data.name_server,
+              record.data.email_addr,
+              record.data.serial_number,
+              record.data.refresh,
+              record.data.retry,
+              record.data.expiry,
+              record.data.nxdomain_ttl,
+              sep='\t')
+    elif record.type_ == RRType.TXT:
+        print('TXT', record.data.text, sep='\t')
+    elif record.type_ == RRType.MX:
+        print('MX', record.data.preference, record.data.name, sep='\t')
+    elif record.type_ == RRType.CNAME:
+        print('CNAME', record.data.cname, sep='\t')
+    elif record.type_ == RRType.DNAME:
+        print('DNAME', record.name, record.data.dname, sep='\t')
+    print()
+
+
 def main():  # pragma: no cover
     args = arg_parser.parse_args(sys.argv[1:])
 
     try:
+        if args.dump:
+            for record in resolver.stream_zone_dump(
+                    args.hostname, port=args.port, timeout=args.timeout):
+                print_record(record)
+            return
+
         answer = resolver.resolve(args)
 
     except socket.timeout:
@@ -23,40 +63,20 @@ def main():  # pragma: no cover
     except InvalidServerResponse:
         print("invalid server response", file=sys.stderr)
         sys.exit(1)
+    except ZoneTransferRefused:
+        print("zone transfer refused", file=sys.stderr)
+        sys.exit(1)
+    except ResolutionFailed:
+        print("resolution failed", file=sys.stderr)
+        sys.exit(1)
     except ConnectionError:
         print('connection-related error', file=sys.stderr)
         sys.exit(1)
 
     print('Server response:\n\t' + answer.header.response_type.name,
           end='\n\n')
-    for answer in answer.answers:
-        if answer.type_ == RRType.A:
-            print('A', answer.name, answer.data.ip, sep='\t')
-        elif answer.type_ == RRType.AAAA:
-            print('AAAA', answer.name,
-                  ipaddress.IPv6Address(answer.data.ip).compressed, sep='\t')
-        elif answer.type_ == RRType.PTR:
-            ip = answer.name.strip('.in-addr.arpa').split('.')
-            print('PTR', '.'.join(reversed(ip)), answer.data.name, sep='\t')
-        elif answer.type_ == RRType.NS:
-            print('NS', answer.data.name, sep='\t')
-        elif answer.type_ == RRType.SOA:
-            print('SOA',
-                  answer.data.name_server,
-                  answer.data.email_addr,
-                  answer.data.serial_number,
-                  answer.data.refresh,
-                  answer.data.retry,
-                  answer.data.expiry,
-                  answer.data.nxdomain_ttl,
-                  sep='\t')
-        elif answer.type_ == RRType.TXT:
-            print('TXT', answer.data.text, sep='\t')
-        elif answer.type_ == RRType.MX:
-            print('MX', answer.data.preference, answer.data.name, sep='\t')
-        elif answer.type_ == RRType.CNAME:
-            print('CNAME', answer.data.cname, sep='\t')
-        print()
+    for record in answer.answers:
+        print_record(record)
 
 
 if __name__ == '__main__':  # pragma: no cover
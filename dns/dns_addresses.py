@@ -0,0 +1,145 @@
+"""
+Векторизованное извлечение адресов из записей A и AAAA пакета ответов
+
+Требует numpy (необязательная зависимость). Адреса собираются в массивы
+numpy без создания строк: IPv4 - массив uint32 (порядок байт хоста),
+IPv6 - массив uint8 формы (N, 16). Строки, если нужны, получаются
+отдельно через ipv4_to_strings/ipv6_to_strings
+"""
+import struct
+
+from .dns_enums import RRType
+from .dns_message import _HEADER_FIELDS, _RR_FIXED_FIELDS, _skip_name
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+def _require_numpy():
+    """
+    Проверяет, что numpy установлен
+
+    :raise ImportError: если numpy не установлен
+    """
+    if np is None:
+        raise ImportError('Для векторизованного извлечения адресов '
+                          'требуется numpy')
+
+
+def _collect_address_offsets(buffer, starts):
+    """
+    Находит смещения RDATA записей A и AAAA раздела answers, не декодируя
+    имена и адреса. Невалидные сообщения пропускаются
+
+    :param buffer: непрерывный буфер с сообщениями
+    :param starts: индексы начала сообщений в buffer
+    :return: кортеж (смещения A, смещения AAAA) относительно buffer
+    """
+    view = memoryview(buffer)
+    ends = list(starts[1:]) + [len(view)]
+    rr_fixed_fields = _RR_FIXED_FIELDS.unpack_from
+    rr_fixed_size = _RR_FIXED_FIELDS.size
+    a_type = RRType.A.value
+    aaaa_type = RRType.AAAA.value
+
+    a_offsets = []
+    aaaa_offsets = []
+    for start, end in zip(starts, ends):
+        message = view[start:end]
+        message_a = []
+        message_aaaa = []
+        try:
+            _, _, qcount, anscount, _, _ = _HEADER_FIELDS.unpack_from(
+                message, 0)
+            offset = _HEADER_FIELDS.size
+            for _ in range(qcount):
+                offset = _skip_name(message, offset) + 4
+
+            for _ in range(anscount):
+                offset = _skip_name(message, offset)
+                type_, _, _, length = rr_fixed_fields(message, offset)
+                offset += rr_fixed_size
+                if offset + length > len(message):
+                    raise ValueError('RDATA выходит за границы сообщения')
+                if type_ == a_type and length == 4:
+                    message_a.append(start + offset)
+                elif type_ == aaaa_type and length == 16:
+                    message_aaaa.append(start + offset)
+                offset += length
+        except (IndexError, ValueError, struct.error):
+            continue
+        a_offsets.extend(message_a)
+        aaaa_offsets.extend(message_aaaa)
+
+    return a_offsets, aaaa_offsets
+
+
+def extract_addresses(messages, offsets=None):
+    """
+    Извлекает адреса всех записей A и AAAA из раздела answers пакета
+    ответов
+
+    :param messages: последовательность bytes либо один непрерывный буфер
+    :param offsets: индексы начала сообщений, если messages - один буфер
+    :raise ImportError: если numpy не установлен
+    :return: кортеж (numpy.ndarray uint32 формы (N,),
+    numpy.ndarray uint8 формы (M, 16))
+    """
+    _require_numpy()
+
+    if offsets is None:
+        messages = list(messages)
+        offsets = []
+        position = 0
+        for message in messages:
+            offsets.append(position)
+            position += len(message)
+        buffer = b''.join(messages)
+    else:
+        buffer = messages
+
+    a_offsets, aaaa_offsets = _collect_address_offsets(buffer, offsets)
+    data = np.frombuffer(buffer, dtype=np.uint8)
+
+    a_indices = (np.asarray(a_offsets, dtype=np.intp)[:, None]
+                 + np.arange(4, dtype=np.intp))
+    ipv4 = (np.ascontiguousarray(data[a_indices]).view('>u4')
+            .reshape(-1).astype(np.uint32))
+
+    aaaa_indices = (np.asarray(aaaa_offsets, dtype=np.intp)[:, None]
+                    + np.arange(16, dtype=np.intp))
+    ipv6 = data[aaaa_indices].reshape(-1, 16)
+
+    return ipv4, ipv6
+
+
+def ipv4_to_strings(ipv4) -> list:
+    """
+    Форматирует массив IPv4 адресов (uint32) в строки вида '1.2.3.4'
+
+    :param ipv4: массив uint32, например, из extract_addresses
+    :return: список строк
+    """
+    _require_numpy()
+
+    octets = np.asarray(ipv4, dtype='>u4').view(np.uint8).reshape(-1, 4)
+    return ['%d.%d.%d.%d' % tuple(row) for row in octets.tolist()]
+
+
+def ipv6_to_strings(ipv6) -> list:
+    """
+    Форматирует массив IPv6 адресов (N, 16) uint8 в строки в том же виде,
+    что и _AAAAResourceData.ip
+
+    :param ipv6: массив uint8 формы (N, 16), например, из extract_addresses
+    :return: список строк
+    """
+    _require_numpy()
+
+    result = []
+    for row in np.asarray(ipv6, dtype=np.uint8).reshape(-1, 16):
+        ip = row.tobytes().hex()
+        result.append(':'.join(ip[i:i + 4] for i in range(0, 32, 4)))
+    return result
@@ -22,6 +22,7 @@ class ResponseType(IntEnum):
     NAME_ERROR = 3
     NOT_IMPLEMENTED = 4
     REFUSED = 5
+    BAD_VERSION = 16
 
 
 @unique
@@ -30,12 +31,15 @@ class RRType(IntEnum):
     NS = 2
     AAAA = 28
     CNAME = 5
+    DNAME = 39
+    OPT = 41
     SOA = 6
     WKS = 11
     PTR = 12
     HINFO = 13
     MX = 15
     TXT = 16
+    IXFR = 251
     AXFR = 252
 
 
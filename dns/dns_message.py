@@ -1,3 +1,4 @@
+import functools
 import random
 import struct
 from collections import namedtuple
@@ -12,6 +13,25 @@ from utils.zhuban_exceptions import (
 
 _MAX_DOUBLE_BYTE_NUMBER = 65535
 
+_UNSIGNED_SHORT = struct.Struct('!H')
+_HEADER_FIELDS = struct.Struct('!6H')
+_RR_FIXED_FIELDS = struct.Struct('!HHIH')
+_SOA_FIXED_FIELDS = struct.Struct('!5I')
+_OPT_OPTION_FIELDS = struct.Struct('!HH')
+
+_MIN_PAYLOAD_SIZE = 512
+
+_MESSAGE_TYPES = {t.value: t for t in MessageType}
+_QUERY_TYPES = {t.value: t for t in QueryType}
+_RESPONSE_TYPES = {t.value: t for t in ResponseType}
+_RR_TYPES = {t.value: t for t in RRType}
+_RR_CLASSES = {c.value: c for c in RRClass}
+
+_DecodedName = namedtuple('decoded_name', ['decoded_', 'offset'])
+_HeaderWrapper = namedtuple('header_wrapper', ['header', 'offset'])
+_QuestionWrapper = namedtuple('question_wrapper', ['question', 'offset'])
+_RRWrapper = namedtuple('rr_wrapper', ['resource_record', 'offset'])
+
 
 def _encode_number(number: int) -> bytes:
     """
@@ -21,70 +41,179 @@ def _encode_number(number: int) -> bytes:
     :raise ValueError: если число не поместиться в 2 байта
     :return: закодированное число
     """
-    if 0 <= number < _MAX_DOUBLE_BYTE_NUMBER:
+    if 0 <= number <= _MAX_DOUBLE_BYTE_NUMBER:
         return struct.pack('!H', number)
 
     raise ValueError("Число не помещается в 2 байта")
 
 
-def _decode_number(in_bytes: bytes) -> int:
+def _decode_number(in_bytes: bytes, offset: int = 0) -> int:
     """
     Декодирует целое число из 2 байтового представления in_bytes
 
-    :param in_bytes: объект bytes, содержащий число
+    :param in_bytes: объект bytes (или memoryview), содержащий число
+    :param offset: индекс первого байта числа в in_bytes
     :return: декодированное число
     """
 
-    return struct.unpack('!H', in_bytes)[0]
+    return _UNSIGNED_SHORT.unpack_from(in_bytes, offset)[0]
 
 
-def _encode_name(name: str) -> bytes:
+def _encode_name(name: str, compression: dict = None,
+                 offset: int = 0) -> bytes:
     """
     Кодирует строку в байты в формате предназначенном для DNS
 
+    Если передан compression - таблица уже закодированных в сообщении
+    суффиксов (суффикс в нижнем регистре -> смещение), то имя сжимается
+    по RFC 1035 (4.1.4): самый длинный известный суффикс заменяется
+    указателем, а новые суффиксы добавляются в таблицу
+
     :param name: строка для кодирования
+    :param compression: таблица суффиксов сообщения
+    :param offset: смещение имени от начала сообщения
     :return: объект bytes содержащий строку
     """
-    domains = name.split('.')
+    domains = name.rstrip('.').split('.') if name.rstrip('.') else []
     domains_in_bytes = []
-    for d in domains:
+    for i, d in enumerate(domains):
+        if compression is not None:
+            suffix = '.'.join(domains[i:]).lower()
+            pointer = compression.get(suffix)
+            if pointer is not None:
+                domains_in_bytes.append(_encode_number(0xC000 | pointer))
+                break
+            if offset < 0x4000:
+                compression[suffix] = offset
+            offset += len(d) + 1
+
         domains_in_bytes.append(struct.pack('!B', len(d)))
         domains_in_bytes.append(d.encode())
-
-    domains_in_bytes.append(b'\x00')
+    else:
+        domains_in_bytes.append(b'\x00')
 
     return b''.join(domains_in_bytes)
 
 
-def _decode_name(in_bytes: bytes, offset: int):
+def _encode_sections(header, *sections, compress=True) -> bytes:
+    """
+    Кодирует DNS сообщение: Header и следующие за ним разделы
+
+    :param _Header header: заголовок сообщения
+    :param sections: списки _Question/_ResourceRecord в порядке разделов
+    :param bool compress: сжимать ли имена (RFC 1035, 4.1.4)
+    :return: объект bytes содержащий сообщение
+    """
+    encoded_tokens = [header.to_bytes()]
+    compression = {} if compress else None
+    offset = _HEADER_FIELDS.size
+    for section in sections:
+        for entry in section:
+            entry_bytes = entry.to_bytes(compression, offset)
+            encoded_tokens.append(entry_bytes)
+            offset += len(entry_bytes)
+
+    return b''.join(encoded_tokens)
+
+
+def _decode_name(in_bytes: bytes, offset: int, names: dict = None):
     """
     Декодирует доменное имя из байтов, содержащих DNS сообщение
 
+    Метки декодируются прямо из буфера, без промежуточных копий, поэтому
+    in_bytes может быть как bytes, так и memoryview
+
+    Если передан names - кэш уже декодированных суффиксов этого сообщения
+    (смещение метки -> имя начиная с неё), то декодирование останавливается
+    на первом известном суффиксе, а все новые суффиксы сохраняются в names.
+    Так каждая цепочка меток декодируется не более одного раза за сообщение
+
+    Указатель сжатия должен вести строго назад, в начало уже прочитанной
+    части сообщения (RFC 1035, 4.1.4), иначе сообщение невалидно: так
+    зацикленные указатели не приводят к бесконечному циклу
+
     :param in_bytes: байтовое представление Query/Answer
     :param offset: индекс первого байта строки в in_bytes
+    :param names: кэш декодированных суффиксов сообщения
+    :raise InvalidAnswer: если указатель сжатия ведёт не назад
     :return: namedtuple('decoded_name', ['decoded_', 'offset'])
     """
-    index = offset
+    index = start = offset
     offset = 0
     decoded_tokens = []
-    while in_bytes[index]:
+    label_offsets = []
+    suffix = None
+    while True:
+        if names is not None:
+            suffix = names.get(index)
+            if suffix is not None:
+                break
+
         current_byte = in_bytes[index]
+        if not current_byte:
+            break
         if current_byte >> 6 == 3:
             if offset == 0:
                 offset = index + 2
-            index = _decode_number(in_bytes[index:index + 2]) ^ (3 << 14)
+            index = _decode_number(in_bytes, index) & 0x3FFF
+            if index >= start:
+                raise InvalidAnswer
+            start = index
         else:
+            label_offsets.append(index)
             decoded_tokens.append(
-                in_bytes[index + 1:index + 1 + current_byte].decode('utf-8'))
+                str(in_bytes[index + 1:index + 1 + current_byte], 'utf-8'))
             index += current_byte + 1
     if offset == 0:
-        offset = index + 1
+        offset = index + 1 if suffix is None else _skip_name(in_bytes, index)
+
+    if names is None:
+        return _DecodedName('.'.join(decoded_tokens), offset)
+
+    decoded = suffix or ''
+    for label_offset, token in zip(reversed(label_offsets),
+                                   reversed(decoded_tokens)):
+        decoded = f'{token}.{decoded}' if decoded else token
+        names[label_offset] = decoded
+    if suffix is None:
+        names[index] = ''
+
+    return _DecodedName(decoded, offset)
+
+
+def _skip_name(in_bytes: bytes, offset: int) -> int:
+    """
+    Пропускает доменное имя, не декодируя его
+
+    :param in_bytes: байтовое представление Query/Answer
+    :param offset: индекс первого байта имени в in_bytes
+    :raise IndexError: если имя выходит за границы in_bytes
+    :return: индекс первого байта после имени
+    """
+    while True:
+        length = in_bytes[offset]
+        if length >> 6 == 3:
+            return offset + 2
+        if not length:
+            return offset + 1
+        offset += length + 1
 
-    decoded = '.'.join(decoded_tokens)
 
-    decoded_name = namedtuple('decoded_name', ['decoded_', 'offset'])
+def _skip_resource_record(in_bytes: bytes, offset: int) -> int:
+    """
+    Пропускает ResourceRecord, не декодируя его
 
-    return decoded_name(decoded, offset)
+    :param in_bytes: байтовое представление Query/Answer
+    :param offset: индекс первого байта ResourceRecord в in_bytes
+    :raise ValueError: если запись выходит за границы in_bytes
+    :return: индекс первого байта после ResourceRecord
+    """
+    offset = _skip_name(in_bytes, offset)
+    length = _decode_number(in_bytes, offset + 8)
+    offset += _RR_FIXED_FIELDS.size + length
+    if offset > len(in_bytes):
+        raise ValueError('ResourceRecord выходит за границы сообщения')
+    return offset
 
 
 def _get_identifier() -> int:
@@ -100,34 +229,128 @@ class Query:
     Класс для представления DNS-запроса
     """
 
+    __slots__ = ('header', 'questions', 'answers', 'authorities',
+                 'additions')
+
     def __init__(self, hostname: str,
                  rr_type: RRType = RRType.A,
-                 is_recursion_desired=True):
+                 is_recursion_desired=True, payload_size=None):
         """
         Инициализирует Query
 
         :param hostname: доменное имя требуемой DNS записи
         :param rr_type: тип запрашиваемой DNS записи
         :param is_recursion_desired: требуется ли рекурсия
+        :param payload_size: размер UDP ответа, который готов принять
+        клиент (EDNS0, RFC 6891). Если задан, в additions добавляется OPT
+        запись
         """
         self.header = _Header(
             _get_identifier(), MessageType.QUERY, 1, QueryType.STANDARD,
             is_recursion_desired=is_recursion_desired)
 
-        self.question = _Question(hostname, rr_type)
+        self.questions = [_Question(hostname, rr_type)]
+        self.answers = []
+        self.authorities = []
+        self.additions = []
+        if payload_size is not None:
+            self.additions.append(_make_opt_record(payload_size))
 
     def __str__(self):  # pragma: no cover
+        questions = '\n\t'.join(str(q) for q in self.questions)
         return (f'Header:\n\t{self.header}\n'
-                f'Question:\n\t{self.question}\n')
+                f'Questions:\n\t{questions}\n')
+
+    @property
+    def question(self):
+        return self.questions[0]
 
-    def to_bytes(self) -> bytes:
+    def add_question(self, hostname: str, rr_type: RRType = RRType.A):
+        """
+        Добавляет в Query ещё один вопрос
+
+        :param hostname: доменное имя требуемой DNS записи
+        :param rr_type: тип запрашиваемой DNS записи
+        """
+        self.questions.append(_Question(hostname, rr_type))
+        self.header.question_count = len(self.questions)
+
+    def to_bytes(self, *, compress=True) -> bytes:
         """
         Кодирует Query в байты
 
+        Кроме вопросов кодируются и записи answers, authorities и
+        additions (нужны, например, для IXFR и UPDATE сообщений), счётчики
+        Header'а приводятся к размерам разделов
+
+        :param bool compress: сжимать ли имена (RFC 1035, 4.1.4)
         :return: объект bytes содержащий Query
         """
+        self.header.question_count = len(self.questions)
+        self.header.answer_count = len(self.answers)
+        self.header.authority_count = len(self.authorities)
+        self.header.additional_count = len(self.additions)
+
+        return _encode_sections(self.header, self.questions, self.answers,
+                                self.authorities, self.additions,
+                                compress=compress)
+
+
+class QueryTemplate:
+    """
+    Заранее закодированный Query, в который при каждой отправке
+    подставляется только идентификатор
+    """
+
+    __slots__ = ('_wire',)
+
+    def __init__(self, hostname: str,
+                 rr_type: RRType = RRType.A,
+                 is_recursion_desired=True, payload_size=None):
+        """
+        Инициализирует QueryTemplate
+
+        :param hostname: доменное имя требуемой DNS записи
+        :param rr_type: тип запрашиваемой DNS записи
+        :param is_recursion_desired: требуется ли рекурсия
+        :param payload_size: размер UDP ответа для OPT записи (EDNS0)
+        """
+        self._wire = bytes(Query(hostname, rr_type, is_recursion_desired,
+                                 payload_size).to_bytes())
+
+    def render(self, identifier: int = None) -> bytearray:
+        """
+        Возвращает готовый к отправке Query с заданным идентификатором
+
+        :param identifier: идентификатор (по умолчанию случайный)
+        :return: объект bytearray содержащий Query
+        """
+        if identifier is None:
+            identifier = _get_identifier()
 
-        return self.header.to_bytes() + self.question.to_bytes()
+        query = bytearray(self._wire)
+        _UNSIGNED_SHORT.pack_into(query, 0, identifier)
+
+        return query
+
+
+@functools.lru_cache(maxsize=4096)
+def get_query_template(hostname: str,
+                       rr_type: RRType = RRType.A,
+                       is_recursion_desired=True,
+                       payload_size=None) -> QueryTemplate:
+    """
+    Возвращает закэшированный QueryTemplate для (hostname, rr_type, флаги,
+    payload_size)
+
+    :param hostname: доменное имя требуемой DNS записи
+    :param rr_type: тип запрашиваемой DNS записи
+    :param is_recursion_desired: требуется ли рекурсия
+    :param payload_size: размер UDP ответа для OPT записи (EDNS0)
+    :return: объект QueryTemplate
+    """
+    return QueryTemplate(hostname, rr_type, is_recursion_desired,
+                         payload_size)
 
 
 class Answer:
@@ -135,6 +358,9 @@ class Answer:
     Класс для представления ответа от DNS-сервера
     """
 
+    __slots__ = ('header', 'questions', '_answers', '_authorities',
+                 '_additions', '_in_bytes', '_record_offsets', '_names')
+
     def __init__(self, header, questions, answers, authorities, additions):
         """
         Инициализирует Answer
@@ -147,9 +373,12 @@ class Answer:
         """
         self.header = header
         self.questions = questions
-        self.answers = answers
-        self.authorities = authorities
-        self.additions = additions
+        self._answers = answers
+        self._authorities = authorities
+        self._additions = additions
+        self._in_bytes = None
+        self._record_offsets = None
+        self._names = None
 
     def __str__(self):  # pragma: no cover
         questions = '\n\t'.join(str(q) for q in self.questions)
@@ -165,36 +394,160 @@ class Answer:
                 f'Authorities:\n\t{authorities}\n'
                 f'Additions:\n\t{additions}\n')
 
+    def to_bytes(self, *, compress=True) -> bytes:
+        """
+        Кодирует Answer в байты (например, для синтезированных ответов)
+
+        Счётчики Header'а приводятся к размерам разделов
+
+        :param bool compress: сжимать ли имена (RFC 1035, 4.1.4)
+        :return: объект bytes содержащий Answer
+        """
+        self.header.question_count = len(self.questions)
+        self.header.answer_count = len(self.answers)
+        self.header.authority_count = len(self.authorities)
+        self.header.additional_count = len(self.additions)
+
+        return _encode_sections(self.header, self.questions, self.answers,
+                                self.authorities, self.additions,
+                                compress=compress)
+
+    @property
+    def answers(self):
+        if self._answers is None:
+            self._answers = self._decode_section(0)
+        return self._answers
+
+    @property
+    def authorities(self):
+        if self._authorities is None:
+            self._authorities = self._decode_section(1)
+        return self._authorities
+
+    @property
+    def additions(self):
+        if self._additions is None:
+            self._additions = self._decode_section(2)
+        return self._additions
+
+    @property
+    def opt(self):
+        """
+        OPT запись ответа (EDNS0) либо None, если сервер не поддерживает
+        EDNS0
+        """
+        for record in self.additions:
+            if record.type_ == RRType.OPT:
+                return record
+        return None
+
+    @property
+    def payload_size(self) -> int:
+        """
+        Размер UDP ответа, который готов принять отправитель (по умолчанию
+        512 байт, RFC 1035 2.3.4)
+        """
+        opt = self.opt
+        if opt is None:
+            return _MIN_PAYLOAD_SIZE
+        return max(opt.class_, _MIN_PAYLOAD_SIZE)
+
+    @property
+    def response_code(self):
+        """
+        Полный код ответа: RCODE из Header'а, дополненный старшими битами
+        из OPT записи (RFC 6891, 6.1.3)
+
+        :return: ResponseType либо int для неизвестных кодов
+        """
+        code = self.header.response_type
+        opt = self.opt
+        if opt is not None:
+            code |= (opt.ttl >> 24) << 4
+        return _RESPONSE_TYPES.get(code, code)
+
+    def _decode_section(self, section):
+        """
+        Декодирует ResourceRecord'ы раздела ленивого Answer по сохранённым
+        смещениям
+
+        :param int section: номер раздела (0 - answers, 1 - authorities,
+        2 - additions)
+        :raise InvalidAnswer: если записи раздела не удалось декодировать
+        :return: список _ResourceRecord раздела
+        """
+        try:
+            return [
+                _ResourceRecord.from_bytes(
+                    self._in_bytes, offset, self._names).resource_record
+                for offset in self._record_offsets[section]]
+        except Exception as e:
+            raise InvalidAnswer from e
+
     @classmethod
-    def from_bytes(cls, in_bytes):
+    def from_bytes(cls, in_bytes, *, lazy=False):
         """
         Создаёт Answer из объекта bytes, содержащего Answer
 
+        Разбор идёт по одному memoryview над in_bytes: поля читаются через
+        struct.unpack_from по смещениям, а байты копируются только при
+        материализации конкретного значения (метки, текст)
+
+        В ленивом режиме (lazy=True) сразу декодируются только Header и
+        вопросы, для остальных разделов запоминаются смещения записей, а
+        сами записи декодируются при первом обращении к answers,
+        authorities или additions. Такой Answer держит ссылку на in_bytes
+
+        Все имена сообщения декодируются через общий кэш суффиксов (см.
+        _decode_name), поэтому общий суффикс, на который ссылаются
+        несколько записей, декодируется один раз
+
         :param bytes in_bytes: объект bytes, содержащий Answer
+        :param bool lazy: откладывать ли декодирование записей
         :return: объект Answer, декодированный из in_bytes
         """
         try:
+            in_bytes = memoryview(in_bytes)
+            names = {}
             header, offset = _Header.from_bytes(in_bytes, 0)
             questions = []
             for _ in range(header.question_count):
-                question, offset = _Question.from_bytes(in_bytes, offset)
+                question, offset = _Question.from_bytes(
+                    in_bytes, offset, names)
                 questions.append(question)
 
+            if lazy:
+                record_offsets = []
+                for count in (header.answer_count, header.authority_count,
+                              header.additional_count):
+                    section = []
+                    for _ in range(count):
+                        section.append(offset)
+                        offset = _skip_resource_record(in_bytes, offset)
+                    record_offsets.append(section)
+
+                answer = cls(header, questions, None, None, None)
+                answer._in_bytes = in_bytes
+                answer._record_offsets = record_offsets
+                answer._names = names
+                return answer
+
             answers = []
             for _ in range(header.answer_count):
-                answer, offset = _ResourceRecord.from_bytes(in_bytes, offset)
+                answer, offset = _ResourceRecord.from_bytes(
+                    in_bytes, offset, names)
                 answers.append(answer)
 
             authorities = []
             for _ in range(header.authority_count):
                 authority, offset = _ResourceRecord.from_bytes(
-                    in_bytes, offset)
+                    in_bytes, offset, names)
                 authorities.append(authority)
 
             additions = []
             for _ in range(header.additional_count):
                 additional, offset = _ResourceRecord.from_bytes(
-                    in_bytes, offset)
+                    in_bytes, offset, names)
                 additions.append(additional)
         except Exception as e:
             raise InvalidAnswer from e
@@ -207,6 +560,11 @@ class _Header:
     Класс для заголовка DNS сообщения
     """
 
+    __slots__ = ('identifier', 'message_type', 'query_type',
+                 'is_authority_answer', 'is_truncated', 'is_recursion_desired',
+                 'is_recursion_available', 'response_type', 'question_count',
+                 'answer_count', 'authority_count', 'additional_count')
+
     def __init__(
             self, identifier, message_type, question_count,
             query_type=QueryType.STANDARD, is_authority_answer=False,
@@ -309,17 +667,11 @@ class _Header:
         :param int beginning: индекс начала Header внутри Query/Answer
         :return: объект namedtuple, содержащий Header и offset
         """
-        offset = beginning
-
-        identifier_in_bytes = in_bytes[offset:offset + 2]
-        offset += 2
-        identifier = _decode_number(identifier_in_bytes)
+        (identifier, flags, qcount, anscount,
+         authcount, addcount) = _HEADER_FIELDS.unpack_from(in_bytes, beginning)
+        offset = beginning + _HEADER_FIELDS.size
 
-        flags_in_bytes = in_bytes[offset:offset + 2]
-        offset += 2
-        flags = int.from_bytes(flags_in_bytes, byteorder='big')
-
-        response_type = ResponseType(flags & 15)
+        response_type = _RESPONSE_TYPES[flags & 15]
 
         is_recursion_available = bool(flags & 0x80)
 
@@ -330,28 +682,10 @@ class _Header:
         is_authority_answer = bool(flags & 0x400)
 
         flags >>= 11
-        query_type = QueryType(flags & 15)
+        query_type = _QUERY_TYPES[flags & 15]
         flags >>= 4
 
-        message_type = MessageType(flags & 1)
-
-        qcount_in_bytes = in_bytes[offset:offset + 2]
-        offset += 2
-        qcount = _decode_number(qcount_in_bytes)
-
-        anscount_in_bytes = in_bytes[offset:offset + 2]
-        offset += 2
-        anscount = _decode_number(anscount_in_bytes)
-
-        authcount_in_bytes = in_bytes[offset:offset + 2]
-        offset += 2
-        authcount = _decode_number(authcount_in_bytes)
-
-        addcount_in_bytes = in_bytes[offset:offset + 2]
-        offset += 2
-        addcount = _decode_number(addcount_in_bytes)
-
-        header_wrapper = namedtuple('Header', ['header', 'offset'])
+        message_type = _MESSAGE_TYPES[flags & 1]
 
         header = cls(
             identifier, message_type, qcount, query_type=query_type,
@@ -361,7 +695,7 @@ class _Header:
             response_type=response_type, answer_count=anscount,
             authority_count=authcount, additional_count=addcount)
 
-        return header_wrapper(header, offset)
+        return _HeaderWrapper(header, offset)
 
 
 class _Question:
@@ -369,6 +703,8 @@ class _Question:
     Класс для вопроса DNS сообщения
     """
 
+    __slots__ = ('name', 'type_', 'class_')
+
     def __init__(self, name, type_=RRType.A):
         """
         Инициализирует Question
@@ -387,14 +723,16 @@ class _Question:
                 f'Тип требуемой записи (QTYPE): {qtype}\n\t'
                 f'Класс запроса (QCLASS): {qclass}\n')
 
-    def to_bytes(self):
+    def to_bytes(self, compression=None, offset=0):
         """
         Кодирует Question сообщения в байты
 
+        :param dict compression: таблица суффиксов для сжатия имён
+        :param int offset: смещение Question от начала сообщения
         :return: объект bytes содержащий Question
         """
         encoded_tokens = [
-            _encode_name(self.name),
+            _encode_name(self.name, compression, offset),
             _encode_number(self.type_.value),
             _encode_number(self.class_.value)
         ]
@@ -402,22 +740,20 @@ class _Question:
         return b''.join(encoded_tokens)
 
     @classmethod
-    def from_bytes(cls, in_bytes, beginning):
+    def from_bytes(cls, in_bytes, beginning, names=None):
         """
         Создаёт Question из объекта bytes, содержащего Query/Answer
 
         :param bytes in_bytes: объект bytes, содержащий Query/Answer
         :param int beginning: индекс начала Question внутри Query/Answer
+        :param dict names: кэш декодированных имён сообщения
         :return: объект namedtuple, содержащий Question и offset
         """
-        name, offset = _decode_name(in_bytes, beginning)
-        type_ = RRType(_decode_number(in_bytes[offset:offset + 2]))
+        name, offset = _decode_name(in_bytes, beginning, names)
+        type_ = _RR_TYPES[_decode_number(in_bytes, offset)]
         offset += (2 + 2)
 
-        question_wrapper = namedtuple(
-            'question_wrapper', ['question', 'offset'])
-
-        return question_wrapper(cls(name, type_=type_), offset)
+        return _QuestionWrapper(cls(name, type_=type_), offset)
 
 
 class _AResourceData:
@@ -425,92 +761,107 @@ class _AResourceData:
     Класс для данных DNS записи типа A (IPv4)
     """
 
+    __slots__ = ('ip',)
+
     def __init__(self, in_bytes):
         """
         Инициализирует AResourceData
 
         :param bytes in_bytes: 4 байта, содержащие ip address
         """
-        ip = struct.unpack('BBBB', in_bytes)
-        self.ip = '.'.join(map(str, ip))
+        self.ip = '%d.%d.%d.%d' % struct.unpack('BBBB', in_bytes)
 
     def __str__(self):  # pragma: no cover
         return f'IPv4 адрес (ADDRESS): {self.ip}\n'
 
+    def to_bytes(self, compression=None, offset=0):
+        return bytes(map(int, self.ip.split('.')))
+
 
 class _AAAAResourceData:
     """
     Класс для данных DNS записи типа AAAA (IPv6)
     """
 
+    __slots__ = ('ip',)
+
     def __init__(self, in_bytes):
         """
         Инициализирует AAAAResourceData
 
-        :param bytes in_bytes: 32 байта, содержащие ip address
+        :param bytes in_bytes: 16 байт, содержащие ip address
         """
-        ip = [in_bytes[i:i + 2] for i in range(0, len(in_bytes), 2)]
-        self.ip = ':'.join(map(bytes.hex, ip))
+        ip = in_bytes.hex()
+        self.ip = ':'.join(ip[i:i + 4] for i in range(0, len(ip), 4))
 
     def __str__(self):  # pragma: no cover
         return f'IPv6 адрес (ADDRESS): {self.ip}\n\t'
 
+    def to_bytes(self, compression=None, offset=0):
+        return bytes.fromhex(self.ip.replace(':', ''))
+
 
 class _PTRResourceData:
     """
     Класс для данных DNS записи типа PTR
     """
 
-    def __init__(self, in_bytes):
+    __slots__ = ('name',)
+
+    def __init__(self, in_bytes, offset=0, names=None):
         """
         Инициализирует PTRResourceData
 
         :param bytes in_bytes: байты содержащие domain_name
+        :param int offset: индекс первого байта domain_name в in_bytes
+        :param dict names: кэш декодированных имён сообщения
         """
-        self.name = _decode_name(in_bytes, 0).decoded_
+        self.name = _decode_name(in_bytes, offset, names).decoded_
 
     def __str__(self):  # pragma: no cover
         return f'Доменное имя (PTRDNAME): {self.name}\n'
 
+    def to_bytes(self, compression=None, offset=0):
+        return _encode_name(self.name, compression, offset)
+
 
 class _NSResourceData:
     """
     Класс для данных DNS записи типа NS
     """
 
-    def __init__(self, in_bytes, offset):
+    __slots__ = ('name',)
+
+    def __init__(self, in_bytes, offset, names=None):
         """
         Инициализирует NSResourceData
 
         :param bytes in_bytes:
+        :param dict names: кэш декодированных имён сообщения
         """
-        self.name = _decode_name(in_bytes, offset).decoded_
+        self.name = _decode_name(in_bytes, offset, names).decoded_
 
     def __str__(self):  # pragma: no cover
         return f'Авторитетный сервер разрешения имен (NSDNAME): {self.name}\n'
 
+    def to_bytes(self, compression=None, offset=0):
+        return _encode_name(self.name, compression, offset)
+
 
 class _SOAResourceData:
     """
     Класс для данных DNS записи типа SOA
     """
 
-    def __init__(self, in_bytes, offset):
-        self.name_server, offset = _decode_name(in_bytes, offset)
-        self.email_addr, offset = _decode_name(in_bytes, offset)
-
-        serial_number = in_bytes[offset:offset + 4]
-        refresh = in_bytes[offset + 4:offset + 8]
-        retry = in_bytes[offset + 8:offset + 12]
-        expiry = in_bytes[offset + 12:offset + 16]
-        nxdomain_ttl = in_bytes[offset + 16:offset + 20]
-
-        fmt = '!I'
-        self.serial_number = struct.unpack(fmt, serial_number)[0]
-        self.refresh = struct.unpack(fmt, refresh)[0]
-        self.retry = struct.unpack(fmt, retry)[0]
-        self.expiry = struct.unpack(fmt, expiry)[0]
-        self.nxdomain_ttl = struct.unpack(fmt, nxdomain_ttl)[0]
+    __slots__ = ('name_server', 'email_addr', 'serial_number', 'refresh',
+                 'retry', 'expiry', 'nxdomain_ttl')
+
+    def __init__(self, in_bytes, offset, names=None):
+        self.name_server, offset = _decode_name(in_bytes, offset, names)
+        self.email_addr, offset = _decode_name(in_bytes, offset, names)
+
+        (self.serial_number, self.refresh, self.retry, self.expiry,
+         self.nxdomain_ttl) = _SOA_FIXED_FIELDS.unpack_from(in_bytes, offset)
 
     def __str__(self):  # pragma: no cover
         return (f'Мастер сервер зоны (MNAME): {self.name_server}\n\t\t'
@@ -526,51 +877,162 @@ class _SOAResourceData:
                 f'Минимальный TTL, который должен быть экспортирован с '
                 f'любой записью из зоны (MINIMUM): {self.nxdomain_ttl}\n\t\t')
 
+    def to_bytes(self, compression=None, offset=0):
+        name_server = _encode_name(self.name_server, compression, offset)
+        email_addr = _encode_name(self.email_addr, compression,
+                                  offset + len(name_server))
+        return name_server + email_addr + _SOA_FIXED_FIELDS.pack(
+            self.serial_number, self.refresh, self.retry, self.expiry,
+            self.nxdomain_ttl)
+
 
 class _TXTResourceData:
     """
     Класс для данных DNS записи типа TXT
     """
 
+    __slots__ = ('text',)
+
     def __init__(self, in_bytes, offset):
-        length = struct.unpack('!B', in_bytes[offset: offset + 1])[0]
-        self.text = in_bytes[offset + 1: offset + 1 + length].decode('utf-8')
+        length = in_bytes[offset]
+        self.text = str(in_bytes[offset + 1: offset + 1 + length], 'utf-8')
 
     def __str__(self):  # pragma: no cover
         return f'Текст (TXT-DATA): {self.text}'
 
+    def to_bytes(self, compression=None, offset=0):
+        text = self.text.encode('utf-8')
+        return struct.pack('!B', len(text)) + text
+
 
 class _MXResourceData:
     """
     Класс для данных DNS записи типа MX
     """
 
-    def __init__(self, in_bytes, offset):
-        self.preference = _decode_number(in_bytes[offset: offset + 2])
-        self.name = _decode_name(in_bytes, offset + 2)[0]
+    __slots__ = ('preference', 'name')
+
+    def __init__(self, in_bytes, offset, names=None):
+        self.preference = _decode_number(in_bytes, offset)
+        self.name = _decode_name(in_bytes, offset + 2, names)[0]
 
     def __str__(self):  # pragma: no cover
         return (f'Приоритет записи (PREFERENCE): {self.preference}\n\t\t'
                 f'Домен почтового сервера (EXCHANGE): {self.name}\n\t\t')
 
+    def to_bytes(self, compression=None, offset=0):
+        return (_encode_number(self.preference)
+                + _encode_name(self.name, compression, offset + 2))
+
 
 class _CNAMEResourceData:
     """
     Класс для представления DNS записи типа CNAME
     """
 
-    def __init__(self, in_bytes, offset):
-        self.cname = _decode_name(in_bytes, offset).decoded_
+    __slots__ = ('cname',)
+
+    def __init__(self, in_bytes, offset, names=None):
+        self.cname = _decode_name(in_bytes, offset, names).decoded_
 
     def __str__(self):  # pragma: no cover
         return f'Каноническое имя (CNAME): {self.cname}\n'
 
+    def to_bytes(self, compression=None, offset=0):
+        return _encode_name(self.cname, compression, offset)
+
+
+class _DNAMEResourceData:
+    """
+    Класс для представления DNS записи типа DNAME (RFC 6672)
+    """
+
+    __slots__ = ('dname',)
+
+    def __init__(self, in_bytes, offset, names=None):
+        self.dname = _decode_name(in_bytes, offset, names).decoded_
+
+    def __str__(self):  # pragma: no cover
+        return f'Замена суффикса имени (DNAME): {self.dname}\n'
+
+    def to_bytes(self, compression=None, offset=0):
+        # Имя в DNAME не сжимается (RFC 6672, 2.5)
+        return _encode_name(self.dname)
+
+
+class _OPTResourceData:
+    """
+    Класс для данных OPT записи (EDNS0, RFC 6891): список опций вида
+    (код, данные)
+    """
+
+    __slots__ = ('options',)
+
+    def __init__(self, options=None):
+        """
+        Инициализирует OPTResourceData
+
+        :param options: список кортежей (код опции, bytes с данными)
+        """
+        self.options = options if options is not None else []
+
+    def __str__(self):  # pragma: no cover
+        options = ', '.join(f'{code}: {data.hex()}'
+                            for code, data in self.options)
+        return f'Опции (OPTIONS): {options}\n'
+
+    def to_bytes(self, compression=None, offset=0):
+        return b''.join(
+            _OPT_OPTION_FIELDS.pack(code, len(data)) + data
+            for code, data in self.options)
+
+    @classmethod
+    def from_bytes(cls, in_bytes):
+        """
+        Создаёт OPTResourceData из RDATA OPT записи
+
+        :param in_bytes: RDATA OPT записи
+        :raise ValueError: если опция выходит за границы RDATA
+        :return: объект _OPTResourceData
+        """
+        options = []
+        offset = 0
+        while offset < len(in_bytes):
+            code, length = _OPT_OPTION_FIELDS.unpack_from(in_bytes, offset)
+            offset += _OPT_OPTION_FIELDS.size
+            if offset + length > len(in_bytes):
+                raise ValueError('Опция выходит за границы OPT записи')
+            options.append((code, bytes(in_bytes[offset:offset + length])))
+            offset += length
+
+        return cls(options)
+
+
+class _UnknownResourceData:
+    """
+    Класс для данных DNS записи неподдерживаемого типа: RDATA хранятся
+    как есть (RFC 3597)
+    """
+
+    __slots__ = ('data',)
+
+    def __init__(self, in_bytes):
+        self.data = bytes(in_bytes)
+
+    def __str__(self):  # pragma: no cover
+        return f'Данные (RDATA): \\# {len(self.data)} {self.data.hex()}\n'
+
+    def to_bytes(self, compression=None, offset=0):
+        return self.data
+
 
 class _ResourceRecord:
     """
     Класс для ResourceRecord
     """
 
+    __slots__ = ('name', 'type_', 'class_', 'ttl', 'length', 'data')
+
     def __init__(
             self, name, type_, length, data, ttl=0,
             class_=RRClass.IN):
@@ -602,8 +1064,23 @@ class _ResourceRecord:
                 f'Данные (RDATA): \n\t\t{self.data}\n\t'
                 '----------------------------------\n')
 
+    def to_bytes(self, compression=None, offset=0):
+        """
+        Кодирует ResourceRecord в байты
+
+        :param dict compression: таблица суффиксов для сжатия имён
+        :param int offset: смещение ResourceRecord от начала сообщения
+        :return: объект bytes содержащий ResourceRecord
+        """
+        name = _encode_name(self.name, compression, offset)
+        data = self.data.to_bytes(
+            compression, offset + len(name) + _RR_FIXED_FIELDS.size)
+
+        return name + _RR_FIXED_FIELDS.pack(
+            self.type_, self.class_, self.ttl, len(data)) + data
+
     @classmethod
-    def _decode_data(cls, in_bytes, type_, length, offset):
+    def _decode_data(cls, in_bytes, type_, length, offset, names=None):
         """
         Декодирует данные ResourceRecord
 
@@ -611,6 +1088,7 @@ class _ResourceRecord:
         :param RRType type_: тип DNS записи
         :param int length: длина данных в байтах
         :param int offset: индекс первого байта данных в in_bytes
+        :param dict names: кэш декодированных имён сообщения
         :return: соответствующий type_ *ResourceData
         """
         data_in_bytes = in_bytes[offset:offset + length]
@@ -619,45 +1097,129 @@ class _ResourceRecord:
         elif type_ == RRType.AAAA:
             return _AAAAResourceData(data_in_bytes)
         elif type_ == RRType.PTR:
-            return _PTRResourceData(data_in_bytes)
+            return _PTRResourceData(in_bytes, offset, names)
         elif type_ == RRType.NS:
-            return _NSResourceData(in_bytes, offset)
+            return _NSResourceData(in_bytes, offset, names)
         elif type_ == RRType.SOA:
-            return _SOAResourceData(in_bytes, offset)
+            return _SOAResourceData(in_bytes, offset, names)
         elif type_ == RRType.TXT:
             return _TXTResourceData(in_bytes, offset)
         elif type_ == RRType.MX:
-            return _MXResourceData(in_bytes, offset)
+            return _MXResourceData(in_bytes, offset, names)
         elif type_ == RRType.CNAME:
-            return _CNAMEResourceData(in_bytes, offset)
+            return _CNAMEResourceData(in_bytes, offset, names)
+        elif type_ == RRType.DNAME:
+            return _DNAMEResourceData(in_bytes, offset, names)
+        elif type_ == RRType.OPT:
+            return _OPTResourceData.from_bytes(data_in_bytes)
+        return _UnknownResourceData(data_in_bytes)
 
     @classmethod
-    def from_bytes(cls, in_bytes, beginning):
+    def from_bytes(cls, in_bytes, beginning, names=None):
         """
         Создаёт ResourceRecord из объекта bytes, содержащего Query/Answer
 
         :param bytes in_bytes: объект bytes, содержащий Query/Answer
         :param int beginning: индекс начала ResourceRecord внутри Query/Answer
+        :param dict names: кэш декодированных имён сообщения
         :return: объект namedtuple, содержащий ResourceRecord и offset
         """
-        name, offset = _decode_name(in_bytes, beginning)
+        name, offset = _decode_name(in_bytes, beginning, names)
 
-        type_ = RRType(_decode_number(in_bytes[offset:offset + 2]))
-        offset += 2
+        type_, class_, ttl, length = _RR_FIXED_FIELDS.unpack_from(
+            in_bytes, offset)
+        type_ = _RR_TYPES.get(type_, type_)
+        # У OPT записи в поле CLASS лежит размер UDP ответа
+        class_ = (class_ if type_ == RRType.OPT
+                  else _RR_CLASSES[class_])
+        offset += _RR_FIXED_FIELDS.size
 
-        class_ = RRClass(_decode_number(
-            in_bytes[offset:offset + 2]))
-        offset += 2
+        data = cls._decode_data(in_bytes, type_, length, offset, names)
+        offset += length
 
-        ttl = struct.unpack('!I', in_bytes[offset:offset + 4])[0]
-        offset += 4
+        return _RRWrapper(cls(name, type_, length, data, ttl, class_), offset)
 
-        length = _decode_number(in_bytes[offset:offset + 2])
-        offset += 2
 
-        data = cls._decode_data(in_bytes, type_, length, offset)
-        offset += length
+def _make_opt_record(payload_size, *, extended_rcode=0, version=0,
+                     dnssec_ok=False, options=None):
+    """
+    Создаёт OPT запись (EDNS0, RFC 6891, 6.1.2)
+
+    :param int payload_size: размер UDP ответа, который готов принять
+    отправитель
+    :param int extended_rcode: старшие 8 бит кода ответа
+    :param int version: версия EDNS
+    :param bool dnssec_ok: флаг DO
+    :param options: список кортежей (код опции, bytes с данными)
+    :return: объект _ResourceRecord
+    """
+    ttl = (extended_rcode << 24) | (version << 16) | (dnssec_ok << 15)
+    data = _OPTResourceData(options)
+
+    return _ResourceRecord('', RRType.OPT, len(data.to_bytes()), data,
+                           ttl=ttl, class_=max(payload_size,
+                                               _MIN_PAYLOAD_SIZE))
+
 
-        rr_wrapper = namedtuple('rr_wrapper', ['resource_record', 'offset'])
+def _iter_messages(messages, offsets=None):
+    """
+    Перебирает сообщения пакета в виде memoryview без копирования
+
+    :param messages: последовательность bytes либо один непрерывный буфер
+    :param offsets: индексы начала сообщений в буфере messages (каждое
+    сообщение заканчивается там, где начинается следующее)
+    :return: генератор memoryview по сообщениям
+    """
+    if offsets is None:
+        for message in messages:
+            yield memoryview(message)
+        return
 
-        return rr_wrapper(cls(name, type_, length, data, ttl, class_), offset)
+    buffer = memoryview(messages)
+    ends = list(offsets[1:]) + [len(buffer)]
+    for start, end in zip(offsets, ends):
+        yield buffer[start:end]
+
+
+def decode_records(messages, offsets=None) -> list:
+    """
+    Быстрый путь пакетного декодирования: возвращает только записи из
+    раздела answers всех сообщений в виде кортежей (name, type_, data), не
+    создавая Answer, _Header, _Question и _ResourceRecord. Невалидные
+    сообщения пропускаются, а записи неподдерживаемых типов отдаются как
+    в _ResourceRecord.from_bytes: с числовым типом и _UnknownResourceData
+
+    :param messages: последовательность bytes либо один непрерывный буфер
+    :param offsets: индексы начала сообщений, если messages - один буфер
+    :return: список кортежей (доменное имя, RRType либо int, *ResourceData)
+    """
+    header_fields = _HEADER_FIELDS.unpack_from
+    rr_fixed_fields = _RR_FIXED_FIELDS.unpack_from
+    rr_fixed_size = _RR_FIXED_FIELDS.size
+    rr_types = _RR_TYPES
+    decode_data = _ResourceRecord._decode_data
+
+    records = []
+    for message in _iter_messages(messages, offsets):
+        message_records = []
+        try:
+            _, _, qcount, anscount, _, _ = header_fields(message, 0)
+            offset = _HEADER_FIELDS.size
+            for _ in range(qcount):
+                offset = _skip_name(message, offset) + 4
+
+            names = {}
+            for _ in range(anscount):
+                name, offset = _decode_name(message, offset, names)
+                type_, _, _, length = rr_fixed_fields(message, offset)
+                offset += rr_fixed_size
+                type_ = rr_types.get(type_, type_)
+                message_records.append(
+                    (name, type_,
+                     decode_data(message, type_, length, offset, names)))
+                offset += length
+        except Exception:
+            continue
+        records.extend(message_records)
+
+    return records
@@ -0,0 +1,212 @@
+"""
+Общие для тестов фейковые серверы и конструкторы DNS записей и ответов
+"""
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+from dns.dns_enums import MessageType, RRType
+from dns.dns_message import (
+    Answer, _Header, _Question, _ResourceRecord, _AResourceData,
+    _NSResourceData, _SOAResourceData, _skip_name)
+
+
+def make_response(query, ip=b'\x01\x02\x03\x04'):
+    """
+    Превращает запрос в ответ с одной записью A
+    """
+    header = query[:2] + b'\x81\x80' + query[4:6] + b'\x00\x01' + bytes(4)
+    record = b'\xc0\x0c\x00\x01\x00\x01\x00\x00\x00\x3c\x00\x04' + ip
+    return header + query[12:_skip_name(query, 12) + 4] + record
+
+
+class FakeUDPServer:
+    """
+    Локальный UDP сервер: на каждый запрос вызывает handler(query, reply),
+    где reply(data, from_other_port=False) отправляет датаграмму клиенту
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.port = self.socket.getsockname()[1]
+        self.other = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                query, client = self.socket.recvfrom(512)
+            except OSError:
+                return
+
+            def reply(data, from_other_port=False):
+                sender = self.other if from_other_port else self.socket
+                sender.sendto(data, client)
+
+            self.handler(query, reply)
+
+    def close(self):
+        self.socket.close()
+        self.other.close()
+
+
+def send(connection, data, fragment=False):
+    """
+    Отправляет data целиком либо кусками случайной длины с паузами, чтобы
+    получатель видел их отдельными сегментами
+    """
+    if not fragment:
+        connection.sendall(data)
+        return
+
+    if connection.family != socket.AF_UNIX:
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    while data:
+        size = random.randint(1, min(len(data), 3000))
+        connection.sendall(data[:size])
+        data = data[size:]
+        time.sleep(0.001)
+
+
+class FakeTCPServer:
+    """
+    Локальный TCP сервер: на каждый запрос вызывает handler(query, reply),
+    где reply(data) отправляет клиенту сообщение с префиксом длины. При
+    fragment=True сообщение отправляется кусками случайной длины
+    """
+
+    def __init__(self, handler, fragment=False):
+        self.handler = handler
+        self.fragment = fragment
+        self.connections = []
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.listen()
+        self.port = self.socket.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:
+                return
+            self.connections.append(connection)
+            threading.Thread(target=self._serve, args=(connection,),
+                             daemon=True).start()
+
+    def _serve(self, connection):
+        lock = threading.Lock()
+
+        def reply(data):
+            with lock:
+                send(connection, struct.pack('!H', len(data)) + data,
+                     self.fragment)
+
+        try:
+            while True:
+                size = connection.recv(2)
+                if len(size) < 2:
+                    return
+                size = struct.unpack('!H', size)[0]
+                query = b''
+                while len(query) < size:
+                    query += connection.recv(size - len(query))
+                self.handler(query, reply)
+        except OSError:
+            connection.close()
+
+    def drop_connections(self):
+        """
+        Закрывает все принятые соединения (как сервер по простою)
+        """
+        for connection in self.connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.close()
+
+    def close(self):
+        self.socket.close()
+        self.drop_connections()
+
+
+def a_record(name, ip=b'\x01\x02\x03\x04', ttl=300):
+    return _ResourceRecord(name, RRType.A, 4, _AResourceData(ip), ttl=ttl)
+
+
+def ns_record(zone, target, ttl=3600):
+    labels = b''.join(bytes([len(label)]) + label.encode()
+                      for label in target.split('.'))
+    return _ResourceRecord(zone, RRType.NS, len(labels) + 1,
+                           _NSResourceData(labels + b'\x00', 0), ttl=ttl)
+
+
+def referral(hostname, zone, targets, glue=()):
+    """
+    Ответ-делегирование на NS запрос hostname к зоне zone
+    """
+    authorities = [ns_record(zone, target) for target in targets]
+    additions = [a_record(name, ip) for name, ip in glue]
+    header = _Header(1, MessageType.RESPONSE, 1,
+                     authority_count=len(authorities),
+                     additional_count=len(additions))
+    return Answer(header, [_Question(hostname, RRType.NS)], [],
+                  authorities, additions)
+
+
+def ns_answer(hostname, targets, glue=()):
+    """
+    Ответ с NS записями hostname в answers и glue записями в additions
+    """
+    answers = [ns_record(hostname, target) for target in targets]
+    additions = [a_record(name, ip) for name, ip in glue]
+    header = _Header(1, MessageType.RESPONSE, 1, answer_count=len(answers),
+                     additional_count=len(additions))
+    return Answer(header, [_Question(hostname, RRType.NS)], answers, [],
+                  additions)
+
+
+def soa_record(name, ttl=3600, minimum=300):
+    data = (b'\x03ns1\x00\x0ahostmaster\x00'
+            + struct.pack('!5I', 1, 7200, 3600, 1209600, minimum))
+    return _ResourceRecord(name, RRType.SOA, len(data),
+                           _SOAResourceData(data, 0), ttl=ttl)
+
+
+def axfr_message(query, *records, rcode=0):
+    """
+    Сообщение передачи зоны: вопрос из query и записи records
+    """
+    header = query[:2] + struct.pack('!HHHHH', 0x8400 | rcode, 1,
+                                     len(records), 0, 0)
+    question = query[12:query.index(b'\x00', 12) + 5]
+    return header + question + b''.join(records)
+
+
+def rr(owner, type_, rdata):
+    return owner + struct.pack('!HHIH', type_, 1, 300, len(rdata)) + rdata
+
+
+def soa(serial):
+    return rr(b'\xc0\x0c', 6, b'\x03ns1\xc0\x0c\x0ahostmaster\xc0\x0c'
+              + struct.pack('!5I', serial, 7200, 3600, 1209600, 300))
+
+
+SOA = soa(2024010101)
+
+
+def host(i):
+    label = f'host{i}'.encode()
+    return rr(bytes([len(label)]) + label + b'\xc0\x0c', 1,
+              struct.pack('!I', i))
@@ -88,6 +88,32 @@ def test_port_valid():
     assert arg_parser.port(p) == 80
 
 
+incorrect_payload_sizes = {
+    'not digit': 'a',
+    'too small': '511',
+    'too large': '65536'}
+
+
+@pytest.mark.parametrize('incorrect_payload_size',
+                         list(incorrect_payload_sizes.values()),
+                         ids=list(incorrect_payload_sizes.keys()))
+def test_if_incorrect_payload_size_raise_exception(incorrect_payload_size):
+    """
+    Если невалидный размер UDP ответа,
+    то arg_parser.payload_size должен выбросить исключение ArgumentTypeError
+    """
+    with pytest.raises(ArgumentTypeError):
+        arg_parser.payload_size(incorrect_payload_size)
+
+
+def test_payload_size_valid():
+    assert arg_parser.payload_size('4096') == 4096
+
+
+def test_payload_size_disables_edns():
+    assert arg_parser.payload_size('0') is None
+
+
 incorrect_timeouts = {
     'not digit': '@',
     'negative': '-5',
@@ -0,0 +1,263 @@
+import asyncio
+import os
+import socket
+import sys
+import unittest
+from argparse import Namespace
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+from dns.dns_enums import MessageType, ResponseType, RRType
+from dns.dns_message import (
+    Answer, _Header, _Question, _ResourceRecord, _AResourceData,
+    get_query_template)
+from utils import async_resolver, resolver
+from utils.zhuban_exceptions import InvalidServerResponse, ResolutionFailed
+from helpers import (
+    SOA, FakeTCPServer, FakeUDPServer, axfr_message, host, make_response,
+    ns_answer, referral)
+
+
+class TestAsyncQuery(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.close()
+
+    def serve(self, server):
+        self.servers.append(server)
+        return {'server': '127.0.0.1', 'port': server.port, 'timeout': 2}
+
+    def test_concurrent_udp(self):
+        queries = []
+
+        def handler(query, reply):
+            queries.append(query)
+            if len(queries) == 3:
+                for q in reversed(queries):
+                    reply(make_response(q))
+
+        args = self.serve(FakeUDPServer(handler))
+        names = ['a.example.com', 'b.example.com', 'c.example.com']
+
+        async def main():
+            return await asyncio.gather(*(
+                async_resolver.get_answer(name, RRType.A, protocol='udp',
+                                          **args)
+                for name in names))
+
+        answers = asyncio.run(main())
+        self.assertEqual(names, [a.questions[0].name for a in answers])
+        self.assertEqual(3, len({q[:2] for q in queries}))
+
+    def test_udp_timeout(self):
+        args = self.serve(FakeUDPServer(lambda query, reply: None))
+        args['timeout'] = 0.05
+
+        with self.assertRaises(socket.timeout):
+            query = get_query_template('example.com', RRType.A).render()
+            asyncio.run(async_resolver.udp_query(query, **args))
+
+    def test_tcp(self):
+        args = self.serve(FakeTCPServer(
+            lambda query, reply: reply(make_response(query))))
+
+        answer = asyncio.run(async_resolver.get_answer(
+            'example.com', RRType.A, protocol='tcp', **args))
+        self.assertEqual('1.2.3.4', answer.answers[0].data.ip)
+
+
+class TestAsyncTruncatedFallback(unittest.TestCase):
+    def setUp(self):
+        resolver.answer_cache.clear()
+        self.addCleanup(resolver.answer_cache.clear)
+
+    def test_truncated_retried_over_tcp(self):
+        async def udp_query(query, **kwargs):
+            response = bytearray(make_response(query))
+            response[2] |= 0x02
+            return response
+
+        async def tcp_query(query, **kwargs):
+            return make_response(query, b'\x05\x06\x07\x08')
+
+        with mock.patch('utils.async_resolver.udp_query', udp_query), \
+                mock.patch('utils.async_resolver.tcp_query', tcp_query):
+            answer = asyncio.run(async_resolver.get_answer(
+                'example.com', RRType.A, protocol='udp', server='10.0.0.1',
+                port=53, timeout=1))
+
+        self.assertEqual('5.6.7.8', answer.answers[0].data.ip)
+        self.assertEqual(1, resolver.get_tcp_fallback_counts()['10.0.0.1'])
+
+
+class TestAsyncCoalescing(unittest.TestCase):
+    def setUp(self):
+        resolver.answer_cache.clear()
+        self.addCleanup(resolver.answer_cache.clear)
+
+    def test_concurrent_duplicates_sent_once(self):
+        queries = []
+
+        async def udp_query(query, **kwargs):
+            queries.append(query)
+            await asyncio.sleep(0.01)
+            return make_response(query)
+
+        async def lookup():
+            return await asyncio.gather(*(
+                async_resolver.get_answer(
+                    name, RRType.A, protocol='udp', server='10.0.0.1',
+                    port=53, timeout=1)
+                for name in ['a.com'] * 5 + ['b.com']))
+
+        stats = resolver.get_coalescing_stats()
+        with mock.patch('utils.async_resolver.udp_query', udp_query):
+            answers = asyncio.run(lookup())
+
+        self.assertEqual(2, len(queries))
+        self.assertEqual(['a.com'] * 5 + ['b.com'],
+                         [a.questions[0].name for a in answers])
+        self.assertEqual(stats['coalesced'] + 4,
+                         resolver.get_coalescing_stats()['coalesced'])
+
+    def test_cancelled_leader_does_not_cancel_duplicates(self):
+        async def udp_query(query, **kwargs):
+            await asyncio.sleep(0.01)
+            return make_response(query)
+
+        async def lookup():
+            args = {'protocol': 'udp', 'server': '10.0.0.1', 'port': 53,
+                    'timeout': 1}
+            leader = asyncio.ensure_future(
+                async_resolver.get_answer('a.com', RRType.A, **args))
+            await asyncio.sleep(0)
+            duplicate = asyncio.ensure_future(
+                async_resolver.get_answer('a.com', RRType.A, **args))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await duplicate
+
+        with mock.patch('utils.async_resolver.udp_query', udp_query):
+            answer = asyncio.run(lookup())
+
+        self.assertEqual('1.2.3.4', answer.answers[0].data.ip)
+
+
+class TestAsyncZoneDump(unittest.TestCase):
+    def setUp(self):
+        resolver.answer_cache.clear()
+        self.addCleanup(resolver.answer_cache.clear)
+
+    def dump(self, handler):
+        server = FakeTCPServer(handler, fragment=True)
+        self.addCleanup(server.close)
+        with mock.patch('utils.async_resolver.find_name_servers',
+                        return_value=['127.0.0.1']):
+            return asyncio.run(async_resolver.get_zone_dump(
+                'vk.com', port=server.port, timeout=2))
+
+    def test_multi_message(self):
+        def handler(query, reply):
+            reply(axfr_message(query, SOA, host(0), host(1)))
+            reply(axfr_message(query, *(host(i) for i in range(2, 500))))
+            reply(axfr_message(query, host(500), SOA))
+
+        answer = self.dump(handler)
+
+        self.assertEqual(RRType.SOA, answer.answers[0].type_)
+        self.assertEqual(502, answer.header.answer_count)
+        self.assertEqual('host500.vk.com', answer.answers[-1].name)
+        self.assertEqual(0, len(resolver.answer_cache))
+
+    def test_refused(self):
+        answer = self.dump(
+            lambda query, reply: reply(axfr_message(query, rcode=5)))
+
+        self.assertEqual(ResponseType.REFUSED, answer.header.response_type)
+        self.assertEqual([], answer.answers)
+
+    def test_notauth(self):
+        answer = self.dump(
+            lambda query, reply: reply(axfr_message(query, rcode=9)))
+
+        self.assertEqual(ResponseType.REFUSED, answer.header.response_type)
+        self.assertEqual([], answer.answers)
+
+    def test_stream_cut_short(self):
+        def handler(query, reply):
+            reply(axfr_message(query, SOA, host(0)))
+            raise OSError
+
+        self.assertRaises(InvalidServerResponse, self.dump, handler)
+
+
+class TestAsyncResolve(unittest.TestCase):
+    @mock.patch('utils.async_resolver.get_answer')
+    def test_resolve(self, mock_get_answer):
+        args = Namespace(hostname='vk.com', protocol='udp', server='8.8.8.8',
+                         port=53, timeout=10, inverse=False, dump=False,
+                         debug=False, ipv6=False,
+                         payload_size=1232)
+
+        header = _Header(
+            1823, MessageType.RESPONSE, question_count=1, answer_count=1)
+        answers = [_ResourceRecord(
+            'vk.com', type_=RRType.A, length=4,
+            data=_AResourceData(b'\x57\xf0\xb6\xe0'))]
+
+        async def fake_get_answer(*args, **kwargs):
+            return Answer(header, [_Question('vk.com')], answers, [], [])
+
+        mock_get_answer.side_effect = fake_get_answer
+
+        answer = asyncio.run(async_resolver.resolve(args))
+        self.assertEqual('87.240.182.224', answer.answers[0].data.ip)
+
+    @mock.patch('utils.async_resolver.lookup_addresses')
+    @mock.patch('utils.async_resolver.get_answer')
+    def test_find_name_servers(self, mock_get_answer, mock_lookup_addresses):
+        resolver.delegation_cache.clear()
+        self.addCleanup(resolver.delegation_cache.clear)
+
+        async def fake_get_answer(hostname, record_type, *, server, **kwargs):
+            return ns_answer(hostname, ['ns1.vk.com', 'ns.other.org'],
+                             [('ns1.vk.com', b'\x57\xf0\xb6\x01')])
+
+        async def fake_lookup_addresses(hostname, **kwargs):
+            return ['10.0.0.2']
+
+        mock_get_answer.side_effect = fake_get_answer
+        mock_lookup_addresses.side_effect = fake_lookup_addresses
+
+        servers = asyncio.run(async_resolver.find_name_servers(
+            'vk.com', protocol='udp', port=53, timeout=10))
+
+        self.assertEqual(['87.240.182.1', '10.0.0.2'], servers)
+        mock_lookup_addresses.assert_called_once_with(
+            'ns.other.org', protocol='udp', port=53, timeout=10)
+
+    @mock.patch('utils.async_resolver.get_answer')
+    def test_reverse_referral_loop_stops(self, mock_get_answer):
+        resolver.delegation_cache.clear()
+        self.addCleanup(resolver.delegation_cache.clear)
+        args = Namespace(hostname='87.240.182.224', protocol='udp',
+                         server='8.8.8.8', port=53, timeout=10, inverse=True,
+                         dump=False, debug=False, ipv6=False,
+                         payload_size=1232)
+        zone = '182.240.87.in-addr.arpa'
+
+        async def fake_get_answer(hostname, record_type, **kwargs):
+            return referral(hostname, zone, ['ns.' + zone],
+                            [('ns.' + zone, b'\x0a\x00\x00\x01')])
+
+        mock_get_answer.side_effect = fake_get_answer
+
+        with self.assertRaises(ResolutionFailed):
+            asyncio.run(async_resolver.resolve_reverse_lookup(args))
+        self.assertEqual(
+            ['8.8.8.8', '10.0.0.1'],
+            [c.kwargs['server'] for c in mock_get_answer.call_args_list])
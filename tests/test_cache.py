@@ -0,0 +1,464 @@
+import asyncio
+import os
+import struct
+import sys
+import threading
+import time
+import unittest
+from argparse import Namespace
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+from dns.dns_enums import MessageType, ResponseType, RRType
+from dns.dns_message import Answer, _Header, _Question
+from utils import resolver
+from utils.cache import (
+    AnswerCache, AsyncInFlightRequests, DelegationCache, InFlightRequests,
+    InfrastructureCache)
+from helpers import (
+    a_record, make_response, ns_answer, ns_record, referral, soa_record)
+
+
+def negative_response(query, rcode):
+    """
+    Отрицательный ответ на query с SOA в authorities
+    """
+    header = (bytes(query[:2]) + struct.pack('!H', 0x8180 | rcode)
+              + bytes(query[4:6]) + b'\x00\x00\x00\x01\x00\x00')
+    soa = soa_record('com').to_bytes()
+    return header + bytes(query[12:24]) + soa
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAnswerCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = AnswerCache(max_entries=2, clock=self.clock)
+
+    def test_miss(self):
+        self.assertIsNone(self.cache.get('vk.com', RRType.A))
+
+    def test_hit_with_decremented_ttl(self):
+        self.cache.put('vk.com', RRType.A,
+                       [a_record('vk.com', ttl=300),
+                        a_record('vk.com', ttl=600)])
+        self.clock.now += 100.5
+
+        actual = self.cache.get('VK.com.', RRType.A)
+
+        self.assertEqual([200, 500], [r.ttl for r in actual])
+        self.assertEqual('1.2.3.4', actual[0].data.ip)
+
+    def test_expired(self):
+        self.cache.put('vk.com', RRType.A, [a_record('vk.com', ttl=300)])
+        self.clock.now += 300
+
+        self.assertIsNone(self.cache.get('vk.com', RRType.A))
+        self.assertEqual(0, len(self.cache))
+
+    def test_zero_ttl_not_cached(self):
+        self.cache.put('vk.com', RRType.A, [a_record('vk.com', ttl=0)])
+
+        self.assertEqual(0, len(self.cache))
+
+    def test_lru_eviction(self):
+        self.cache.put('a.com', RRType.A, [a_record('a.com')])
+        self.cache.put('b.com', RRType.A, [a_record('b.com')])
+        self.cache.get('a.com', RRType.A)
+        self.cache.put('c.com', RRType.A, [a_record('c.com')])
+
+        self.assertIsNotNone(self.cache.get('a.com', RRType.A))
+        self.assertIsNone(self.cache.get('b.com', RRType.A))
+        self.assertIsNotNone(self.cache.get('c.com', RRType.A))
+
+
+class TestNegativeCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = AnswerCache(clock=self.clock)
+
+    def test_nxdomain_covers_all_types(self):
+        self.cache.put_negative('dead.com', RRType.NS,
+                                ResponseType.NAME_ERROR, soa_record('com'))
+
+        response_type, soa = self.cache.get_negative('dead.com', RRType.A)
+
+        self.assertEqual(ResponseType.NAME_ERROR, response_type)
+        self.assertEqual('com', soa.name)
+        self.assertIsNone(self.cache.get('dead.com', RRType.A))
+
+    def test_nodata_only_for_type(self):
+        self.cache.put_negative('vk.com', RRType.AAAA,
+                                ResponseType.NO_ERROR, soa_record('vk.com'))
+
+        self.assertEqual(ResponseType.NO_ERROR,
+                         self.cache.get_negative('vk.com', RRType.AAAA)[0])
+        self.assertIsNone(self.cache.get_negative('vk.com', RRType.A))
+
+    def test_ttl_from_soa_minimum(self):
+        self.cache.put_negative('dead.com', RRType.A,
+                                ResponseType.NAME_ERROR,
+                                soa_record('com', ttl=3600, minimum=300))
+        self.clock.now += 299
+        self.assertIsNotNone(self.cache.get_negative('dead.com', RRType.A))
+
+        self.clock.now += 1
+        self.assertIsNone(self.cache.get_negative('dead.com', RRType.A))
+
+
+class TestDelegationCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = DelegationCache(clock=self.clock)
+
+    def test_deepest_ancestor(self):
+        self.cache.put('com', [ns_record('com', 'a.gtld.net')])
+        self.cache.put('example.com', [ns_record('example.com',
+                                                 'ns1.example.com')],
+                       [a_record('ns1.example.com', b'\x0a\x00\x00\x01'),
+                        a_record('other.com', b'\x0a\x00\x00\x02')])
+
+        zone, names, glue = self.cache.find('a.b.Example.com.')
+
+        self.assertEqual('example.com', zone)
+        self.assertEqual(['ns1.example.com'], names)
+        self.assertEqual({'ns1.example.com': ['10.0.0.1']}, glue)
+        self.assertEqual('com', self.cache.find('vk.com')[0])
+        self.assertIsNone(self.cache.find('vk.ru'))
+
+    def test_expiry(self):
+        self.cache.put('com', [ns_record('com', 'a.gtld.net', ttl=10)])
+        self.clock.now += 10
+
+        self.assertIsNone(self.cache.find('vk.com'))
+
+
+class FakeRandom:
+    def __init__(self, value):
+        self.value = value
+
+    def random(self):
+        return self.value
+
+    def choice(self, items):
+        return items[-1]
+
+
+class TestInfrastructureCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = InfrastructureCache(clock=self.clock,
+                                         rng=FakeRandom(0.5))
+
+    def test_smoothed_rtt(self):
+        self.cache.record_rtt('10.0.0.1', 0.1)
+        self.assertEqual((0.1, 0.05, 0), self.cache.get('10.0.0.1'))
+
+        self.cache.record_rtt('10.0.0.1', 0.5)
+        srtt, rttvar, _ = self.cache.get('10.0.0.1')
+
+        self.assertAlmostEqual(0.15, srtt)
+        self.assertAlmostEqual(0.1375, rttvar)
+
+    def test_adaptive_timeout(self):
+        self.assertEqual(5, self.cache.timeout('10.0.0.1', 5))
+
+        self.cache.record_rtt('10.0.0.1', 0.1)
+        self.assertAlmostEqual(0.3, self.cache.timeout('10.0.0.1', 5))
+        self.cache.record_rtt('10.0.0.2', 0.01)
+        self.assertEqual(0.2, self.cache.timeout('10.0.0.2', 5))
+
+        self.cache.record_timeout('10.0.0.1')
+        self.cache.record_timeout('10.0.0.1')
+        self.assertAlmostEqual(1.2, self.cache.timeout('10.0.0.1', 5))
+        self.assertEqual(1, self.cache.timeout('10.0.0.1', 1))
+
+    def test_prefers_fastest(self):
+        self.cache.record_rtt('10.0.0.1', 0.3)
+        self.cache.record_rtt('10.0.0.2', 0.05)
+        self.cache.record_rtt('10.0.0.3', 0.01)
+        self.cache.record_timeout('10.0.0.3')
+        self.cache.record_timeout('10.0.0.3')
+        self.cache.record_timeout('10.0.0.3')
+
+        servers = ['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.4']
+        self.assertEqual('10.0.0.2', self.cache.choose(servers))
+        self.assertEqual(['10.0.0.2', '10.0.0.3', '10.0.0.1', '10.0.0.4'],
+                         self.cache.sort(servers))
+
+    def test_exploration(self):
+        self.cache.record_rtt('10.0.0.1', 0.01)
+        self.cache._rng = FakeRandom(0.01)
+
+        self.assertEqual('10.0.0.2',
+                         self.cache.choose(['10.0.0.1', '10.0.0.2']))
+        self.assertEqual('10.0.0.1', self.cache.choose(['10.0.0.1']))
+
+    def test_expiry(self):
+        self.cache.record_timeout('10.0.0.1')
+        self.clock.now += 900
+
+        self.assertIsNone(self.cache.get('10.0.0.1'))
+        self.assertEqual(self.cache.unknown_rtt,
+                         self.cache.score('10.0.0.1'))
+
+
+class TestInFlightRequests(unittest.TestCase):
+    def setUp(self):
+        self.stats = {}
+        self.requests = InFlightRequests(self.stats)
+
+    def test_sequential_calls_not_coalesced(self):
+        self.assertEqual(1, self.requests.run('key', lambda: 1))
+        self.assertEqual(2, self.requests.run('key', lambda: 2))
+        self.assertEqual({'queries': 2}, self.stats)
+        self.assertEqual(0, len(self.requests))
+
+    def test_exception_shared_with_duplicates(self):
+        started, release = threading.Event(), threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            release.wait(5)
+            raise ConnectionError
+
+        def call():
+            try:
+                self.requests.run('key', fail)
+            except ConnectionError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(5)
+        duplicate = threading.Thread(target=call)
+        duplicate.start()
+        while self.stats.get('coalesced') != 1:
+            threading.Event().wait(0.01)
+        release.set()
+        leader.join()
+        duplicate.join()
+
+        self.assertEqual(2, len(errors))
+        self.assertIs(errors[0], errors[1])
+        self.assertEqual(0, len(self.requests))
+
+    def test_shared_stats_counted_across_threads(self):
+        class YieldingStats(dict):
+            # Переключение потока между чтением и записью счётчика
+            def get(self, key, default=None):
+                value = super().get(key, default)
+                time.sleep(0)
+                return value
+
+        stats = YieldingStats()
+        requests = InFlightRequests(stats)
+        async_requests = AsyncInFlightRequests(stats)
+
+        async def value():
+            return 1
+
+        async def run_async():
+            for i in range(100):
+                await async_requests.run(i, value)
+
+        def run_sync():
+            for i in range(100):
+                requests.run((threading.get_ident(), i), lambda: 1)
+
+        threads = ([threading.Thread(target=run_sync) for _ in range(4)]
+                   + [threading.Thread(target=asyncio.run,
+                                       args=(run_async(),))
+                      for _ in range(4)])
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual({'queries': 800}, stats)
+
+
+class TestResolverDelegation(unittest.TestCase):
+    def setUp(self):
+        resolver.delegation_cache.clear()
+        self.addCleanup(resolver.delegation_cache.clear)
+
+    @mock.patch('utils.resolver.get_answer')
+    def test_walk_starts_at_cached_zone(self, mock_get_answer):
+        def get_answer(hostname, record_type, *, server, **kwargs):
+            if server == '10.0.0.1':
+                return ns_answer(hostname, ['ns.' + hostname],
+                                 [('ns.' + hostname, b'\x0a\x00\x00\x05')])
+            return referral(hostname, 'example.com', ['ns1.example.com'],
+                            [('ns1.example.com', b'\x0a\x00\x00\x01')])
+
+        mock_get_answer.side_effect = get_answer
+        args = {'protocol': 'udp', 'port': 53, 'timeout': 10}
+
+        resolver.find_name_servers('a.example.com', **args)
+        mock_get_answer.reset_mock()
+        servers = resolver.find_name_servers('b.example.com', **args)
+
+        self.assertEqual(['10.0.0.5'], servers)
+        self.assertEqual(
+            ['10.0.0.1'],
+            [c.kwargs['server'] for c in mock_get_answer.call_args_list])
+
+    @mock.patch('utils.resolver.get_root_servers')
+    @mock.patch('utils.resolver.get_answer')
+    def test_referral_follows_glue(self, mock_get_answer,
+                                   mock_get_root_servers):
+        mock_get_root_servers.return_value = {'198.41.0.4'}
+
+        def get_answer(hostname, record_type, *, server, **kwargs):
+            if server == '198.41.0.4':
+                return referral(hostname, 'org', ['a.org-servers.org'],
+                                [('a.org-servers.org', b'\x0a\x00\x00\x01')])
+            return ns_answer(hostname, ['ns.' + hostname],
+                             [('ns.' + hostname, b'\x0a\x00\x00\x05')])
+
+        mock_get_answer.side_effect = get_answer
+
+        servers = resolver.find_name_servers('vk.org', protocol='udp',
+                                             port=53, timeout=10)
+
+        self.assertEqual(['10.0.0.5'], servers)
+        self.assertEqual(
+            ['198.41.0.4', '10.0.0.1'],
+            [c.kwargs['server'] for c in mock_get_answer.call_args_list])
+
+    @mock.patch('utils.resolver.get_root_servers')
+    @mock.patch('utils.resolver.get_answer')
+    def test_glueless_name_server_resolved_iteratively(
+            self, mock_get_answer, mock_get_root_servers):
+        mock_get_root_servers.return_value = {'198.41.0.4'}
+        resolver.answer_cache.clear()
+        self.addCleanup(resolver.answer_cache.clear)
+
+        def get_answer(hostname, record_type, *, server, **kwargs):
+            questions = [_Question(hostname, record_type)]
+            if hostname == 'ns.other.org':
+                header = _Header(1, MessageType.RESPONSE, 1, answer_count=1)
+                return Answer(header, questions,
+                              [a_record(hostname, b'\x0a\x00\x00\x02')],
+                              [], [])
+            if server == '198.41.0.4':
+                return referral(hostname, 'vk.org', ['ns.other.org'])
+            return ns_answer(hostname, ['ns.other.org'])
+
+        mock_get_answer.side_effect = get_answer
+
+        servers = resolver.find_name_servers('vk.org', protocol='udp',
+                                             port=53, timeout=10)
+
+        self.assertEqual(['10.0.0.2'], servers)
+        self.assertEqual(
+            [('vk.org', '198.41.0.4'), ('ns.other.org', '198.41.0.4'),
+             ('vk.org', '10.0.0.2'), ('ns.other.org', '198.41.0.4')],
+            [(c.args[0], c.kwargs['server'])
+             for c in mock_get_answer.call_args_list])
+
+    def test_unrelated_referral_ignored(self):
+        resolver._cache_delegation(
+            'vk.com', referral('vk.com', 'evil.org', ['ns.evil.org']), '')
+
+        self.assertEqual(0, len(resolver.delegation_cache))
+
+    def test_upward_referral_ignored(self):
+        resolver._cache_delegation(
+            'www.example.org',
+            referral('www.example.org', 'org', ['ns.evil.test'],
+                     [('ns.evil.test', b'\x06\x06\x06\x06')]),
+            'example.org')
+
+        self.assertIsNone(resolver.delegation_cache.get('org'))
+
+    def test_out_of_zone_glue_dropped(self):
+        resolver._cache_delegation(
+            'www.example.org',
+            referral('www.example.org', 'example.org',
+                     ['ns.example.org', 'ns.evil.test'],
+                     [('ns.example.org', b'\x0a\x00\x00\x01'),
+                      ('ns.evil.test', b'\x06\x06\x06\x06')]),
+            'org')
+
+        self.assertEqual(
+            (['ns.example.org', 'ns.evil.test'],
+             {'ns.example.org': ['10.0.0.1']}),
+            resolver.delegation_cache.get('example.org'))
+
+
+class TestResolverCache(unittest.TestCase):
+    def setUp(self):
+        resolver.answer_cache.clear()
+        self.addCleanup(resolver.answer_cache.clear)
+        self.args = {'protocol': 'udp', 'server': '8.8.8.8', 'port': 53,
+                     'timeout': 10}
+
+    @mock.patch('utils.resolver.udp_query')
+    def test_repeated_lookup_served_from_cache(self, mock_udp_query):
+        mock_udp_query.side_effect = (
+            lambda query, **kwargs: make_response(query))
+
+        first = resolver.get_answer('vk.com', RRType.A, **self.args)
+        second = resolver.get_answer('vk.com', RRType.A, **self.args)
+
+        self.assertEqual(1, mock_udp_query.call_count)
+        self.assertEqual(first.answers[0].data.ip,
+                         second.answers[0].data.ip)
+        self.assertEqual('vk.com', second.questions[0].name)
+
+    @mock.patch('utils.resolver.udp_query')
+    def test_empty_answer_not_cached(self, mock_udp_query):
+        mock_udp_query.side_effect = (
+            lambda query, **kwargs: bytes(query[:2]) + b'\x81\x80'
+            + bytes(query[4:6]) + bytes(6) + bytes(query[12:24]))
+
+        resolver.get_answer('vk.com', RRType.A, **self.args)
+        resolver.get_answer('vk.com', RRType.A, **self.args)
+
+        self.assertEqual(2, mock_udp_query.call_count)
+
+    @mock.patch('utils.resolver.udp_query')
+    def test_nxdomain_cached(self, mock_udp_query):
+        mock_udp_query.side_effect = (
+            lambda query, **kwargs: negative_response(query, 3))
+
+        first = resolver.get_answer('vk.com', RRType.NS, **self.args)
+        second = resolver.get_answer('vk.com', RRType.A, **self.args)
+
+        self.assertEqual(1, mock_udp_query.call_count)
+        self.assertEqual(ResponseType.NAME_ERROR,
+                         first.header.response_type)
+        self.assertEqual(ResponseType.NAME_ERROR,
+                         second.header.response_type)
+        self.assertEqual(RRType.SOA, second.authorities[0].type_)
+
+    @mock.patch('utils.resolver.get_answer')
+    def test_resolve_dead_domain(self, mock_get_answer):
+        def get_answer(hostname, record_type, **kwargs):
+            answer = resolver._decode_response(negative_response(
+                resolver.get_query_template(hostname, record_type).render(),
+                3))
+            resolver._cache_answer(hostname, record_type, answer)
+            return answer
+
+        mock_get_answer.side_effect = get_answer
+        args = Namespace(hostname='vk.com', protocol='udp', server=None,
+                         port=53, timeout=10, inverse=False, dump=False,
+                         debug=False, ipv6=False, payload_size=1232)
+
+        answer = resolver.resolve(args)
+
+        self.assertEqual(ResponseType.NAME_ERROR,
+                         answer.header.response_type)
+        self.assertEqual(1, mock_get_answer.call_count)
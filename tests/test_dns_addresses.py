@@ -0,0 +1,72 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+from dns import dns_addresses
+from dns.dns_message import decode_records
+
+first = b'\x00\x01\x80\x00\x00\x01\x00\x02\x00\x00\x00\x00' \
+        b'\x06google\x03com\x00\x00\x01\x00\x01' \
+        b'\xc0\x0c\x00\x01\x00\x01\x00\x00\x00\x00\x00\x04\xac\xd9\x0en' \
+        b'\xc0\x0c\x00\x05\x00\x01\x00\x00\x00\x00\x00\x02\xc0\x0c'
+second = b'\x2b\x74\x85\x00\x00\x01\x00\x02\x00\x00\x00\x00' \
+         b'\x06google\x03com\x00\x00\x1c\x00\x01' \
+         b'\xc0\x0c\x00\x1c\x00\x01\x00\x00\x01\x2c\x00\x10' \
+         b'\x2a\x00\x14\x50\x40\x11\x08\x08\x00\x00\x00\x00' \
+         b'\x00\x00\x10\x02' \
+         b'\xc0\x0c\x00\x01\x00\x01\x00\x00\x00\x00\x00\x04\x01\x02\x03\x04'
+invalid = b'\x00\x03\x80\x00\x00\x01\x00\x01'
+
+
+class TestCollectAddressOffsets(unittest.TestCase):
+    def test_offsets(self):
+        buffer = first + invalid + second
+        starts = [0, len(first), len(first) + len(invalid)]
+
+        a_offsets, aaaa_offsets = dns_addresses._collect_address_offsets(
+            buffer, starts)
+
+        self.assertEqual([b'\xac\xd9\x0en', b'\x01\x02\x03\x04'],
+                         [buffer[o:o + 4] for o in a_offsets])
+        self.assertEqual([second[40:56]],
+                         [buffer[o:o + 16] for o in aaaa_offsets])
+
+    @mock.patch('dns.dns_addresses.np', None)
+    def test_without_numpy(self):
+        self.assertRaises(ImportError, dns_addresses.extract_addresses,
+                          [first])
+
+
+@unittest.skipIf(dns_addresses.np is None, 'numpy не установлен')
+class TestExtractAddresses(unittest.TestCase):
+    def test_messages(self):
+        ipv4, ipv6 = dns_addresses.extract_addresses([first, invalid, second])
+
+        self.assertEqual([0xacd90e6e, 0x01020304], ipv4.tolist())
+        self.assertEqual((1, 16), ipv6.shape)
+        self.assertEqual(second[40:56], ipv6[0].tobytes())
+
+    def test_buffer(self):
+        ipv4, ipv6 = dns_addresses.extract_addresses(
+            second + first, [0, len(second)])
+
+        self.assertEqual([0x01020304, 0xacd90e6e], ipv4.tolist())
+
+    def test_empty(self):
+        ipv4, ipv6 = dns_addresses.extract_addresses([invalid])
+
+        self.assertEqual((0,), ipv4.shape)
+        self.assertEqual((0, 16), ipv6.shape)
+
+    def test_same_strings_as_decoder(self):
+        ipv4, ipv6 = dns_addresses.extract_addresses([first, second])
+        records = decode_records([first, second])
+
+        expected = [data.ip for _, _, data in records if hasattr(data, 'ip')]
+        actual = (dns_addresses.ipv4_to_strings(ipv4)
+                  + dns_addresses.ipv6_to_strings(ipv6))
+
+        self.assertEqual(sorted(expected), sorted(actual))
@@ -6,12 +6,15 @@ sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
                              os.path.pardir))
 from dns.dns_message import (
     _encode_number, _decode_number, _encode_name, _decode_name, _Header,
-    _Question, _ResourceRecord, Query, Answer, _AResourceData
+    _Question, _ResourceRecord, Query, Answer, _AResourceData,
+    _NSResourceData, _MXResourceData, _SOAResourceData, QueryTemplate,
+    get_query_template, decode_records
 )
 from dns.dns_enums import (
     MessageType, QueryType, ResponseType, RRType,
     RRClass
 )
+from utils.zhuban_exceptions import InvalidAnswer
 
 
 class TestEncodeNumber(unittest.TestCase):
@@ -44,6 +47,19 @@ class TestEncodeNumber(unittest.TestCase):
 
         self.assertEqual(expected, actual)
 
+    def test_max(self):
+        number = 65535
+
+        expected = b'\xff\xff'
+        actual = _encode_number(number)
+
+        self.assertEqual(expected, actual)
+
+    def test_too_big(self):
+        number = 65536
+
+        self.assertRaises(ValueError, _encode_number, number)
+
 
 class TestDecodeNumber(unittest.TestCase):
     def test_zero(self):
@@ -89,6 +105,34 @@ class TestEncodeString(unittest.TestCase):
         self.assertEqual(expected, actual)
 
 
+class TestEncodeNameCompression(unittest.TestCase):
+    def test_new_suffixes_registered(self):
+        compression = {}
+
+        actual = _encode_name('www.Yandex.ru', compression, 12)
+
+        self.assertEqual(b'\x03www\x06Yandex\x02ru\x00', actual)
+        self.assertEqual({'www.yandex.ru': 12, 'yandex.ru': 16, 'ru': 23},
+                         compression)
+
+    def test_pointer_to_suffix(self):
+        compression = {'www.yandex.ru': 12, 'yandex.ru': 16, 'ru': 23}
+
+        actual = _encode_name('mail.yandex.ru', compression, 40)
+
+        self.assertEqual(b'\x04mail\xc0\x10', actual)
+        self.assertEqual(40, compression['mail.yandex.ru'])
+
+    def test_whole_name_pointer(self):
+        compression = {'yandex.ru': 16, 'ru': 23}
+
+        self.assertEqual(b'\xc0\x10',
+                         _encode_name('yandex.ru.', compression, 40))
+
+    def test_root(self):
+        self.assertEqual(b'\x00', _encode_name('', {}, 12))
+
+
 class TestDecodeString(unittest.TestCase):
     def test_labels(self):
         in_bytes = b'\x01\x00\x80\x00\x00\x01\x00\x01\x00\x00\x00\x00' \
@@ -109,6 +153,67 @@ class TestDecodeString(unittest.TestCase):
         self.assertEqual(expected, actual)
 
 
+class TestDecodeNameCache(unittest.TestCase):
+    in_bytes = b'\x01\x00\x80\x00\x00\x01\x00\x01\x00\x00\x00\x00' \
+               b'\x03www\x06yandex\x02ru\x00\x00\x01\x00\x01' \
+               b'\x04mail\xc0\x10\xc0\x0c'
+
+    def test_suffixes_cached(self):
+        names = {}
+
+        actual = _decode_name(self.in_bytes, 12, names)
+
+        self.assertEqual(('www.yandex.ru', 27), actual)
+        self.assertEqual({12: 'www.yandex.ru', 16: 'yandex.ru', 23: 'ru',
+                          26: ''}, names)
+
+    def test_pointer_to_cached_suffix(self):
+        names = {}
+        _decode_name(self.in_bytes, 12, names)
+
+        actual = _decode_name(self.in_bytes, 31, names)
+
+        self.assertEqual(('mail.yandex.ru', 38), actual)
+        self.assertEqual('mail.yandex.ru', names[31])
+
+    def test_cached_name_offset(self):
+        names = {}
+        _decode_name(self.in_bytes, 12, names)
+
+        self.assertEqual(('www.yandex.ru', 27),
+                         _decode_name(self.in_bytes, 12, names))
+        self.assertEqual(('www.yandex.ru', 40),
+                         _decode_name(self.in_bytes, 38, names))
+
+    def test_same_as_uncached(self):
+        names = {}
+
+        for offset in (12, 31, 38, 16):
+            self.assertEqual(_decode_name(self.in_bytes, offset),
+                             _decode_name(self.in_bytes, offset, names))
+
+    def test_pointer_to_itself(self):
+        in_bytes = self.in_bytes[:12] + b'\xc0\x0c'
+
+        self.assertRaises(InvalidAnswer, _decode_name, in_bytes, 12, {})
+
+    def test_pointer_loop(self):
+        in_bytes = self.in_bytes[:12] + b'\x01a\xc0\x0c'
+
+        self.assertRaises(InvalidAnswer, _decode_name, in_bytes, 12)
+
+    def test_pointer_forward(self):
+        in_bytes = self.in_bytes[:12] + b'\xc0\x0e\x01a\x00'
+
+        self.assertRaises(InvalidAnswer, _decode_name, in_bytes, 12)
+
+    def test_answer_with_pointer_loop(self):
+        in_bytes = (b'\x01\x00\x80\x00\x00\x01\x00\x00\x00\x00\x00\x00'
+                    b'\xc0\x0c\x00\x01\x00\x01')
+
+        self.assertRaises(InvalidAnswer, Answer.from_bytes, in_bytes)
+
+
 class TestHeaderInit(unittest.TestCase):
     def test_standard_query(self):
         header = _Header(1337, MessageType.QUERY, 1)
@@ -531,6 +636,53 @@ class TestQueryToBytes(unittest.TestCase):
         self.assertEqual(expected, actual)
 
 
+class TestEDNS(unittest.TestCase):
+    def test_query_with_opt(self):
+        query = Query('google.com', RRType.A, payload_size=1232)
+        id_bytes = _encode_number(query.header.identifier)
+
+        expected = id_bytes + b'\x01\x00\x00\x01\x00\x00\x00\x00\x00\x01' \
+                              b'\x06google\x03com\x00\x00\x01\x00\x01' \
+                              b'\x00\x00\x29\x04\xd0\x00\x00\x00\x00\x00\x00'
+        actual = query.to_bytes()
+
+        self.assertEqual(expected, actual)
+
+    def test_template_with_opt(self):
+        actual = get_query_template('google.com', RRType.A,
+                                    payload_size=4096).render(1)
+
+        self.assertEqual(Query('google.com', RRType.A,
+                               payload_size=4096).to_bytes()[2:],
+                         actual[2:])
+
+    def test_answer_opt(self):
+        query = Query('google.com', RRType.A, payload_size=4096)
+        query.additions[0].ttl = 1 << 24
+        query.additions[0].data.options.append((10, b'\x01\x02'))
+
+        actual = Answer.from_bytes(query.to_bytes())
+
+        self.assertEqual(4096, actual.payload_size)
+        self.assertEqual(ResponseType.BAD_VERSION, actual.response_code)
+        self.assertEqual([(10, b'\x01\x02')], actual.opt.data.options)
+
+    def test_answer_without_opt(self):
+        actual = Answer.from_bytes(Query('google.com').to_bytes())
+
+        self.assertIsNone(actual.opt)
+        self.assertEqual(512, actual.payload_size)
+        self.assertEqual(ResponseType.NO_ERROR, actual.response_code)
+
+    def test_truncated_option(self):
+        in_bytes = bytearray(
+            Query('google.com', payload_size=1232).to_bytes())
+        in_bytes[-2:] = b'\x00\x04'
+        in_bytes += b'\x00\x0a\x00\x05\x01'
+
+        self.assertRaises(InvalidAnswer, Answer.from_bytes, in_bytes)
+
+
 class TestAnswerInit(unittest.TestCase):
     def test_one_A(self):
         header = _Header(0, MessageType.RESPONSE, 1)
@@ -597,3 +749,250 @@ class TestAnswerFromBytes(unittest.TestCase):
         self.assertEqual(0, actual.answers[0].ttl)
         self.assertEqual(4, actual.answers[0].length)
         self.assertEqual(a_resource_data.ip, actual.answers[0].data.ip)
+
+
+class TestAnswerFromBuffer(unittest.TestCase):
+    in_bytes = b'\x00\x00\x80\x00\x00\x01\x00\x01\x00\x00\x00\x00' \
+               b'\x06google\x03com\x00\x00\x01\x00\x01' \
+               b'\xc0\x0c\x00\x01\x00\x01\x00\x00\x00\x00' \
+               b'\x00\x04\xac\xd9\x0en'
+
+    def test_memoryview(self):
+        actual = Answer.from_bytes(memoryview(self.in_bytes))
+
+        self.assertEqual('google.com', actual.answers[0].name)
+        self.assertEqual('172.217.14.110', actual.answers[0].data.ip)
+
+    def test_bytearray(self):
+        actual = Answer.from_bytes(bytearray(self.in_bytes))
+
+        self.assertEqual('google.com', actual.questions[0].name)
+        self.assertEqual('172.217.14.110', actual.answers[0].data.ip)
+
+    def test_compressed_PTR(self):
+        in_bytes = b'\x00\x00\x80\x00\x00\x01\x00\x01\x00\x00\x00\x00' \
+                   b'\x03224\x03182\x03240\x0287\x07in-addr\x04arpa\x00' \
+                   b'\x00\x0c\x00\x01' \
+                   b'\xc0\x0c\x00\x0c\x00\x01\x00\x00\x00\x00\x00\x05' \
+                   b'\x02vk\xc0\x23'
+
+        actual = Answer.from_bytes(in_bytes)
+
+        self.assertEqual('vk.arpa', actual.answers[0].data.name)
+
+
+class TestLazyAnswerFromBytes(unittest.TestCase):
+    in_bytes = b'\x00\x00\x80\x00\x00\x01\x00\x01\x00\x01\x00\x01' \
+               b'\x06google\x03com\x00\x00\x01\x00\x01' \
+               b'\xc0\x0c\x00\x01\x00\x01\x00\x00\x00\x00' \
+               b'\x00\x04\xac\xd9\x0en' \
+               b'\xc0\x0c\x00\x02\x00\x01\x00\x00\x00\x00' \
+               b'\x00\x06\x03ns1\xc0\x0c' \
+               b'\xc0\x38\x00\x01\x00\x01\x00\x00\x00\x00' \
+               b'\x00\x04\xd8\xef\x20\x0a'
+
+    def test_header_and_questions_decoded(self):
+        actual = Answer.from_bytes(self.in_bytes, lazy=True)
+
+        self.assertEqual(1, actual.header.answer_count)
+        self.assertEqual('google.com', actual.questions[0].name)
+        self.assertIsNone(actual._answers)
+        self.assertIsNone(actual._authorities)
+        self.assertIsNone(actual._additions)
+
+    def test_sections_decoded_on_access(self):
+        actual = Answer.from_bytes(self.in_bytes, lazy=True)
+
+        self.assertEqual('ns1.google.com', actual.authorities[0].data.name)
+        self.assertIsNone(actual._answers)
+        self.assertIsNone(actual._additions)
+
+        self.assertEqual('172.217.14.110', actual.answers[0].data.ip)
+        self.assertEqual('ns1.google.com', actual.additions[0].name)
+        self.assertEqual('216.239.32.10', actual.additions[0].data.ip)
+        self.assertIs(actual.answers, actual.answers)
+
+    def test_truncated_record(self):
+        self.assertRaises(InvalidAnswer, Answer.from_bytes,
+                          self.in_bytes[:-1], lazy=True)
+
+    def test_invalid_record_on_access(self):
+        in_bytes = bytearray(self.in_bytes)
+        in_bytes[32] = 0xff
+
+        actual = Answer.from_bytes(in_bytes, lazy=True)
+
+        with self.assertRaises(InvalidAnswer):
+            actual.answers
+
+    def test_unknown_type_kept_raw(self):
+        in_bytes = bytearray(self.in_bytes)
+        in_bytes[30:32] = b'\x00\x2e'
+
+        actual = Answer.from_bytes(bytes(in_bytes))
+
+        self.assertEqual(46, actual.answers[0].type_)
+        self.assertEqual(b'\xac\xd9\x0en', actual.answers[0].data.data)
+        self.assertEqual(bytes(in_bytes), actual.to_bytes())
+
+
+class TestSlots(unittest.TestCase):
+    def test_no_instance_dict(self):
+        in_bytes = b'\x00\x00\x80\x00\x00\x01\x00\x01\x00\x00\x00\x00' \
+                   b'\x06google\x03com\x00\x00\x01\x00\x01' \
+                   b'\xc0\x0c\x00\x01\x00\x01\x00\x00\x00\x00' \
+                   b'\x00\x04\xac\xd9\x0en'
+        answer = Answer.from_bytes(in_bytes)
+        query = Query('google.com')
+
+        for obj in (answer, answer.header, answer.questions[0],
+                    answer.answers[0], answer.answers[0].data,
+                    query, query.header, query.question):
+            self.assertFalse(hasattr(obj, '__dict__'), type(obj).__name__)
+
+
+class TestMessageToBytes(unittest.TestCase):
+    def test_query_several_questions(self):
+        query = Query('www.example.com')
+        query.add_question('mail.example.com', RRType.MX)
+        id_bytes = _encode_number(query.header.identifier)
+
+        expected = id_bytes + \
+            b'\x01\x00\x00\x02\x00\x00\x00\x00\x00\x00' \
+            b'\x03www\x07example\x03com\x00\x00\x01\x00\x01' \
+            b'\x04mail\xc0\x10\x00\x0f\x00\x01'
+        actual = query.to_bytes()
+
+        self.assertEqual(expected, actual)
+        self.assertEqual(2, query.header.question_count)
+
+    def test_query_without_compression(self):
+        query = Query('www.example.com')
+        query.add_question('mail.example.com', RRType.MX)
+
+        actual = query.to_bytes(compress=False)
+
+        self.assertEqual(query.header.to_bytes()
+                         + query.questions[0].to_bytes()
+                         + query.questions[1].to_bytes(), actual)
+
+    def test_answer_round_trip(self):
+        header = _Header(4242, MessageType.RESPONSE, 1,
+                         is_authority_answer=True)
+        questions = [_Question('example.com', RRType.MX)]
+        answers = [
+            _ResourceRecord('example.com', RRType.MX, 0, ttl=300,
+                            data=_MXResourceData(
+                                b'\x00\x0a' + _encode_name('mx.example.com'),
+                                0)),
+            _ResourceRecord('example.com', RRType.NS, 0, ttl=300,
+                            data=_NSResourceData(
+                                _encode_name('ns1.example.com'), 0)),
+            _ResourceRecord('example.com', RRType.SOA, 0, ttl=300,
+                            data=_SOAResourceData(
+                                _encode_name('ns1.example.com')
+                                + _encode_name('admin.example.com')
+                                + b'\x00\x00\x00\x01' + bytes(16), 0)),
+        ]
+        additions = [
+            _ResourceRecord('ns1.example.com', RRType.A, 4, ttl=300,
+                            data=_AResourceData(b'\xc0\x00\x02\x01'))
+        ]
+        answer = Answer(header, questions, answers, [], additions)
+
+        compressed = answer.to_bytes()
+        plain = answer.to_bytes(compress=False)
+        actual = Answer.from_bytes(compressed)
+
+        self.assertLess(len(compressed), len(plain))
+        self.assertEqual(3, actual.header.answer_count)
+        self.assertEqual(1, actual.header.additional_count)
+        self.assertEqual(10, actual.answers[0].data.preference)
+        self.assertEqual('mx.example.com', actual.answers[0].data.name)
+        self.assertEqual('ns1.example.com', actual.answers[1].data.name)
+        self.assertEqual('admin.example.com',
+                         actual.answers[2].data.email_addr)
+        self.assertEqual(1, actual.answers[2].data.serial_number)
+        self.assertEqual('ns1.example.com', actual.additions[0].name)
+        self.assertEqual('192.0.2.1', actual.additions[0].data.ip)
+        self.assertEqual(compressed, Answer.from_bytes(plain).to_bytes())
+
+
+class TestQueryTemplate(unittest.TestCase):
+    def test_render(self):
+        template = QueryTemplate('google.com', RRType.NS)
+
+        expected = b'\x12\x34\x01\x00\x00\x01\x00\x00\x00\x00\x00\x00' \
+                   b'\x06google\x03com\x00\x00\x02\x00\x01'
+        actual = template.render(0x1234)
+
+        self.assertEqual(expected, actual)
+
+    def test_render_returns_new_buffer(self):
+        template = QueryTemplate('google.com')
+
+        first = template.render(1)
+        second = template.render(2)
+
+        self.assertEqual(b'\x00\x01', first[:2])
+        self.assertEqual(b'\x00\x02', second[:2])
+        self.assertEqual(first[2:], second[2:])
+
+    def test_same_as_query(self):
+        query = Query('github.com', RRType.A, is_recursion_desired=False)
+
+        actual = QueryTemplate('github.com', RRType.A, False).render(
+            query.header.identifier)
+
+        self.assertEqual(query.to_bytes(), actual)
+
+    def test_cached(self):
+        self.assertIs(get_query_template('python.org', RRType.A),
+                      get_query_template('python.org', RRType.A))
+        self.assertIsNot(get_query_template('python.org', RRType.A),
+                         get_query_template('python.org', RRType.NS))
+
+
+class TestBatchDecoding(unittest.TestCase):
+    first = b'\x00\x01\x80\x00\x00\x01\x00\x01\x00\x00\x00\x00' \
+            b'\x06google\x03com\x00\x00\x01\x00\x01' \
+            b'\xc0\x0c\x00\x01\x00\x01\x00\x00\x00\x00' \
+            b'\x00\x04\xac\xd9\x0en'
+    second = b'\x00\x02\x80\x00\x00\x01\x00\x02\x00\x00\x00\x00' \
+             b'\x06python\x03org\x00\x00\x02\x00\x01' \
+             b'\xc0\x0c\x00\x02\x00\x01\x00\x00\x00\x00' \
+             b'\x00\x06\x03ns1\xc0\x0c' \
+             b'\xc0\x0c\x00\x02\x00\x01\x00\x00\x00\x00' \
+             b'\x00\x06\x03ns2\xc0\x0c'
+    invalid = b'\x00\x03\x80\x00\x00\x01\x00\x01'
+
+    def test_decode_records(self):
+        actual = decode_records([self.first, self.invalid, self.second])
+
+        self.assertEqual(
+            [('google.com', RRType.A), ('python.org', RRType.NS),
+             ('python.org', RRType.NS)],
+            [(name, type_) for name, type_, _ in actual])
+        self.assertEqual('172.217.14.110', actual[0][2].ip)
+        self.assertEqual('ns1.python.org', actual[1][2].name)
+
+    def test_decode_records_buffer(self):
+        buffer = self.second + self.first
+
+        actual = decode_records(buffer, [0, len(self.second)])
+
+        self.assertEqual(3, len(actual))
+        self.assertEqual('172.217.14.110', actual[2][2].ip)
+
+    def test_decode_records_unknown_type(self):
+        rrsig = (b'\xc0\x0c\x00\x2e\x00\x01\x00\x00\x00\x00'
+                 b'\x00\x03\x00\x01\x02')
+        message = bytearray(self.first + rrsig + self.first[28:])
+        message[7] = 3
+
+        actual = decode_records([bytes(message)])
+
+        self.assertEqual([RRType.A, 46, RRType.A],
+                         [type_ for _, type_, _ in actual])
+        self.assertEqual(b'\x00\x01\x02', actual[1][2].data)
+        self.assertEqual('172.217.14.110', actual[2][2].ip)
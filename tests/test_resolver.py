@@ -2,22 +2,30 @@ import io
 import logging
 import socket
 import sys
+import threading
 import unittest
 from argparse import Namespace
 
 import pytest
 
 
+from dns import dns_servers
 from dns.dns_message import (
     Query, Answer, _Header, _Question, _ResourceRecord,
-    _NSResourceData, _SOAResourceData, _AResourceData, _PTRResourceData)
+    _NSResourceData, _SOAResourceData, _AResourceData, _PTRResourceData,
+    _CNAMEResourceData, _DNAMEResourceData, _encode_name)
 from dns.dns_enums import (
     RRType, MessageType, ResponseType)
 from unittest import mock
 from utils import (
     resolver, get_user_log_level_selection
 )
-from utils.zhuban_exceptions import InvalidServerResponse
+from utils.transport import TCPTransport
+from utils.zhuban_exceptions import (
+    InvalidServerResponse, ResolutionFailed, ZoneTransferRefused)
+from helpers import (
+    SOA, FakeTCPServer, FakeUDPServer, a_record, axfr_message, host,
+    make_response, ns_answer, ns_record, referral, soa, soa_record)
 
 
 @pytest.fixture()
@@ -83,9 +91,30 @@ def test_record_a(mock_udp_query, args):
     assert answer.answers[0].data.ip == '213.180.204.62'
 
 
+@mock.patch('utils.resolver.get_root_servers')
+@mock.patch('utils.resolver.udp_query')
+def test_find_name_servers_invalid_section(mock_udp_query,
+                                           mock_get_root_servers):
+    """
+    Ошибка в разделе ленивого ответа выдаётся как InvalidServerResponse
+    """
+    mock_get_root_servers.return_value = ['198.41.0.4']
+    mock_udp_query.return_value = \
+        b'\x00\x00\x81\x00\x00\x01\x00\x00\x00\x01\x00\x00' \
+        b'\x05dead1\x03com\x00\x00\x02\x00\x01' \
+        b'\xc0\x0c\x00\x02\x00\x03\x00\x00\x00\x3c\x00\x02\xc0\x0c'
+
+    with pytest.raises(InvalidServerResponse):
+        resolver.find_name_servers('dead1.com', protocol='udp', port=53,
+                                   timeout=10)
+
+
+@mock.patch('utils.resolver.lookup_addresses')
 @mock.patch('utils.resolver.get_root_servers')
 @mock.patch('utils.resolver.get_answer')
-def test_find_name_servers(mock_get_answer, mock_get_root_servers):
+def test_find_name_servers(mock_get_answer, mock_get_root_servers,
+                           mock_lookup_addresses):
+    mock_lookup_addresses.return_value = ['87.240.182.1']
     mock_get_root_servers.return_value = {'198.41.0.4'}
 
     header = _Header(
@@ -95,11 +124,31 @@ def test_find_name_servers(mock_get_answer, mock_get_root_servers):
         'vk.com', type_=RRType.NS, length=18,
         data=_NSResourceData(
             b'\xc0\x0c\x00\x02\x00\x01\x00\x00\x02\x0b\x00\x12'
-            b'\x03ns4\x09vkontakte\x02ru\x00', offset=0))]
+            b'\x03ns4\x09vkontakte\x02ru\x00', offset=12))]
     mock_get_answer.return_value = Answer(header, questions, answers, [], [])
 
     assert resolver.find_name_servers(
-        'vk.com', protocol='udp', port=53, timeout=10) == ['ns4.vkontakte.ru']
+        'vk.com', protocol='udp', port=53, timeout=10) == ['87.240.182.1']
+    assert mock_get_answer.call_args.kwargs['lazy']
+    mock_lookup_addresses.assert_called_once_with(
+        'ns4.vkontakte.ru', protocol='udp', port=53, timeout=10)
+
+
+@mock.patch('utils.resolver.lookup_addresses')
+@mock.patch('utils.resolver.get_root_servers')
+@mock.patch('utils.resolver.get_answer')
+def test_find_name_servers_uses_glue(mock_get_answer, mock_get_root_servers,
+                                     mock_lookup_addresses):
+    mock_get_root_servers.return_value = {'198.41.0.4'}
+    mock_get_answer.return_value = ns_answer(
+        'vk.com', ['ns1.vk.com', 'ns2.vk.com'],
+        [('ns1.vk.com', b'\x57\xf0\xb6\x01'),
+         ('ns2.vk.com', b'\x57\xf0\xb6\x02')])
+
+    assert resolver.find_name_servers(
+        'vk.com', protocol='udp', port=53, timeout=10) == \
+        ['87.240.182.1', '87.240.182.2']
+    mock_lookup_addresses.assert_not_called()
 
 
 @mock.patch('utils.resolver.get_answer')
@@ -116,8 +165,8 @@ def test_get_primary_name_server_1(mock_find_name_servers, mock_get_answer):
         data=_SOAResourceData(
             b'\xc0\x0c\x00\x06\x00\x01\x00\x00\x02\x0b\x00\x44'
             b'\x03ns1\x09vkontakte\x02ru\x00'
-            b'\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
-            b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00', offset=0))]
+            b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+            b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00', offset=12))]
     mock_get_answer.return_value = Answer(header, questions, answers, [], [])
 
     assert resolver.get_primary_name_server(
@@ -143,7 +192,7 @@ def test_get_primary_name_server_2(mock_find_name_servers, mock_get_answer):
 def test_resolve_ip4_recursive(mock_get_answer):
     args = Namespace(hostname='vk.com', protocol='udp', server='8.8.8.8',
                      port=53, timeout=10, inverse=False, dump=False,
-                     debug=False, ipv6=False)
+                     debug=False, ipv6=False, payload_size=1232)
 
     header = _Header(
         1823, MessageType.RESPONSE, question_count=1, answer_count=1)
@@ -156,47 +205,316 @@ def test_resolve_ip4_recursive(mock_get_answer):
     assert resolver.resolve(args).answers[0].data.ip == '87.240.182.224'
 
 
-@mock.patch('utils.resolver.get_answer')
-def test_resolve_reverse_lookup(mock_get_answer):
-    args = Namespace(hostname='87.240.182.224', protocol='udp',
-                     server='8.8.8.8', port=53, timeout=10, inverse=True,
-                     dump=False, debug=False, ipv6=False)
-
-    f_header = _Header(
-        1823, MessageType.RESPONSE, question_count=1, answer_count=0,
-        authority_count=1)
-    s_header = _Header(
-        2938, MessageType.RESPONSE, question_count=1, answer_count=1)
-    questions = [_Question('vk.com')]
-    authorities = [_ResourceRecord(
-        'vk.com', type_=RRType.NS, length=18,
-        data=_NSResourceData(
-            b'\xc0\x0c\x00\x02\x00\x01\x00\x00\x02\x0b\x00\x12'
-            b'\x03ns4\x09vkontakte\x02ru\x00', offset=0))]
-    answers = [_ResourceRecord(
-        'vk.com', type_=RRType.PTR, length=8,
-        data=_PTRResourceData(b'\x02vk\x03com\x00'))]
-    first = Answer(f_header, questions, [], authorities, [])
-    second = Answer(s_header, questions, answers, [], [])
-    mock_get_answer.side_effect = [first, second]
+class TestResolveReverseLookup(unittest.TestCase):
+    qname = '224.182.240.87.in-addr.arpa'
 
-    assert (resolver.resolve_reverse_lookup(args).answers[0]
-            .data.name == 'vk.com')
+    def setUp(self):
+        resolver.delegation_cache.clear()
+        resolver.infra_cache.clear()
+        self.addCleanup(resolver.delegation_cache.clear)
+        self.addCleanup(resolver.infra_cache.clear)
+        get_answer = mock.patch('utils.resolver.get_answer')
+        self.mock_get_answer = get_answer.start()
+        self.addCleanup(get_answer.stop)
+        self.args = Namespace(hostname='87.240.182.224', protocol='udp',
+                              server=None, port=53, timeout=10,
+                              inverse=True, dump=False, debug=False,
+                              ipv6=False, payload_size=1232)
+
+    def queried(self):
+        return [c.kwargs['server']
+                for c in self.mock_get_answer.call_args_list]
+
+    @mock.patch('utils.resolver.lookup_addresses')
+    def test_resolve_reverse_lookup(self, mock_lookup_addresses):
+        mock_lookup_addresses.return_value = ['87.240.182.1']
+        header = _Header(2938, MessageType.RESPONSE, question_count=1,
+                         answer_count=1)
+        answers = [_ResourceRecord(
+            self.qname, type_=RRType.PTR, length=8,
+            data=_PTRResourceData(b'\x02vk\x03com\x00'))]
+        self.mock_get_answer.side_effect = [
+            referral(self.qname, '182.240.87.in-addr.arpa',
+                     ['ns4.vkontakte.ru'],
+                     [('ns4.vkontakte.ru', b'\x06\x06\x06\x06')]),
+            Answer(header, [_Question(self.qname, RRType.PTR)], answers,
+                   [], [])]
+
+        answer = resolver.resolve_reverse_lookup(self.args)
+
+        self.assertEqual('vk.com', answer.answers[0].data.name)
+        self.assertEqual(self.qname,
+                         self.mock_get_answer.call_args.args[0])
+        self.assertIn(self.queried()[0], dns_servers.revers_lookup_servers)
+        self.assertEqual('87.240.182.1', self.queried()[1])
+        mock_lookup_addresses.assert_called_once_with(
+            'ns4.vkontakte.ru', protocol='udp', port=53, timeout=10,
+            _depth=1)
+
+    def test_referral_loop_stops(self):
+        zone = '182.240.87.in-addr.arpa'
+        self.mock_get_answer.side_effect = (
+            lambda hostname, record_type, **kwargs: referral(
+                hostname, zone, ['ns.' + zone],
+                [('ns.' + zone, b'\x0a\x00\x00\x01')]))
+
+        self.assertRaises(ResolutionFailed,
+                          resolver.resolve_reverse_lookup, self.args)
+        self.assertEqual('10.0.0.1', self.queried()[-1])
+        self.assertEqual(2, len(self.queried()))
+
+    def test_upward_referral_is_lame(self):
+        self.args.server = '8.8.8.8'
+        self.mock_get_answer.side_effect = [
+            referral(self.qname, '182.240.87.in-addr.arpa',
+                     ['ns.182.240.87.in-addr.arpa'],
+                     [('ns.182.240.87.in-addr.arpa',
+                       b'\x0a\x00\x00\x01')]),
+            referral(self.qname, 'in-addr.arpa', ['ns.evil.test'],
+                     [('ns.evil.test', b'\x06\x06\x06\x06')])]
+
+        self.assertRaises(ResolutionFailed,
+                          resolver.resolve_reverse_lookup, self.args)
+        self.assertEqual(['8.8.8.8', '10.0.0.1'], self.queried())
+        self.assertIsNone(resolver.delegation_cache.get('in-addr.arpa'))
+
+
+class TestTransferZone(unittest.TestCase):
+    def transfer(self, handler):
+        server = FakeTCPServer(handler, fragment=True)
+        self.addCleanup(server.close)
+        return resolver.transfer_zone('vk.com', server='127.0.0.1',
+                                      port=server.port, timeout=2)
+
+    def test_multi_message(self):
+        def handler(query, reply):
+            reply(axfr_message(query, SOA, host(0), host(1)))
+            reply(axfr_message(query, *(host(i) for i in range(2, 500))))
+            reply(axfr_message(query, host(500), SOA))
+
+        records = list(self.transfer(handler))
+
+        self.assertEqual(RRType.SOA, records[0].type_)
+        self.assertEqual(502, len(records))
+        self.assertEqual('host500.vk.com', records[-1].name)
+        self.assertEqual('0.0.1.244', records[-1].data.ip)
+
+    def test_records_yielded_incrementally(self):
+        sent = threading.Event()
+
+        def handler(query, reply):
+            reply(axfr_message(query, SOA, host(0)))
+            sent.wait(5)
+            reply(axfr_message(query, SOA))
+
+        records = self.transfer(handler)
+
+        self.assertEqual(RRType.SOA, next(records).type_)
+        self.assertEqual('host0.vk.com', next(records).name)
+        sent.set()
+        self.assertEqual([], list(records))
+
+    def test_refused(self):
+        records = self.transfer(
+            lambda query, reply: reply(axfr_message(query, rcode=5)))
+
+        self.assertRaises(ZoneTransferRefused, list, records)
+
+    def test_stream_cut_short(self):
+        def handler(query, reply):
+            reply(axfr_message(query, SOA, host(0)))
+            raise OSError
+
+        self.assertRaises(InvalidServerResponse, list,
+                          self.transfer(handler))
+
+
+class TestUpdateZone(unittest.TestCase):
+    def setUp(self):
+        query = Query('vk.com', RRType.AXFR).to_bytes()
+        self.snapshot = Answer.from_bytes(axfr_message(
+            query, SOA, host(0), host(1), host(2))).answers
+        self.queries = []
 
+    def update(self, handler):
+        def serve(query, reply):
+            self.queries.append(Answer.from_bytes(query))
+            handler(query, reply)
 
-@mock.patch('utils.resolver.get_answer')
+        server = FakeTCPServer(serve, fragment=True)
+        self.addCleanup(server.close)
+        return resolver.update_zone('vk.com', self.snapshot,
+                                    server='127.0.0.1', port=server.port,
+                                    timeout=2)
+
+    def test_query_carries_snapshot_serial(self):
+        self.update(lambda query, reply: reply(axfr_message(query, SOA)))
+
+        query, = self.queries
+        self.assertEqual(RRType.IXFR, query.questions[0].type_)
+        self.assertEqual(2024010101,
+                         query.authorities[0].data.serial_number)
+
+    def test_up_to_date(self):
+        records = self.update(
+            lambda query, reply: reply(axfr_message(query, SOA)))
+
+        self.assertEqual(self.snapshot, records)
+
+    def test_incremental(self):
+        def handler(query, reply):
+            reply(axfr_message(query, soa(3), SOA, host(1), soa(2),
+                               host(3)))
+            reply(axfr_message(query, soa(2), host(0), soa(3), host(4),
+                               soa(3)))
+
+        records = self.update(handler)
+
+        self.assertEqual(3, records[0].data.serial_number)
+        self.assertEqual(['host2.vk.com', 'host3.vk.com', 'host4.vk.com'],
+                         [r.name for r in records[1:]])
+
+    def test_full_zone(self):
+        def handler(query, reply):
+            reply(axfr_message(query, soa(3), host(5)))
+            reply(axfr_message(query, host(6), soa(3)))
+
+        records = self.update(handler)
+
+        self.assertEqual(3, records[0].data.serial_number)
+        self.assertEqual(['host5.vk.com', 'host6.vk.com'],
+                         [r.name for r in records[1:]])
+
+    def test_full_zone_after_lone_soa(self):
+        def handler(query, reply):
+            reply(axfr_message(query, soa(3)))
+            reply(axfr_message(query, host(7), host(8)))
+            reply(axfr_message(query, soa(3)))
+
+        records = self.update(handler)
+
+        self.assertEqual(3, records[0].data.serial_number)
+        self.assertEqual(['host7.vk.com', 'host8.vk.com'],
+                         [r.name for r in records[1:]])
+
+    def test_incremental_after_lone_soa(self):
+        def handler(query, reply):
+            reply(axfr_message(query, soa(3)))
+            reply(axfr_message(query, SOA, host(0), soa(3), host(5),
+                               soa(3)))
+
+        records = self.update(handler)
+
+        self.assertEqual(3, records[0].data.serial_number)
+        self.assertEqual(['host1.vk.com', 'host2.vk.com', 'host5.vk.com'],
+                         [r.name for r in records[1:]])
+
+    def test_refused(self):
+        self.assertRaises(ZoneTransferRefused, self.update,
+                          lambda query, reply: reply(
+                              axfr_message(query, rcode=4)))
+
+    def test_stream_cut_short(self):
+        def handler(query, reply):
+            reply(axfr_message(query, soa(3), SOA, host(1)))
+            raise OSError
+
+        self.assertRaises(InvalidServerResponse, self.update, handler)
+
+
+@mock.patch('utils.resolver.transfer_zone')
+@mock.patch('utils.resolver.update_zone')
+@mock.patch('utils.resolver.find_name_servers')
+def test_get_zone_update_falls_back_to_axfr(
+        mock_find_name_servers, mock_update_zone, mock_transfer_zone):
+    mock_find_name_servers.return_value = ['ns1.vk.ru']
+    mock_update_zone.side_effect = ZoneTransferRefused
+    mock_transfer_zone.return_value = iter(['SOA', 'A'])
+
+    assert resolver.get_zone_update(
+        'vk.com', ['SOA'], port=53, timeout=10) == ['SOA', 'A']
+    assert mock_transfer_zone.call_args.kwargs['server'] == 'ns1.vk.ru'
+
+
+@mock.patch('utils.resolver.transfer_zone')
+@mock.patch('utils.resolver.update_zone')
+@mock.patch('utils.resolver.find_name_servers')
+def test_get_zone_update_skips_notauth(
+        mock_find_name_servers, mock_update_zone, mock_transfer_zone):
+    mock_find_name_servers.return_value = ['ns1.vk.ru', 'ns4.vk.ru']
+    mock_update_zone.side_effect = [InvalidServerResponse,
+                                    InvalidServerResponse]
+    mock_transfer_zone.side_effect = [InvalidServerResponse,
+                                      iter(['SOA', 'A'])]
+
+    assert resolver.get_zone_update(
+        'vk.com', ['SOA'], port=53, timeout=10) == ['SOA', 'A']
+    assert mock_transfer_zone.call_count == 2
+
+
+@mock.patch('utils.resolver.transfer_zone')
+@mock.patch('utils.resolver.find_name_servers')
+def test_get_zone_dump(mock_find_name_servers, mock_transfer_zone):
+    mock_find_name_servers.return_value = ['ns1.vk.ru', 'ns4.vk.ru']
+
+    def refused():
+        raise ZoneTransferRefused
+        yield
+
+    query = Query('vk.com', RRType.AXFR).to_bytes()
+    soa, = Answer.from_bytes(axfr_message(query, SOA)).answers
+    mock_transfer_zone.side_effect = [refused(), iter([soa])]
+
+    answer = resolver.get_zone_dump('vk.com', port=53, timeout=10)
+    assert answer.answers == [soa]
+    assert answer.header.answer_count == 1
+    assert mock_transfer_zone.call_args.kwargs['server'] == 'ns4.vk.ru'
+
+
+@mock.patch('utils.resolver.transfer_zone')
 @mock.patch('utils.resolver.find_name_servers')
-def test_get_zone_dump(mock_find_name_servers, mock_get_answer):
+def test_get_zone_dump_skips_notauth(mock_find_name_servers,
+                                     mock_transfer_zone):
     mock_find_name_servers.return_value = ['ns1.vk.ru', 'ns4.vk.ru']
 
-    f_header = _Header(2932, MessageType.RESPONSE, 1,
-                       response_type=ResponseType.REFUSED)
-    s_header = _Header(2928, MessageType.RESPONSE, 1, answer_count=1)
-    questions = [_Question('vk.com', RRType.AXFR)]
-    mock_get_answer.side_effect = [Answer(f_header, questions, [], [], []),
-                                   Answer(s_header, questions, [], [], [])]
+    def notauth():
+        raise InvalidServerResponse
+        yield
+
+    mock_transfer_zone.side_effect = [notauth(), iter(['SOA'])]
+
+    answer = resolver.get_zone_dump('vk.com', port=53, timeout=10)
+    assert answer.answers == ['SOA']
+    assert mock_transfer_zone.call_count == 2
+
+
+@mock.patch('utils.resolver.transfer_zone')
+@mock.patch('utils.resolver.find_name_servers')
+def test_get_zone_dump_refused(mock_find_name_servers, mock_transfer_zone):
+    mock_find_name_servers.return_value = ['ns1.vk.ru']
+    mock_transfer_zone.side_effect = ZoneTransferRefused
+
+    answer = resolver.get_zone_dump('vk.com', port=53, timeout=10)
+    assert not answer.answers
+    assert answer.header.response_type == ResponseType.REFUSED
+
+
+@mock.patch('utils.resolver.find_name_servers')
+def test_get_zone_dump_without_name_servers(mock_find_name_servers):
+    mock_find_name_servers.return_value = []
+
+    assert resolver.get_zone_dump('vk.com', port=53, timeout=10) is None
+
+
+@mock.patch('utils.resolver.transfer_zone')
+@mock.patch('utils.resolver.find_name_servers')
+def test_stream_zone_dump_refused(mock_find_name_servers,
+                                  mock_transfer_zone):
+    mock_find_name_servers.return_value = ['ns1.vk.ru']
+    mock_transfer_zone.side_effect = ZoneTransferRefused
 
-    assert not resolver.get_zone_dump('vk.com', port=53, timeout=10).answers
+    with pytest.raises(ZoneTransferRefused):
+        list(resolver.stream_zone_dump('vk.com', port=53, timeout=10))
 
 
 class TestSendMessage(unittest.TestCase):
@@ -212,8 +530,34 @@ class TestSendMessage(unittest.TestCase):
 
     @mock.patch('utils.resolver.udp_query')
     def test_too_long_message(self, mock_udp_query):
+        mock_udp_query.return_value = bytearray(1233)
+
+        self.assertRaises(InvalidServerResponse, resolver.send_query,
+                          **self.argv)
+
+    @mock.patch('utils.resolver.udp_query')
+    def test_too_long_message_without_edns(self, mock_udp_query):
         mock_udp_query.return_value = bytearray(513)
 
+        self.assertRaises(InvalidServerResponse, resolver.send_query,
+                          payload_size=None, **self.argv)
+
+    @mock.patch('utils.resolver.udp_query')
+    def test_large_message_with_edns(self, mock_udp_query):
+        mock_udp_query.return_value = bytearray(4096)
+
+        response = resolver.send_query(payload_size=4096, **self.argv)
+
+        self.assertEqual(4096, len(response))
+
+    def test_oversized_datagram_not_truncated(self):
+        def handler(query, reply):
+            reply(make_response(query) + bytes(1500))
+
+        server = FakeUDPServer(handler)
+        self.addCleanup(server.close)
+        self.argv.update(server='127.0.0.1', port=server.port, timeout=2)
+
         self.assertRaises(InvalidServerResponse, resolver.send_query,
                           **self.argv)
 
@@ -225,13 +569,209 @@ class TestSendMessage(unittest.TestCase):
     def test_gaierror(self, mock_udp_query):
         self.assertRaises(socket.gaierror, resolver.send_query, **self.argv)
 
-    @mock.patch('socket.socket.recv', side_effect=ConnectionError)
+    @mock.patch('socket.socket.recvfrom', side_effect=ConnectionError)
     def test_connectionerror(self, mock_connectionerror):
         self.assertRaises(
             ConnectionError, resolver.send_query, **self.argv
         )
 
 
+class TestTruncatedFallback(unittest.TestCase):
+    def setUp(self):
+        self.argv = {'protocol': 'udp', 'server': '8.8.8.8', 'port': 53,
+                     'timeout': 10}
+        self.fallbacks = resolver.get_tcp_fallback_counts().get('8.8.8.8', 0)
+        resolver.answer_cache.clear()
+        self.addCleanup(resolver.answer_cache.clear)
+
+    @mock.patch('utils.resolver.tcp_query')
+    @mock.patch('utils.resolver.udp_query')
+    def test_truncated_retried_over_tcp(self, mock_udp_query,
+                                        mock_tcp_query):
+        def truncated(query, **kwargs):
+            response = bytearray(make_response(query))
+            response[2] |= 0x02
+            return response
+
+        mock_udp_query.side_effect = truncated
+        mock_tcp_query.side_effect = (
+            lambda query, **kwargs: make_response(query, b'\x05\x06\x07\x08'))
+
+        answer = resolver.get_answer('vk.com', RRType.A, **self.argv)
+
+        self.assertFalse(answer.header.is_truncated)
+        self.assertEqual('5.6.7.8', answer.answers[0].data.ip)
+        self.assertEqual(self.fallbacks + 1,
+                         resolver.get_tcp_fallback_counts()['8.8.8.8'])
+
+    @mock.patch('utils.resolver.tcp_query')
+    @mock.patch('utils.resolver.udp_query')
+    def test_complete_answer_not_retried(self, mock_udp_query,
+                                         mock_tcp_query):
+        mock_udp_query.side_effect = (
+            lambda query, **kwargs: make_response(query))
+
+        answer = resolver.get_answer('vk.com', RRType.A, **self.argv)
+
+        self.assertEqual('1.2.3.4', answer.answers[0].data.ip)
+        mock_tcp_query.assert_not_called()
+        self.assertEqual(
+            self.fallbacks,
+            resolver.get_tcp_fallback_counts().get('8.8.8.8', 0))
+
+
+class TestEDNSFallback(unittest.TestCase):
+    def setUp(self):
+        self.argv = {'protocol': 'udp', 'server': '8.8.8.8', 'port': 53,
+                     'timeout': 10}
+        resolver.answer_cache.clear()
+        self.addCleanup(resolver.answer_cache.clear)
+
+    def resolve(self, edns_error):
+        def udp_query(query, **kwargs):
+            if query[11]:
+                return edns_error(query)
+            return make_response(query)
+
+        with mock.patch('utils.resolver.udp_query',
+                        side_effect=udp_query) as mock_udp_query:
+            answer = resolver.get_answer('vk.com', RRType.A, **self.argv)
+
+        self.assertEqual('1.2.3.4', answer.answers[0].data.ip)
+        self.assertEqual(2, mock_udp_query.call_count)
+
+    def test_format_error_retried_without_opt(self):
+        def format_error(query):
+            return bytes(query[:2]) + b'\x81\x81' + bytes(query[4:])
+
+        self.resolve(format_error)
+
+    def test_bad_version_retried_without_opt(self):
+        def bad_version(query):
+            # OPT запись запроса с расширенным кодом ответа BADVERS (16)
+            opt = b'\x00\x00\x29\x04\xd0\x01\x00\x00\x00\x00\x00'
+            return (bytes(query[:2]) + b'\x81\x80' + bytes(query[4:-11])
+                    + opt)
+
+        self.resolve(bad_version)
+
+    @mock.patch('utils.resolver.udp_query')
+    def test_without_edns_not_retried(self, mock_udp_query):
+        mock_udp_query.side_effect = (
+            lambda query, **kwargs: bytes(query[:2]) + b'\x81\x81'
+            + bytes(query[4:]))
+
+        answer = resolver.get_answer('vk.com', RRType.A, payload_size=None,
+                                     **self.argv)
+
+        self.assertEqual(ResponseType.FORMAT_ERROR,
+                         answer.header.response_type)
+        self.assertEqual(1, mock_udp_query.call_count)
+
+
+class TestCoalescing(unittest.TestCase):
+    def setUp(self):
+        resolver.answer_cache.clear()
+        self.addCleanup(resolver.answer_cache.clear)
+        self.stats = resolver.get_coalescing_stats()
+
+    @mock.patch('utils.resolver.udp_query')
+    def test_concurrent_duplicates_sent_once(self, mock_udp_query):
+        release = threading.Event()
+
+        def udp_query(query, **kwargs):
+            release.wait(5)
+            return make_response(query)
+
+        def call():
+            answers.append(resolver.get_answer(
+                'VK.com', RRType.A, protocol='udp', server='8.8.8.8',
+                port=53, timeout=10))
+
+        mock_udp_query.side_effect = udp_query
+        answers = []
+        threads = [threading.Thread(target=call) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for _ in range(500):
+            if (resolver.get_coalescing_stats()['coalesced']
+                    == self.stats['coalesced'] + 4):
+                break
+            threading.Event().wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, mock_udp_query.call_count)
+        self.assertEqual(['1.2.3.4'] * 5,
+                         [a.answers[0].data.ip for a in answers])
+        self.assertEqual({'queries': self.stats['queries'] + 1,
+                          'coalesced': self.stats['coalesced'] + 4},
+                         resolver.get_coalescing_stats())
+
+
+class TestServerSelection(unittest.TestCase):
+    def setUp(self):
+        resolver.answer_cache.clear()
+        resolver.infra_cache.clear()
+        self.addCleanup(resolver.answer_cache.clear)
+        self.addCleanup(resolver.infra_cache.clear)
+        explore = mock.patch.object(resolver.infra_cache, 'explore', 0)
+        explore.start()
+        self.addCleanup(explore.stop)
+
+    @mock.patch('utils.resolver.udp_query')
+    def test_fastest_server_with_failover(self, mock_udp_query):
+        def udp_query(query, *, server, **kwargs):
+            if server == '10.0.0.9':
+                raise socket.timeout('timed out')
+            return make_response(query)
+
+        mock_udp_query.side_effect = udp_query
+        resolver.infra_cache.record_rtt('10.0.0.9', 0.01)
+        resolver.infra_cache.record_rtt('10.0.0.2', 0.5)
+
+        answer = resolver._query_fastest(
+            'vk.com', RRType.A, ['10.0.0.1', '10.0.0.2', '10.0.0.9'],
+            protocol='udp', port=53, timeout=10)
+
+        self.assertEqual('1.2.3.4', answer.answers[0].data.ip)
+        self.assertEqual(
+            [('10.0.0.9', 0.2), ('10.0.0.1', 10)],
+            [(c.kwargs['server'], c.kwargs['timeout'])
+             for c in mock_udp_query.call_args_list])
+        self.assertEqual(1, resolver.infra_cache.get('10.0.0.9')[2])
+        self.assertEqual(0, resolver.infra_cache.get('10.0.0.1')[2])
+
+    @mock.patch('utils.resolver.udp_query')
+    def test_failover_on_invalid_response(self, mock_udp_query):
+        def udp_query(query, *, server, **kwargs):
+            if server == '10.0.0.9':
+                return query[:2] + b'\x81\x80'
+            return make_response(query)
+
+        mock_udp_query.side_effect = udp_query
+        resolver.infra_cache.record_rtt('10.0.0.9', 0.01)
+
+        answer = resolver._query_fastest(
+            'vk.com', RRType.A, ['10.0.0.1', '10.0.0.9'],
+            protocol='udp', port=53, timeout=10)
+
+        self.assertEqual('1.2.3.4', answer.answers[0].data.ip)
+        self.assertEqual(
+            ['10.0.0.9', '10.0.0.1'],
+            [c.kwargs['server'] for c in mock_udp_query.call_args_list])
+
+    @mock.patch('utils.resolver.udp_query')
+    def test_all_servers_time_out(self, mock_udp_query):
+        mock_udp_query.side_effect = socket.timeout('timed out')
+
+        self.assertRaises(socket.timeout, resolver._query_fastest,
+                          'vk.com', RRType.A, ['10.0.0.1', '10.0.0.2'],
+                          protocol='udp', port=53, timeout=1)
+        self.assertEqual(2, mock_udp_query.call_count)
+
+
 class TestUDPQuery(unittest.TestCase):
     def setUp(self):
         self.argv = {
@@ -239,14 +779,16 @@ class TestUDPQuery(unittest.TestCase):
             'port': 53,
             'timeout': 10
         }
-        self.bytes_ = Query('yandex.com').to_bytes()
+        query = Query('yandex.com')
+        query.header.identifier = 0
+        self.bytes_ = query.to_bytes()
 
     @mock.patch(
-        'socket.socket.recv',
-        return_value=b'\x00\x00\x81\x80\x00\x01\x00\x01\x00\x00\x00\x00'
-                     b'\x06yandex\x03com\x00\x00\x01\x00\x01'
-                     b'\xc0\x0c\x00\x01\x00\x01\x00\x00\x00\x00\x00'
-                     b'\x04\xd5\xb4\xcc\x3e')
+        'socket.socket.recvfrom',
+        return_value=(b'\x00\x00\x81\x80\x00\x01\x00\x01\x00\x00\x00\x00'
+                      b'\x06yandex\x03com\x00\x00\x01\x00\x01'
+                      b'\xc0\x0c\x00\x01\x00\x01\x00\x00\x00\x00\x00'
+                      b'\x04\xd5\xb4\xcc\x3e', ('8.8.8.8', 53)))
     def test_A(self, mock_socket_recv):
         response = resolver.udp_query(self.bytes_, **self.argv)
         answer = Answer.from_bytes(response)
@@ -254,19 +796,19 @@ class TestUDPQuery(unittest.TestCase):
         self.assertEqual(answer.answers[0].name, 'yandex.com')
         self.assertEqual(answer.answers[0].data.ip, '213.180.204.62')
 
-    @mock.patch('socket.socket.recv', side_effect=socket.timeout)
+    @mock.patch('socket.socket.recvfrom', side_effect=socket.timeout)
     def test_timeout(self, mock_socket_recv):
         self.assertRaises(
             socket.timeout, resolver.udp_query, self.bytes_, **self.argv
         )
 
-    @mock.patch('socket.socket.recv', side_effect=socket.gaierror)
+    @mock.patch('socket.socket.recvfrom', side_effect=socket.gaierror)
     def test_gaierror(self, mock_socket_recv):
         self.assertRaises(
             socket.gaierror, resolver.udp_query, self.bytes_, **self.argv
         )
 
-    @mock.patch('socket.socket.recv', side_effect=ConnectionError)
+    @mock.patch('socket.socket.recvfrom', side_effect=ConnectionError)
     def test_connectionerror(self, mock_connectionerror):
         self.assertRaises(
             ConnectionError, resolver.udp_query, self.bytes_, **self.argv
@@ -275,46 +817,238 @@ class TestUDPQuery(unittest.TestCase):
 
 class TestTCPQuery(unittest.TestCase):
     def setUp(self):
+        self.server = FakeTCPServer(self.handle)
         self.argv = {
-            'server': '8.8.8.8',
-            'port': 53,
+            'server': '127.0.0.1',
+            'port': self.server.port,
             'timeout': 10
         }
         self.bytes_ = Query('google.com').to_bytes()
-
-    def mock_recv(bufsize):
-        size = b'\x00\x2c'
-        response = \
-            b'\x00\x00\x81\x80\x00\x01\x00\x01\x00\x00\x00\x00' \
-            b'\x06google\x03com\x00\x00\x01\x00\x01\xc0\x0c' \
-            b'\x00\x01\x00\x01\x00\x00\x00\x00\x00\x04\x4a\x7d\xe8\xe7'
-        if bufsize == 2:
-            return size
-        else:
-            return response
-
-    @mock.patch('socket.socket.recv', side_effect=mock_recv)
-    def test_A(self, mock_socket_recv):
+        transport = mock.patch('utils.resolver._tcp_transport',
+                               TCPTransport())
+        self.transport = transport.start()
+        self.addCleanup(transport.stop)
+        self.addCleanup(self.transport.close)
+        self.addCleanup(self.server.close)
+
+    @staticmethod
+    def handle(query, reply):
+        if b'google' in query:
+            reply(query[:2] +
+                  b'\x81\x80\x00\x01\x00\x01\x00\x00\x00\x00'
+                  b'\x06google\x03com\x00\x00\x01\x00\x01\xc0\x0c'
+                  b'\x00\x01\x00\x01\x00\x00\x00\x00\x00\x04'
+                  b'\x4a\x7d\xe8\xe7')
+        elif b'closed' in query:
+            raise OSError
+
+    def test_A(self):
         response = resolver.tcp_query(self.bytes_, **self.argv)
         answer = Answer.from_bytes(response)
 
         self.assertEqual(answer.questions[0].name, 'google.com')
         self.assertEqual(answer.answers[0].data.ip, '74.125.232.231')
 
-    @mock.patch('socket.socket.recv', side_effect=socket.timeout)
-    def test_timeout(self, mock_socket_recv):
+    def test_timeout(self):
+        self.argv['timeout'] = 0.1
         self.assertRaises(
-            socket.timeout, resolver.tcp_query, self.bytes_, **self.argv
+            socket.timeout, resolver.tcp_query,
+            Query('silent.com').to_bytes(), **self.argv
         )
 
-    @mock.patch('socket.socket.recv', side_effect=socket.gaierror)
-    def test_gaierror(self, mock_socket_recv):
+    @mock.patch('socket.create_connection', side_effect=socket.gaierror)
+    def test_gaierror(self, mock_create_connection):
         self.assertRaises(
             socket.gaierror, resolver.tcp_query, self.bytes_, **self.argv
         )
 
-    @mock.patch('socket.socket.recv', side_effect=ConnectionError)
-    def test_connectionerror(self, mock_connectionerror):
+    def test_connectionerror(self):
         self.assertRaises(
-            ConnectionError, resolver.tcp_query, self.bytes_, **self.argv
+            ConnectionError, resolver.tcp_query,
+            Query('closed.com').to_bytes(), **self.argv
         )
+
+
+def alias(owner, type_, target):
+    data = _encode_name(target)
+    cls = (_CNAMEResourceData if type_ == RRType.CNAME
+           else _DNAMEResourceData)
+    return _ResourceRecord(owner, type_, len(data), cls(data, 0), ttl=300)
+
+
+class TestResolveIterative(unittest.TestCase):
+    """
+    Спуск по фиктивной иерархии: корень -> org/net -> example.org/
+    example.net, у каждой зоны свой сервер
+    """
+
+    zones = {'': '198.41.0.4', 'org': '10.0.0.1', 'net': '10.0.0.2',
+             'example.org': '10.1.0.1', 'example.net': '10.2.0.1'}
+
+    def setUp(self):
+        resolver.answer_cache.clear()
+        resolver.delegation_cache.clear()
+        resolver.infra_cache.clear()
+        self.addCleanup(resolver.answer_cache.clear)
+        self.addCleanup(resolver.delegation_cache.clear)
+        self.addCleanup(resolver.infra_cache.clear)
+
+        root = mock.patch('utils.resolver.get_root_servers',
+                          return_value={'198.41.0.4'})
+        root.start()
+        self.addCleanup(root.stop)
+        get_answer = mock.patch('utils.resolver.get_answer',
+                                side_effect=self.get_answer)
+        self.mock_get_answer = get_answer.start()
+        self.addCleanup(get_answer.stop)
+
+        self.servers = {ip: zone for zone, ip in self.zones.items()}
+        self.records = {
+            'www.example.org': [alias('www.example.org', RRType.CNAME,
+                                      'cdn.example.net')],
+            'cdn.example.net': [a_record('cdn.example.net',
+                                         b'\x05\x06\x07\x08')],
+            'old.example.org': [alias('old.example.org', RRType.DNAME,
+                                      'example.net')],
+        }
+        self.lame = set()
+        self.upward = set()
+
+    def get_answer(self, hostname, record_type, *, server, **kwargs):
+        answer = self.respond(hostname, record_type, server)
+        resolver._cache_answer(hostname, record_type, answer)
+        return answer
+
+    def respond(self, hostname, record_type, server):
+        questions = [_Question(hostname, record_type)]
+        if server in self.lame:
+            header = _Header(1, MessageType.RESPONSE, 1,
+                             response_type=ResponseType.REFUSED)
+            return Answer(header, questions, [], [], [])
+        if server in self.upward:
+            return referral(hostname, 'org', ['ns.evil.test'],
+                            [('ns.evil.test', b'\x06\x06\x06\x06')])
+
+        zone = self.servers[server]
+        children = [z for z in self.zones
+                    if z != zone and resolver._is_subdomain(z, zone)
+                    and resolver._is_subdomain(hostname, z)]
+        if children:
+            child = min(children, key=len)
+            return referral(hostname, child, ['ns.' + child],
+                            [('ns.' + child,
+                              bytes(map(int,
+                                        self.zones[child].split('.'))))])
+
+        records = self.records.get(hostname)
+        if records is None:
+            records = [r for owner, rs in self.records.items()
+                       for r in rs if r.type_ == RRType.DNAME
+                       and hostname.endswith('.' + owner)]
+        if records:
+            header = _Header(1, MessageType.RESPONSE, 1,
+                             answer_count=len(records))
+            return Answer(header, questions, records, [], [])
+
+        header = _Header(1, MessageType.RESPONSE, 1,
+                         response_type=ResponseType.NAME_ERROR,
+                         authority_count=1)
+        return Answer(header, questions, [], [soa_record(zone)], [])
+
+    def resolve(self, hostname):
+        return resolver.resolve_iterative(hostname, RRType.A,
+                                          protocol='udp', port=53,
+                                          timeout=10)
+
+    def queried(self):
+        return [(c.args[0], c.kwargs['server'])
+                for c in self.mock_get_answer.call_args_list]
+
+    def test_cname_across_zones(self):
+        answer = self.resolve('www.example.org')
+
+        self.assertEqual('www.example.org', answer.questions[0].name)
+        self.assertEqual([RRType.CNAME, RRType.A],
+                         [r.type_ for r in answer.answers])
+        self.assertEqual('5.6.7.8', answer.answers[1].data.ip)
+        self.assertEqual(
+            [('www.example.org', '198.41.0.4'),
+             ('www.example.org', '10.0.0.1'),
+             ('www.example.org', '10.1.0.1'),
+             ('cdn.example.net', '198.41.0.4'),
+             ('cdn.example.net', '10.0.0.2'),
+             ('cdn.example.net', '10.2.0.1')],
+            self.queried())
+
+    def test_repeated_lookup_uses_caches(self):
+        self.resolve('www.example.org')
+        self.mock_get_answer.reset_mock()
+
+        self.assertEqual('5.6.7.8', self.resolve('www.example.org')
+                         .answers[1].data.ip)
+        self.resolve('mail.example.org')
+
+        self.assertEqual([('mail.example.org', '10.1.0.1')], self.queried())
+
+    def test_dname(self):
+        answer = self.resolve('cdn.old.example.org')
+
+        self.assertEqual([RRType.DNAME, RRType.A],
+                         [r.type_ for r in answer.answers])
+        self.assertEqual('cdn.example.net', answer.answers[1].name)
+
+    def test_nxdomain(self):
+        answer = self.resolve('nope.example.org')
+
+        self.assertEqual(ResponseType.NAME_ERROR,
+                         answer.header.response_type)
+        self.assertEqual(RRType.SOA, answer.authorities[0].type_)
+
+    def test_cname_loop(self):
+        self.records['a.example.org'] = [
+            alias('a.example.org', RRType.CNAME, 'b.example.org')]
+        self.records['b.example.org'] = [
+            alias('b.example.org', RRType.CNAME, 'a.example.org')]
+
+        self.assertRaises(ResolutionFailed, self.resolve, 'a.example.org')
+
+    @mock.patch.object(resolver.infra_cache, 'explore', 0)
+    def test_lame_server_skipped(self):
+        self.lame.add('10.1.0.9')
+        resolver.delegation_cache.put(
+            'example.org', [ns_record('example.org', 'ns1.example.org'),
+                            ns_record('example.org', 'ns2.example.org')],
+            [a_record('ns1.example.org', b'\x0a\x01\x00\x09'),
+             a_record('ns2.example.org', b'\x0a\x01\x00\x01')])
+
+        answer = self.resolve('nope.example.org')
+
+        self.assertEqual(ResponseType.NAME_ERROR,
+                         answer.header.response_type)
+        self.assertEqual([('nope.example.org', '10.1.0.9'),
+                          ('nope.example.org', '10.1.0.1')], self.queried())
+
+    def test_refusing_root_fails(self):
+        self.lame.add('198.41.0.4')
+
+        self.assertRaises(ResolutionFailed, self.resolve, 'www.example.org')
+
+    def test_upward_referral_is_lame(self):
+        self.upward.add('10.1.0.1')
+
+        self.assertRaises(ResolutionFailed, self.resolve, 'www.example.org')
+        self.assertEqual(['ns.example.org'],
+                         resolver.delegation_cache.get('example.org')[0])
+        self.assertEqual((['ns.org'], {'ns.org': ['10.0.0.1']}),
+                         resolver.delegation_cache.get('org'))
+        self.assertEqual(('www.example.org', '10.1.0.1'),
+                         self.queried()[-1])
+
+    def test_resolve_without_server(self):
+        args = Namespace(hostname='cdn.example.net', protocol='udp',
+                         server=None, port=53, timeout=10, inverse=False,
+                         dump=False, debug=False, ipv6=False,
+                         payload_size=1232)
+
+        self.assertEqual('5.6.7.8',
+                         resolver.resolve(args).answers[0].data.ip)
@@ -0,0 +1,354 @@
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+from dns.dns_enums import RRType
+from dns.dns_message import get_query_template
+from utils import resolver
+from utils.transport import (
+    TCPTransport, UDPMultiplexer, UDPTransport, _FrameReader, _TimerWheel)
+from helpers import FakeTCPServer, FakeUDPServer, make_response, send
+
+
+class TestUDPTransport(unittest.TestCase):
+    def setUp(self):
+        self.transport = UDPTransport(pool_size=1)
+        self.servers = []
+
+    def tearDown(self):
+        self.transport.close()
+        for server in self.servers:
+            server.close()
+
+    def serve(self, handler):
+        server = FakeUDPServer(handler)
+        self.servers.append(server)
+        return {'server': '127.0.0.1', 'port': server.port, 'timeout': 2}
+
+    def test_echo(self):
+        args = self.serve(lambda query, reply: reply(query + b'!'))
+
+        self.assertEqual(b'\x12\x34query!',
+                         self.transport.query(b'\x12\x34query', **args))
+
+    def test_socket_reused(self):
+        args = self.serve(lambda query, reply: reply(query))
+
+        self.transport.query(b'\x00\x01', **args)
+        first = self.transport._idle[0]
+        self.transport.query(b'\x00\x02', **args)
+
+        self.assertEqual([first], self.transport._idle)
+
+    def test_foreign_datagrams_ignored(self):
+        def handler(query, reply):
+            reply(b'\xff\xff' + query[2:] + b'wrong id')
+            reply(query + b'wrong port', from_other_port=True)
+            reply(query + b'ok')
+
+        args = self.serve(handler)
+
+        self.assertEqual(b'\x00\x07queryok',
+                         self.transport.query(b'\x00\x07query', **args))
+
+    def test_timeout(self):
+        args = self.serve(lambda query, reply: None)
+        args['timeout'] = 0.2
+
+        self.assertRaises(socket.timeout, self.transport.query,
+                          b'\x00\x01', **args)
+        self.assertEqual([], self.transport._idle)
+
+
+class TestTimerWheel(unittest.TestCase):
+    def test_expiry_order(self):
+        wheel = _TimerWheel(tick=0.1, size=8)
+        now = time.monotonic()
+        wheel.add(now + 0.3, 'b')
+        wheel.add(now + 0.1, 'a')
+        wheel.add(now + 5, 'c')
+
+        self.assertEqual([], wheel.advance(now))
+        self.assertEqual(['a'], wheel.advance(now + 0.15))
+        self.assertEqual(['b'], wheel.advance(now + 0.45))
+        self.assertEqual([], wheel.advance(now + 1))
+        self.assertEqual(['c'], wheel.advance(now + 5.2))
+
+    def test_past_deadline(self):
+        wheel = _TimerWheel(tick=0.1, size=8)
+        now = time.monotonic()
+        wheel.add(now - 10, 'late')
+
+        self.assertEqual(['late'], wheel.advance(now + 0.1))
+
+    def test_add_during_advance(self):
+        entered, release = threading.Event(), threading.Event()
+
+        class Blocking(int):
+            def __le__(self, other):
+                entered.set()
+                release.wait(5)
+                return False
+
+        wheel = _TimerWheel(tick=1, size=4)
+        now = time.monotonic()
+        wheel._slots[int(now) % 4].append((Blocking(int(now) + 100), 'x'))
+        results = []
+        advance = threading.Thread(
+            target=lambda: results.append(wheel.advance(now)))
+        advance.start()
+        entered.wait(5)
+        add = threading.Thread(target=wheel.add, args=(now, 'added'))
+        add.start()
+        add.join(0.05)
+        release.set()
+        advance.join(5)
+        add.join(5)
+
+        self.assertEqual([[]], results)
+        self.assertEqual(['added'], wheel.advance(now))
+
+
+class TestUDPMultiplexer(unittest.TestCase):
+    def setUp(self):
+        self.multiplexer = UDPMultiplexer(tick=0.01)
+        self.servers = []
+
+    def tearDown(self):
+        self.multiplexer.close()
+        for server in self.servers:
+            server.close()
+
+    def serve(self, handler):
+        server = FakeUDPServer(handler)
+        self.servers.append(server)
+        return {'server': '127.0.0.1', 'port': server.port, 'timeout': 2}
+
+    def test_out_of_order(self):
+        received = []
+        lock = threading.Lock()
+
+        def handler(query, reply):
+            with lock:
+                received.append((query, reply))
+                if len(received) < 50:
+                    return
+            for query, reply in reversed(received):
+                reply(make_response(query))
+
+        args = self.serve(handler)
+        names = [f'host{i}.example.com' for i in range(50)]
+
+        futures = [self.multiplexer.submit(
+            get_query_template(name).render(), **args) for name in names]
+
+        for name, future in zip(names, futures):
+            response = future.result(timeout=5)
+            encoded_name = get_query_template(name).render()[12:]
+            self.assertEqual(encoded_name, response[12:12 + len(encoded_name)])
+        self.assertEqual(0, len(self.multiplexer))
+
+    def test_unique_identifiers(self):
+        args = self.serve(lambda query, reply: None)
+        query = get_query_template('example.com').render(7)
+
+        for _ in range(100):
+            self.multiplexer.submit(query, **args)
+
+        identifiers = {key[0] for key in self.multiplexer._pending}
+        self.assertEqual(100, len(identifiers))
+
+    def test_timeout(self):
+        def handler(query, reply):
+            if b'answered' in query:
+                reply(make_response(query))
+
+        args = self.serve(handler)
+        args['timeout'] = 0.2
+
+        lost = self.multiplexer.submit(
+            get_query_template('lost.example.com').render(), **args)
+        answered = self.multiplexer.submit(
+            get_query_template('answered.example.com').render(), **args)
+
+        self.assertEqual(b'\x81\x80', answered.result(timeout=5)[2:4])
+        self.assertRaises(socket.timeout, lost.result, timeout=5)
+        self.assertEqual(0, len(self.multiplexer))
+
+    def test_wrong_question_ignored(self):
+        def handler(query, reply):
+            other = get_query_template('other.example.com').render()
+            other[:2] = query[:2]
+            reply(make_response(bytes(other)))
+            reply(make_response(query, ip=b'\x05\x06\x07\x08'))
+
+        args = self.serve(handler)
+
+        response = self.multiplexer.query(
+            get_query_template('example.com').render(), **args)
+
+        self.assertEqual(b'\x05\x06\x07\x08', response[-4:])
+
+
+class TestFrameReader(unittest.TestCase):
+    def setUp(self):
+        self.client, self.server = socket.socketpair()
+        self.addCleanup(self.client.close)
+        self.addCleanup(self.server.close)
+
+    def write(self, data, fragment=False):
+        thread = threading.Thread(target=send,
+                                  args=(self.server, data, fragment))
+        thread.start()
+        self.addCleanup(thread.join)
+
+    @staticmethod
+    def frame(data):
+        return struct.pack('!H', len(data)) + data
+
+    def test_fragmented(self):
+        messages = [bytes(random.getrandbits(8) for _ in range(size))
+                    for size in (1, 2, 700, 65535, 12000)]
+        self.write(b''.join(map(self.frame, messages)), fragment=True)
+
+        reader = _FrameReader(self.client)
+        self.assertEqual(messages, [reader.read_frame() for _ in messages])
+
+    def test_many_frames_per_segment(self):
+        messages = [f'message {i}'.encode() for i in range(100)]
+        self.server.sendall(b''.join(map(self.frame, messages)))
+        self.server.shutdown(socket.SHUT_WR)
+
+        self.assertEqual(messages, list(_FrameReader(self.client)))
+
+    def test_wraps_buffer(self):
+        messages = [bytes([i]) * 40000 for i in range(5)]
+        self.write(b''.join(map(self.frame, messages)), fragment=True)
+
+        reader = _FrameReader(self.client)
+        for message in messages:
+            self.assertEqual(message, reader.read_frame())
+
+    def test_closed_mid_frame(self):
+        self.server.sendall(b'\x00\x10partial')
+        self.server.close()
+
+        self.assertRaises(ConnectionError, list, _FrameReader(self.client))
+
+
+class TestTCPTransport(unittest.TestCase):
+    def setUp(self):
+        self.transport = TCPTransport()
+        self.servers = []
+
+    def tearDown(self):
+        self.transport.close()
+        for server in self.servers:
+            server.close()
+
+    def serve(self, handler, fragment=False):
+        server = FakeTCPServer(handler, fragment)
+        self.servers.append(server)
+        return server, {'server': '127.0.0.1', 'port': server.port,
+                        'timeout': 2}
+
+    def test_connection_reused(self):
+        server, args = self.serve(
+            lambda query, reply: reply(make_response(query)))
+
+        for name in ('a.example.com', 'b.example.com', 'c.example.com'):
+            response = self.transport.query(
+                get_query_template(name).render(), **args)
+            self.assertEqual(b'\x01\x02\x03\x04', response[-4:])
+
+        self.assertEqual(1, len(server.connections))
+
+    def test_pipelining_out_of_order(self):
+        received = []
+        lock = threading.Lock()
+
+        def handler(query, reply):
+            with lock:
+                received.append(query)
+                if len(received) < 20:
+                    return
+            for query in reversed(received):
+                reply(make_response(query, ip=query[13:16] + b'\x00'))
+
+        server, args = self.serve(handler)
+        names = [f'h{i:02}.example.com' for i in range(20)]
+
+        with ThreadPoolExecutor(20) as executor:
+            responses = list(executor.map(
+                lambda name: self.transport.query(
+                    get_query_template(name).render(), **args), names))
+
+        for name, response in zip(names, responses):
+            self.assertEqual(name[:3].encode(), response[-4:-1])
+        self.assertEqual(1, len(server.connections))
+        self.assertEqual(20, len({query[:2] for query in received}))
+
+    def test_large_fragmented_responses(self):
+        def handler(query, reply):
+            reply(query + bytes(60000))
+            reply(query + b'late')
+
+        _, args = self.serve(handler, fragment=True)
+        query = get_query_template('example.com').render()
+
+        response = self.transport.query(query, **args)
+        self.assertEqual(len(query) + 60000, len(response))
+        self.assertEqual(query[2:], response[2:len(query)])
+
+    def test_reconnect_after_idle_close(self):
+        server, args = self.serve(
+            lambda query, reply: reply(make_response(query)))
+        query = get_query_template('example.com').render()
+
+        self.transport.query(query, **args)
+        server.drop_connections()
+        time.sleep(0.05)
+
+        self.assertEqual(b'\x01\x02\x03\x04',
+                         self.transport.query(query, **args)[-4:])
+        self.assertEqual(2, len(server.connections))
+
+    def test_timeout(self):
+        _, args = self.serve(lambda query, reply: None)
+        args['timeout'] = 0.1
+
+        self.assertRaises(socket.timeout, self.transport.query,
+                          get_query_template('example.com').render(), **args)
+
+
+class TestGetAnswers(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeUDPServer(
+            lambda query, reply: None if b'dead' in query
+            else reply(make_response(query, ip=struct.pack('!I', len(query)))))
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_get_answers(self):
+        multiplexer = UDPMultiplexer()
+        self.addCleanup(multiplexer.close)
+
+        with mock.patch('utils.resolver._udp_multiplexer', multiplexer):
+            answers = resolver.get_answers(
+                ['a.example.com', 'dead.example.com', 'bb.example.com'],
+                RRType.A, server='127.0.0.1', port=self.server.port,
+                timeout=0.3)
+
+        self.assertEqual('0.0.0.42', answers[0].answers[0].data.ip)
+        self.assertIsNone(answers[1])
+        self.assertEqual('0.0.0.43', answers[2].answers[0].data.ip)
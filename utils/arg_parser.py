@@ -102,6 +102,22 @@ def timeout(s):
     return int(s)
 
 
+def payload_size(s):
+    """
+    Проверяет является ли переданная строка валидным размером UDP ответа
+    (EDNS0). Размер 0 отключает EDNS0
+
+    :param s: строковое значение размера в байтах
+    :raise argparse.ArgumentTypeError(msg): если строка не является валидным
+    :return: числовое значение размера либо None для 0
+    """
+    if not s.isdigit() or (int(s) != 0
+                           and int(s) not in range(512, 65535 + 1)):
+        msg = 'задан невалидный размер UDP ответа (0 либо от 512 до 65535)'
+        raise argparse.ArgumentTypeError(msg)
+    return int(s) or None
+
+
 def protocol(s):
     """
     Проверяет является ли переданная строка валиным протоколом
@@ -167,6 +183,13 @@ def parse_args(argv):
         '-p', '--port', type=port, default=53,
         help='Порт сервера\n(default: %(default)s)\n\n')
 
+    parser.add_argument(
+        '-b', '--payload-size', type=payload_size,
+        default=resolver.EDNS_PAYLOAD_SIZE, metavar='BYTES',
+        help='Размер UDP ответа, объявляемый серверу через EDNS0.\n'
+             '0 - запросы без EDNS0 (ответ не больше 512 байт)\n'
+             '(default: %(default)s)\n\n')
+
     hostname_type = domain_name
     if is_inverse:
         hostname_type = ipv4 if not is_ipv6 else ipv6
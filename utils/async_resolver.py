@@ -0,0 +1,746 @@
+"""
+Асинхронный (asyncio) аналог utils.resolver
+
+Использует тот же кодек (Query/Answer, шаблоны запросов), но сетевой обмен
+ведётся через транспорты цикла событий, поэтому множество резолвов
+выполняются одновременно в одном потоке:
+
+    answers = await asyncio.gather(*(
+        get_answer(name, RRType.A, protocol='udp', server='8.8.8.8',
+                   port=53, timeout=2)
+        for name in names))
+"""
+import asyncio
+import random
+import socket
+import struct
+import time
+import weakref
+
+from dns.dns_enums import ResponseType, RRType
+from dns.dns_message import get_query_template
+from .resolver import (
+    _ALIAS, _EDNS_ERRORS, _FINAL, _LAME, _MAX_ALIASES, _MAX_DEPTH,
+    _MAX_REFERRALS, _REFERRAL, EDNS_PAYLOAD_SIZE, _cache_answer,
+    _cache_delegation, _coalescing, _decode_response,
+    _decode_transfer_message, _get_cached_answer, _get_glue,
+    _get_reverse_servers, _get_start_servers, _interpret,
+    _make_final_answer, _make_zone_dump, _tcp_fallbacks, answer_cache,
+    get_ip_reverse_notation, infra_cache
+)
+from .cache import AsyncInFlightRequests
+from .transport import _question_key
+from .zhuban_exceptions import (
+    InvalidServerResponse, ResolutionFailed, ZoneTransferRefused
+)
+
+_udp_transports = weakref.WeakKeyDictionary()
+
+# Одинаковые одновременные запросы get_answer из корутин одного цикла
+# событий уходят к серверу один раз (см. resolver.get_coalescing_stats)
+_in_flight = AsyncInFlightRequests(_coalescing)
+
+
+class _DNSDatagramProtocol(asyncio.DatagramProtocol):
+    """
+    Протокол датаграмм: раздаёт ответы ожидающим Future по ключу
+    (идентификатор, адрес сервера, вопрос), как UDPMultiplexer
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.pending = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            key = (struct.unpack_from('!H', data)[0], addr[:2],
+                   _question_key(data))
+        except (IndexError, struct.error):
+            return
+
+        future = self.pending.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc):
+        pass
+
+    def connection_lost(self, exc):
+        pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(
+                    exc or ConnectionError('Транспорт закрыт'))
+
+
+class AsyncUDPTransport:
+    """
+    UDP транспорт для asyncio: один сокет на цикл событий, любое число
+    запросов в полёте
+    """
+
+    def __init__(self):
+        self._protocol = None
+        self._lock = None
+
+    async def _get_protocol(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            if (self._protocol is None
+                    or self._protocol.transport.is_closing()):
+                loop = asyncio.get_running_loop()
+                _, self._protocol = await loop.create_datagram_endpoint(
+                    _DNSDatagramProtocol, local_addr=('0.0.0.0', 0),
+                    family=socket.AF_INET)
+        return self._protocol
+
+    def close(self):
+        """
+        Закрывает сокет, незавершённые запросы получают ConnectionError
+        """
+        if self._protocol is not None:
+            self._protocol.transport.close()
+            self._protocol = None
+
+    async def query(self, query: bytes, *, server, port, timeout) -> bytes:
+        """
+        Отправляет dns-запрос и ждёт ответ. Идентификатор запроса заменяется
+        свободным для этого сервера и вопроса
+
+        :param bytes query: объект bytes, содержащий запрос
+        :param server: адрес сервера
+        :param port: порт
+        :param timeout: время ожидания ответа от сервера
+        :raise socket.timeout: превышено время ожидания
+        :raise socket.gaierror: ошибки связанные с адресом
+        :return: объект bytes содержащий ответ от сервера
+        """
+        protocol = await self._get_protocol()
+        address = (await _resolve_address(server, port), port)
+        question = _question_key(query)
+        query = bytearray(query)
+
+        while True:
+            identifier = random.getrandbits(16)
+            key = (identifier, address, question)
+            if key not in protocol.pending:
+                break
+        struct.pack_into('!H', query, 0, identifier)
+
+        future = asyncio.get_running_loop().create_future()
+        protocol.pending[key] = future
+        try:
+            protocol.transport.sendto(query, address)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise socket.timeout('timed out') from None
+        finally:
+            if protocol.pending.get(key) is future:
+                del protocol.pending[key]
+
+
+async def _resolve_address(server, port) -> str:
+    """
+    Возвращает IPv4 адрес сервера, не блокируя цикл событий
+
+    :raise socket.gaierror: ошибки связанные с адресом
+    """
+    loop = asyncio.get_running_loop()
+    info = await loop.getaddrinfo(server, port, family=socket.AF_INET,
+                                  type=socket.SOCK_DGRAM)
+    return info[0][4][0]
+
+
+def _get_udp_transport() -> AsyncUDPTransport:
+    loop = asyncio.get_running_loop()
+    transport = _udp_transports.get(loop)
+    if transport is None:
+        transport = _udp_transports[loop] = AsyncUDPTransport()
+    return transport
+
+
+async def udp_query(query: bytes, *, server, port, timeout) -> bytes:
+    """
+    Отправляет dns-запрос представленный в виде байт через UDP протокол
+
+    :param bytes query: объект bytes, содержащий запрос
+    :param server: адрес сервера
+    :param port: порт
+    :param timeout: время ожидания ответа от сервера
+    :raise socket.timeout: превышено время ожидания
+    :raise socket.gaierror: ошибки связанные с адресом
+    :return: объект bytes содержащий ответ от сервера
+    """
+    return await _get_udp_transport().query(query, server=server, port=port,
+                                            timeout=timeout)
+
+
+async def tcp_query(query: bytes, *, server, port, timeout) -> bytes:
+    """
+    Отправляет dns-запрос представленный в виде байт через TCP протокол
+
+    :param bytes query: объект bytes, содержащий запрос
+    :param server: адрес сервера
+    :param port: порт
+    :param timeout: время ожидания ответа от сервера
+    :raise socket.timeout: превышено время ожидания
+    :raise socket.gaierror: ошибки связанные с адресом
+    :return: объект bytes содержащий ответ от сервера
+    """
+    async def exchange():
+        reader, writer = await asyncio.open_connection(server, port)
+        try:
+            writer.write(struct.pack('!H', len(query)) + bytes(query))
+            size = struct.unpack('!H', await reader.readexactly(2))[0]
+            return await reader.readexactly(size)
+        except asyncio.IncompleteReadError as e:
+            raise ConnectionError('Соединение закрыто сервером') from e
+        finally:
+            writer.close()
+
+    try:
+        return await asyncio.wait_for(exchange(), timeout)
+    except asyncio.TimeoutError:
+        raise socket.timeout('timed out') from None
+
+
+async def stream_query(query: bytes, *, server, port, timeout):
+    """
+    Асинхронный аналог transport.stream_query: отправляет dns-запрос через
+    отдельное TCP соединение и отдаёт все сообщения ответа по мере их
+    прихода. Соединение закрывается, когда генератор закрыт или исчерпан
+
+    :param bytes query: объект bytes, содержащий запрос
+    :param server: адрес сервера
+    :param port: порт
+    :param timeout: время ожидания каждого сообщения от сервера
+    :raise socket.timeout: превышено время ожидания
+    :raise ConnectionError: если соединение закрыто посреди сообщения
+    :return: асинхронный генератор объектов bytes с идентификатором запроса
+    """
+    async def read(reader, size):
+        try:
+            return await asyncio.wait_for(reader.readexactly(size), timeout)
+        except asyncio.TimeoutError:
+            raise socket.timeout('timed out') from None
+
+    identifier = bytes(query[:2])
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(server, port), timeout)
+    except asyncio.TimeoutError:
+        raise socket.timeout('timed out') from None
+
+    try:
+        writer.write(struct.pack('!H', len(query)) + bytes(query))
+        while True:
+            try:
+                size = struct.unpack('!H', await read(reader, 2))[0]
+            except asyncio.IncompleteReadError as e:
+                if e.partial:
+                    raise ConnectionError(
+                        'Соединение закрыто сервером') from e
+                return
+
+            try:
+                message = await read(reader, size)
+            except asyncio.IncompleteReadError as e:
+                raise ConnectionError('Соединение закрыто сервером') from e
+
+            if message[:2] == identifier:
+                yield message
+    finally:
+        writer.close()
+
+
+async def send_query(*, hostname, record_type: RRType,
+                     protocol: str, server, port, timeout,
+                     payload_size=EDNS_PAYLOAD_SIZE) -> bytes:
+    """
+    Формирует пакет запроса, отправляет его и возвращает ответ от сервера
+
+    :param hostname: доменное имя
+    :param record_type: тип требуемой DNS-записи (A, NS, PTR, и.т.д)
+    :param protocol: протокол сетевего уровня
+    :param server: адрес DNS-сервера
+    :param port: порт DNS-сервера
+    :param timeout: время ожидания ответа от сервера
+    :param payload_size: размер UDP ответа, объявляемый через EDNS0 (None -
+    без EDNS0, ответ не больше 512 байт)
+    :raise InvalidServerResponse: если UDP ответ больше объявленного размера
+    :return: объект bytes содержащий ответ от сервера
+    """
+    query = get_query_template(hostname, record_type,
+                               payload_size=payload_size).render()
+    limit = max(payload_size or 0, 512)
+
+    args = {'server': server, 'port': port, 'timeout': timeout}
+    response = (await udp_query(query, **args) if protocol.lower() == 'udp'
+                else await tcp_query(query, **args))
+
+    if protocol == 'udp' and len(response) > limit:
+        raise InvalidServerResponse
+
+    return response
+
+
+async def get_answer(hostname, record_type,
+                     *, inverse=False, ipv6=False, protocol, server, port,
+                     timeout, lazy=False, payload_size=EDNS_PAYLOAD_SIZE):
+    """
+    Отправляет запрос и декодирует ответ от сервера
+
+    :param hostname: доменное имя (или ip, если inverse)
+    :param record_type: тип требуемой DNS-записи
+    :param inverse: флаг обратного запроса (PTR)
+    :param ipv6: флаг для IPv6
+    :param protocol: протокол сетевого уровня
+    :param server: адрес DNS-сервера
+    :param port: порт DNS-сервера
+    :param timeout: время ожидания ответа от сервера
+    :param lazy: декодировать ли разделы ответа только по требованию
+    :param payload_size: размер UDP ответа, объявляемый через EDNS0
+    :raise InvalidServerResponse: если ответ не удалось декодировать
+    :return: объект Answer
+    """
+    if inverse:
+        hostname = get_ip_reverse_notation(hostname, ipv6=ipv6)
+
+    answer = _get_cached_answer(hostname, record_type)
+    if answer is not None:
+        return answer
+
+    key = (hostname.rstrip('.').lower(), record_type, protocol.lower(),
+           server, port, payload_size, lazy)
+    return await _in_flight.run(key, lambda: _query_answer(
+        hostname, record_type, protocol=protocol, server=server, port=port,
+        timeout=timeout, lazy=lazy, payload_size=payload_size))
+
+
+async def _query_answer(hostname, record_type, *, protocol, server, port,
+                        timeout, lazy, payload_size):
+    """
+    Асинхронный аналог resolver._query_answer
+    """
+    args = {'hostname': hostname, 'record_type': record_type,
+            'server': server, 'port': port, 'timeout': timeout,
+            'payload_size': payload_size}
+    started = time.monotonic()
+    try:
+        response = await send_query(protocol=protocol, **args)
+    except (socket.timeout, ConnectionError):
+        infra_cache.record_timeout(server)
+        raise
+    infra_cache.record_rtt(server, time.monotonic() - started)
+    answer = _decode_response(response, lazy=lazy)
+
+    if payload_size is not None and answer.response_code in _EDNS_ERRORS:
+        # Сервер не понял OPT запись: повторяем запрос без EDNS0, как в
+        # resolver.get_answer
+        args['payload_size'] = None
+        answer = _decode_response(
+            await send_query(protocol=protocol, **args), lazy=lazy)
+
+    if answer.header.is_truncated and protocol.lower() == 'udp':
+        # Обрезанный ответ (флаг TC) повторяется через TCP, как в
+        # resolver.get_answer
+        _tcp_fallbacks[server] += 1
+        answer = _decode_response(await send_query(protocol='tcp', **args),
+                                  lazy=lazy)
+
+    _cache_answer(hostname, record_type, answer)
+    return answer
+
+
+async def find_name_servers(hostname,
+                            *, protocol, port, timeout) -> list:
+    """
+    Находит все name server'ы для домена
+    :param hostname: домен
+    :param protocol: протокол сетевого уровня
+    :param port: порт
+    :param timeout: время ожидания ответа от сервера
+    :return: список IPv4 адресов name server'ов (пустой, если домен не
+    существует либо не делегирован), как в resolver.find_name_servers
+    """
+    args = {'protocol': protocol, 'port': port, 'timeout': timeout}
+    zone, names, addresses = _get_start_servers(hostname)
+    servers = await _resolve_servers(names, addresses, **args)
+    for _ in range(_MAX_REFERRALS):
+        if not servers:
+            return []
+
+        answer = await _query_fastest(hostname, RRType.NS, servers,
+                                      lazy=True, **args)
+        status, value = _interpret(hostname, RRType.NS, answer, zone, [])
+        if status == _LAME:
+            return []
+        if status in (_REFERRAL, _FINAL):
+            _cache_delegation(hostname, answer, zone)
+
+        if status != _REFERRAL:
+            names = [r.data.name for r in answer.answers
+                     if r.type_ == RRType.NS]
+            return await _resolve_all_servers(
+                names, _get_glue(answer, names, hostname), **args)
+
+        zone, names, addresses = value
+        servers = await _resolve_servers(names, addresses, **args)
+
+    return []
+
+
+async def lookup_addresses(hostname, *, protocol, port, timeout,
+                           _depth=0) -> list:
+    """
+    Асинхронный аналог resolver.lookup_addresses
+
+    :param hostname: доменное имя
+    :param protocol: протокол сетевого уровня
+    :param port: порт
+    :param timeout: время ожидания ответа от сервера
+    :return: список IPv4 адресов (пустой, если их найти не удалось)
+    """
+    records = answer_cache.get(hostname, RRType.A)
+    if records is not None:
+        return [r.data.ip for r in records if r.type_ == RRType.A]
+
+    args = {'protocol': protocol, 'port': port, 'timeout': timeout}
+    zone, names, addresses = _get_start_servers(hostname)
+    servers = await _resolve_servers(names, addresses, _depth=_depth,
+                                     **args)
+    for _ in range(_MAX_REFERRALS):
+        if not servers:
+            return []
+
+        answer = await _query_fastest(hostname, RRType.A, servers,
+                                      lazy=True, **args)
+        status, value = _interpret(hostname, RRType.A, answer, zone, [])
+        if status == _LAME:
+            return []
+        if status in (_REFERRAL, _FINAL):
+            _cache_delegation(hostname, answer, zone)
+
+        if status != _REFERRAL:
+            return [r.data.ip for r in answer.answers
+                    if r.type_ == RRType.A]
+
+        zone, names, addresses = value
+        servers = await _resolve_servers(names, addresses, _depth=_depth,
+                                         **args)
+
+    return []
+
+
+async def _query_fastest(hostname, record_type, servers, *, protocol, port,
+                         timeout, **kwargs):
+    """
+    Асинхронный аналог resolver._query_fastest
+    """
+    servers = list(servers)
+    while True:
+        server = infra_cache.choose(servers)
+        try:
+            return await get_answer(
+                hostname, record_type, protocol=protocol, server=server,
+                port=port, timeout=infra_cache.timeout(server, timeout),
+                **kwargs)
+        except (socket.timeout, ConnectionError, InvalidServerResponse):
+            servers.remove(server)
+            if not servers:
+                raise
+
+
+async def _resolve_all_servers(names, glue, *, protocol, port,
+                               timeout) -> list:
+    """
+    Асинхронный аналог resolver._resolve_all_servers
+    """
+    addresses = []
+    for name in names:
+        found = glue.get(name.lower()) or await lookup_addresses(
+            name, protocol=protocol, port=port, timeout=timeout)
+        addresses.extend(ip for ip in found if ip not in addresses)
+
+    return addresses
+
+
+async def _resolve_servers(names, addresses, *, protocol, port, timeout,
+                           _depth=0) -> list:
+    """
+    Асинхронный аналог resolver._resolve_servers
+    """
+    if addresses or _depth >= _MAX_DEPTH:
+        return addresses
+
+    for name in names:
+        found = await lookup_addresses(name, protocol=protocol, port=port,
+                                       timeout=timeout, _depth=_depth + 1)
+        if found:
+            return found
+
+    return []
+
+
+async def get_primary_name_server(hostname,
+                                  *, protocol, port, timeout):
+    """
+    Отдаёт ip адрес primary (master) сервера для домена
+    :param hostname: домен
+    :param protocol: протокол сетевого уровня
+    :param port: порт
+    :param timeout: время ожидания ответа от сервера
+    :return: ip адрес primary сервера
+    """
+    name_servers = await find_name_servers(hostname,
+                                           protocol=protocol, port=port,
+                                           timeout=timeout)
+
+    for name_server in name_servers:
+        answer = await get_answer(hostname, RRType.SOA,
+                                  protocol=protocol, server=name_server,
+                                  port=port, timeout=timeout)
+
+        if answer.header.answer_count:
+            return answer.answers[0].data.name_server
+
+    return None
+
+
+async def resolve_iterative(hostname, record_type, *, protocol, port,
+                            timeout, payload_size=EDNS_PAYLOAD_SIZE):
+    """
+    Асинхронный аналог resolver.resolve_iterative
+
+    :param hostname: доменное имя
+    :param record_type: тип требуемой DNS-записи
+    :param protocol: протокол сетевого уровня
+    :param port: порт
+    :param timeout: время ожидания ответа от сервера
+    :param payload_size: размер UDP ответа, объявляемый через EDNS0
+    :raise ResolutionFailed: если ни один сервер не дал ответа либо
+    цепочка псевдонимов зациклилась
+    :return: объект Answer
+    """
+    args = {'protocol': protocol, 'port': port, 'timeout': timeout,
+            'payload_size': payload_size}
+    chain = []
+    seen = set()
+    qname = hostname
+    while True:
+        if qname.rstrip('.').lower() in seen or len(seen) > _MAX_ALIASES:
+            raise ResolutionFailed
+        seen.add(qname.rstrip('.').lower())
+
+        answer = _get_cached_answer(qname, record_type)
+        if answer is not None:
+            status, value = _interpret(qname, record_type, answer, '', chain)
+        else:
+            answer, status, value = await _resolve_name(
+                qname, record_type, chain, **args)
+
+        if status != _ALIAS:
+            return _make_final_answer(hostname, record_type, answer, chain)
+        qname = value
+
+
+async def _resolve_name(qname, record_type, chain, *, protocol, port,
+                        timeout, payload_size, start=None):
+    """
+    Асинхронный аналог resolver._resolve_name
+    """
+    args = {'protocol': protocol, 'port': port, 'timeout': timeout}
+    zone, names, addresses = start or _get_start_servers(qname)
+    servers = list(await _resolve_servers(names, addresses, **args))
+    error = None
+    for _ in range(_MAX_REFERRALS):
+        if not servers:
+            break
+
+        server = infra_cache.choose(servers)
+        try:
+            answer = await get_answer(
+                qname, record_type, server=server, protocol=protocol,
+                port=port, timeout=infra_cache.timeout(server, timeout),
+                payload_size=payload_size)
+        except (socket.timeout, ConnectionError,
+                InvalidServerResponse) as e:
+            error = e
+            servers.remove(server)
+            continue
+
+        status, value = _interpret(qname, record_type, answer, zone, chain)
+        if status in (_REFERRAL, _FINAL):
+            _cache_delegation(qname, answer, zone)
+        if status == _LAME:
+            servers.remove(server)
+        elif status == _REFERRAL:
+            zone, names, addresses = value
+            servers = list(await _resolve_servers(names, addresses, **args))
+        else:
+            return answer, status, value
+
+    if error is not None:
+        raise error
+    raise ResolutionFailed
+
+
+async def transfer_zone(hostname, *, server, port, timeout):
+    """
+    Асинхронный аналог resolver.transfer_zone: отдаёт записи передачи зоны
+    (AXFR) по мере декодирования сообщений из TCP потока, без повторной
+    SOA записи в конце
+
+    :param hostname: домен (зона)
+    :param server: адрес DNS-сервера
+    :param port: порт DNS-сервера
+    :param timeout: время ожидания каждого сообщения от сервера
+    :raise ZoneTransferRefused: если сервер отказал в передаче
+    :raise InvalidServerResponse: если сообщение не удалось декодировать
+    либо поток оборвался до конца передачи
+    :raise socket.timeout: превышено время ожидания
+    :return: асинхронный генератор _ResourceRecord
+    """
+    query = get_query_template(hostname, RRType.AXFR).render()
+    messages = stream_query(query, server=server, port=port, timeout=timeout)
+
+    soa_count = 0
+    try:
+        async for message in messages:
+            for record in _decode_transfer_message(message):
+                if record.type_ == RRType.SOA:
+                    soa_count += 1
+                    if soa_count == 2:
+                        return
+                elif not soa_count:
+                    raise InvalidServerResponse
+                yield record
+    finally:
+        await messages.aclose()
+
+    if soa_count:
+        raise InvalidServerResponse
+    raise ZoneTransferRefused
+
+
+async def stream_zone_dump(hostname, *, port, timeout):
+    """
+    Асинхронный аналог resolver.stream_zone_dump
+
+    :param hostname: домен
+    :param port: порт
+    :param timeout: время ожидания ответа от сервера
+    :raise ZoneTransferRefused: если ни один сервер не передал зону
+    :return: асинхронный генератор _ResourceRecord
+    """
+    name_servers = await find_name_servers(hostname,
+                                           protocol='udp', port=port,
+                                           timeout=timeout)
+
+    async for record in _transfer_from_any(hostname, name_servers,
+                                           port=port, timeout=timeout):
+        yield record
+
+
+async def _transfer_from_any(hostname, name_servers, *, port, timeout):
+    """
+    Асинхронный аналог resolver._transfer_from_any
+    """
+    for ns in infra_cache.sort(name_servers):
+        records = transfer_zone(hostname, server=ns, port=port,
+                                timeout=timeout)
+        started = time.monotonic()
+        try:
+            first = await records.__anext__()
+        except (ZoneTransferRefused, InvalidServerResponse):
+            continue
+        except (socket.timeout, ConnectionError):
+            infra_cache.record_timeout(ns)
+            continue
+        infra_cache.record_rtt(ns, time.monotonic() - started)
+
+        yield first
+        async for record in records:
+            yield record
+        return
+
+    raise ZoneTransferRefused
+
+
+async def get_zone_dump(hostname, *, port, timeout):
+    """
+    Асинхронный аналог resolver.get_zone_dump: передача зоны читается
+    потоком (см. stream_zone_dump) и собирается в один ответ
+    :param hostname: домен
+    :param port: порт
+    :param timeout: время ожидания ответа от сервера
+    :return: ответ со всеми поддоменами домена (без записей и с кодом
+    REFUSED, если ни один сервер не передал зону) либо None, если у домена
+    нет Name Server'ов
+    """
+    name_servers = await find_name_servers(hostname,
+                                           protocol='udp', port=port,
+                                           timeout=timeout)
+    if not name_servers:
+        return None
+
+    try:
+        records = [record async for record in _transfer_from_any(
+            hostname, name_servers, port=port, timeout=timeout)]
+    except ZoneTransferRefused:
+        return _make_zone_dump(hostname, [], ResponseType.REFUSED)
+
+    return _make_zone_dump(hostname, records)
+
+
+async def resolve(args):
+    """
+    Асинхронный аналог resolver.resolve
+
+    :param args: аргументы командной строки (см. arg_parser)
+    :return: объект Answer
+    """
+    if args.inverse:
+        return await resolve_reverse_lookup(args)
+
+    hostname = args.hostname
+    protocol = args.protocol
+    server = args.server
+    port = args.port
+    timeout = args.timeout
+
+    if args.dump:
+        return await get_zone_dump(hostname, port=port, timeout=timeout)
+
+    record_type = (RRType.AAAA if args.ipv6
+                   else RRType.A)
+
+    if server is None:
+        return await resolve_iterative(hostname, record_type,
+                                       protocol=protocol, port=port,
+                                       timeout=timeout,
+                                       payload_size=args.payload_size)
+
+    return await get_answer(hostname, record_type, inverse=False,
+                            ipv6=args.ipv6, protocol=protocol, server=server,
+                            port=port, timeout=timeout,
+                            payload_size=args.payload_size)
+
+
+async def resolve_reverse_lookup(args):
+    """
+    Асинхронный аналог resolver.resolve_reverse_lookup
+
+    :param args: аргументы командной строки (см. arg_parser)
+    :return: объект Answer
+    """
+    answer, _, _ = await _resolve_name(
+        get_ip_reverse_notation(args.hostname, ipv6=args.ipv6), RRType.PTR,
+        [], protocol=args.protocol, port=args.port, timeout=args.timeout,
+        payload_size=args.payload_size, start=_get_reverse_servers(args))
+    return answer
@@ -0,0 +1,512 @@
+import asyncio
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from dns.dns_enums import ResponseType, RRClass, RRType
+from dns.dns_message import _ResourceRecord
+
+
+class AnswerCache:
+    """
+    Кэш ответов в памяти процесса. Записи хранятся по ключу (имя, тип,
+    класс) вместе с абсолютным сроком жизни, вычисленным из наименьшего TTL
+    записей. Размер ограничен: при переполнении вытесняется давно не
+    использованный ключ (LRU)
+
+    Кроме положительных ответов кэшируются и отрицательные (RFC 2308):
+    NXDOMAIN - для имени с любым типом, NODATA - для пары (имя, тип). Их
+    срок берётся из SOA записи раздела authorities
+    """
+
+    def __init__(self, max_entries=10000, clock=time.monotonic):
+        """
+        Инициализирует AnswerCache
+
+        :param int max_entries: максимальное количество ключей в кэше
+        :param clock: источник времени в секундах
+        """
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(name, type_, class_):
+        return name.rstrip('.').lower(), type_, class_
+
+    def _lookup(self, key, now):
+        """
+        Возвращает не истёкшую запись кэша (stored, expiry, records,
+        response_type) и отмечает её использованной
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, ttl, records, response_type=None):
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+
+        now = self._clock()
+        with self._lock:
+            self._entries[key] = (now, now + ttl, list(records),
+                                  response_type)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _age(records, elapsed):
+        """
+        Копирует записи с TTL, уменьшенным на elapsed секунд
+        """
+        elapsed = int(elapsed)
+        return [_ResourceRecord(r.name, r.type_, r.length, r.data,
+                                r.ttl - elapsed, r.class_)
+                for r in records]
+
+    def get(self, name, type_, class_=RRClass.IN):
+        """
+        Возвращает закэшированные записи с TTL, уменьшенным на время,
+        прошедшее с момента сохранения
+
+        :param name: доменное имя
+        :param type_: тип DNS записи
+        :param class_: класс DNS записи
+        :return: список _ResourceRecord либо None, если записей нет или их
+        срок истёк
+        """
+        now = self._clock()
+        entry = self._lookup(self._key(name, type_, class_), now)
+        if entry is None or entry[3] is not None:
+            return None
+
+        return self._age(entry[2], now - entry[0])
+
+    def put(self, name, type_, records, class_=RRClass.IN):
+        """
+        Сохраняет записи ответа на срок наименьшего из их TTL. Записи с
+        нулевым TTL не кэшируются
+
+        :param name: доменное имя
+        :param type_: тип DNS записи
+        :param records: список _ResourceRecord
+        :param class_: класс DNS записи
+        """
+        if not records:
+            return
+
+        self._store(self._key(name, type_, class_),
+                    min(r.ttl for r in records), records)
+
+    def get_negative(self, name, type_, class_=RRClass.IN):
+        """
+        Возвращает закэшированный отрицательный ответ для (имя, тип)
+
+        :param name: доменное имя
+        :param type_: тип DNS записи
+        :param class_: класс DNS записи
+        :return: кортеж (ResponseType.NAME_ERROR либо ResponseType.NO_ERROR
+        для NODATA, SOA запись с уменьшенным TTL) либо None
+        """
+        now = self._clock()
+        for key_type in (type_, None):
+            entry = self._lookup(self._key(name, key_type, class_), now)
+            if entry is not None and entry[3] is not None:
+                return entry[3], self._age(entry[2], now - entry[0])[0]
+
+        return None
+
+    def put_negative(self, name, type_, response_type, soa,
+                     class_=RRClass.IN):
+        """
+        Сохраняет отрицательный ответ на срок min(TTL SOA, MINIMUM SOA)
+        (RFC 2308, 5)
+
+        :param name: доменное имя
+        :param type_: тип DNS записи
+        :param response_type: ResponseType.NAME_ERROR (NXDOMAIN) либо
+        ResponseType.NO_ERROR (NODATA)
+        :param soa: SOA запись из раздела authorities ответа
+        :param class_: класс DNS записи
+        """
+        if response_type == ResponseType.NAME_ERROR:
+            type_ = None
+
+        self._store(self._key(name, type_, class_),
+                    min(soa.ttl, soa.data.nxdomain_ttl), [soa],
+                    response_type)
+
+    def clear(self):
+        """
+        Удаляет все записи из кэша
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+class DelegationCache:
+    """
+    Кэш делегирований (границ зон): для каждой зоны, встреченной в разделе
+    authorities ответа-делегирования, хранятся имена её Name Server'ов и
+    их адреса из glue записей раздела additions. Срок жизни - наименьший
+    TTL NS записей, при переполнении вытесняется давно не использованная
+    зона (LRU)
+    """
+
+    def __init__(self, max_entries=10000, clock=time.monotonic):
+        """
+        Инициализирует DelegationCache
+
+        :param int max_entries: максимальное количество зон в кэше
+        :param clock: источник времени в секундах
+        """
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, zone, ns_records, additions=()):
+        """
+        Сохраняет делегирование зоны
+
+        :param zone: имя зоны (владелец NS записей)
+        :param ns_records: NS записи делегирования
+        :param additions: записи раздела additions (из них берутся A
+        записи с адресами Name Server'ов)
+        """
+        if not ns_records or self.max_entries <= 0:
+            return
+        ttl = min(r.ttl for r in ns_records)
+        if ttl <= 0:
+            return
+
+        names = [r.data.name for r in ns_records]
+        wanted = {name.lower() for name in names}
+        glue = {}
+        for record in additions:
+            if (record.type_ == RRType.A
+                    and record.name.lower() in wanted):
+                glue.setdefault(record.name.lower(), []).append(
+                    record.data.ip)
+
+        key = zone.rstrip('.').lower()
+        now = self._clock()
+        with self._lock:
+            self._entries[key] = (now + ttl, names, glue)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, zone):
+        """
+        Возвращает делегирование зоны
+
+        :param zone: имя зоны
+        :return: кортеж (список имён Name Server'ов, словарь имя в нижнем
+        регистре -> список IPv4 адресов из glue) либо None
+        """
+        key = zone.rstrip('.').lower()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+
+        return entry[1], entry[2]
+
+    def find(self, hostname):
+        """
+        Находит делегирование ближайшей к hostname закэшированной зоны
+        (сам hostname либо самый длинный его суффикс)
+
+        :param hostname: доменное имя
+        :return: кортеж (зона, список имён Name Server'ов, словарь glue
+        адресов) либо None
+        """
+        labels = hostname.rstrip('.').lower().split('.')
+        for i in range(len(labels)):
+            zone = '.'.join(labels[i:])
+            delegation = self.get(zone)
+            if delegation is not None:
+                return (zone,) + delegation
+
+        return None
+
+    def clear(self):
+        """
+        Удаляет все делегирования из кэша
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+class InfrastructureCache:
+    """
+    Кэш сведений о серверах (как infra cache в Unbound и ADB в BIND): для
+    каждого сервера хранятся сглаженное время ответа (SRTT), его разброс
+    (RTTVAR, RFC 6298) и число таймаутов подряд. По ним выбирается самый
+    быстрый сервер и вычисляется таймаут запроса к нему. Сведения о
+    сервере забываются через ttl секунд без обновлений
+    """
+
+    def __init__(self, max_entries=10000, ttl=900, unknown_rtt=0.376,
+                 min_timeout=0.2, explore=0.05, clock=time.monotonic,
+                 rng=random):
+        """
+        Инициализирует InfrastructureCache
+
+        :param int max_entries: максимальное количество серверов в кэше
+        :param ttl: сколько секунд помнить сервер после обновления
+        :param unknown_rtt: предполагаемое время ответа сервера, о котором
+        ничего не известно (чтобы новые серверы тоже опрашивались)
+        :param min_timeout: нижняя граница адаптивного таймаута
+        :param explore: вероятность выбрать случайный сервер вместо самого
+        быстрого (чтобы обновлять сведения о прочих)
+        :param clock: источник времени в секундах
+        :param rng: источник случайных чисел (random.random/random.choice)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.unknown_rtt = unknown_rtt
+        self.min_timeout = min_timeout
+        self.explore = explore
+        self._clock = clock
+        self._rng = rng
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, server):
+        """
+        Возвращает сведения о сервере
+
+        :param server: адрес сервера
+        :return: кортеж (SRTT либо None, RTTVAR либо None, число таймаутов
+        подряд) либо None, если сервер неизвестен
+        """
+        with self._lock:
+            entry = self._entries.get(server)
+            if entry is None:
+                return None
+            if entry[3] + self.ttl <= self._clock():
+                del self._entries[server]
+                return None
+        return tuple(entry[:3])
+
+    def _update(self, server, srtt, rttvar, timeouts):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[server] = [srtt, rttvar, timeouts, self._clock()]
+            self._entries.move_to_end(server)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_rtt(self, server, rtt):
+        """
+        Учитывает время ответа сервера (RFC 6298, 2) и сбрасывает счётчик
+        таймаутов
+
+        :param server: адрес сервера
+        :param rtt: время ответа в секундах
+        """
+        srtt, rttvar, _ = self.get(server) or (None, None, 0)
+        if srtt is None:
+            srtt, rttvar = rtt, rtt / 2
+        else:
+            rttvar = 0.75 * rttvar + 0.25 * abs(srtt - rtt)
+            srtt = 0.875 * srtt + 0.125 * rtt
+        self._update(server, srtt, rttvar, 0)
+
+    def record_timeout(self, server):
+        """
+        Учитывает, что сервер не ответил
+
+        :param server: адрес сервера
+        """
+        srtt, rttvar, timeouts = self.get(server) or (None, None, 0)
+        self._update(server, srtt, rttvar, timeouts + 1)
+
+    def score(self, server):
+        """
+        Ожидаемое время ответа сервера: SRTT (для неизвестного сервера -
+        unknown_rtt), удвоенное за каждый таймаут подряд
+        """
+        srtt, _, timeouts = self.get(server) or (None, None, 0)
+        if srtt is None:
+            srtt = self.unknown_rtt
+        return srtt * 2 ** min(timeouts, 8)
+
+    def timeout(self, server, default):
+        """
+        Адаптивный таймаут запроса к серверу: SRTT + 4 * RTTVAR (RFC 6298,
+        2), удвоенный за каждый таймаут подряд, но не меньше min_timeout и
+        не больше default
+
+        :param server: адрес сервера
+        :param default: таймаут для сервера, время ответа которого
+        неизвестно, и верхняя граница
+        """
+        srtt, rttvar, timeouts = self.get(server) or (None, None, 0)
+        if srtt is None:
+            return default
+        rto = max(srtt + 4 * rttvar, self.min_timeout)
+        return min(rto * 2 ** min(timeouts, 8), default)
+
+    def choose(self, servers):
+        """
+        Выбирает сервер с наименьшим ожидаемым временем ответа, а с
+        вероятностью explore - случайный
+
+        :param servers: непустой список адресов серверов
+        :return: адрес сервера
+        """
+        if len(servers) > 1 and self._rng.random() < self.explore:
+            return self._rng.choice(servers)
+        return min(servers, key=self.score)
+
+    def sort(self, servers) -> list:
+        """
+        Упорядочивает серверы по ожидаемому времени ответа
+
+        :param servers: адреса серверов
+        :return: список адресов
+        """
+        return sorted(servers, key=self.score)
+
+    def clear(self):
+        """
+        Удаляет сведения обо всех серверах
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+class InFlightRequests:
+    """
+    Объединение одинаковых одновременных запросов (single flight): первый
+    вызов с ключом выполняет запрос, а вызовы с тем же ключом, пришедшие
+    до его завершения, ждут и получают его результат (или исключение)
+    """
+
+    # Общая для всех экземпляров (и AsyncInFlightRequests): счётчики stats
+    # могут разделять несколько объектов из разных потоков
+    _stats_lock = threading.Lock()
+
+    def __init__(self, stats=None):
+        """
+        Инициализирует InFlightRequests
+
+        :param stats: collections.Counter, в котором считаются выполненные
+        ('queries') и объединённые ('coalesced') вызовы
+        """
+        self._stats = stats if stats is not None else {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def run(self, key, function):
+        """
+        Выполняет function() либо дожидается уже выполняющегося вызова с
+        тем же ключом
+
+        :param key: ключ запроса (хэшируемый)
+        :param function: функция без аргументов, выполняющая запрос
+        :return: результат function
+        """
+        with self._lock:
+            future = self._pending.get(key)
+            leader = future is None
+            if leader:
+                future = self._pending[key] = Future()
+            self._count('queries' if leader else 'coalesced')
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = function()
+        except BaseException as e:
+            self._finish(key)
+            future.set_exception(e)
+            raise
+        self._finish(key)
+        future.set_result(result)
+        return result
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] = self._stats.get(name, 0) + 1
+
+    def _finish(self, key):
+        with self._lock:
+            del self._pending[key]
+
+
+class AsyncInFlightRequests(InFlightRequests):
+    """
+    Асинхронный аналог InFlightRequests для корутин. Запросы объединяются
+    только в пределах одного цикла событий
+    """
+
+    async def run(self, key, function):
+        """
+        Выполняет await function() либо дожидается уже выполняющегося
+        вызова с тем же ключом. Если первый вызов отменён, ожидающие
+        выполняют запрос заново
+
+        :param key: ключ запроса (хэшируемый)
+        :param function: функция без аргументов, возвращающая корутину
+        :return: результат корутины
+        """
+        loop = asyncio.get_running_loop()
+        key = (loop, key)
+        while key in self._pending:
+            future = self._pending[key]
+            self._count('coalesced')
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+
+        future = self._pending[key] = loop.create_future()
+        self._count('queries')
+        try:
+            result = await function()
+        except asyncio.CancelledError:
+            del self._pending[key]
+            future.cancel()
+            raise
+        except BaseException as e:
+            del self._pending[key]
+            future.set_exception(e)
+            # Исключение получат ожидающие, если они есть
+            future.exception()
+            raise
+        del self._pending[key]
+        future.set_result(result)
+        return result
@@ -1,15 +1,73 @@
+import collections
+import contextlib
 import ipaddress
-import random
+import itertools
 import socket
-import struct
+import time
 
 from dns import dns_servers
-from dns.dns_enums import RRType
-from dns.dns_message import Query, Answer
+from dns.dns_enums import MessageType, ResponseType, RRType
+from dns.dns_message import (
+    Answer, Query, _Header, _Question, get_query_template
+)
+from .cache import (
+    AnswerCache, DelegationCache, InFlightRequests, InfrastructureCache
+)
+from .transport import (
+    TCPTransport, UDPMultiplexer, UDPTransport, stream_query
+)
 from .zhuban_exceptions import (
-    InvalidAnswer, InvalidServerResponse
+    InvalidAnswer, InvalidServerResponse, ResolutionFailed,
+    ZoneTransferRefused
 )
 
+# Размер UDP ответа, объявляемый серверу через EDNS0 (RFC 6891). 1232
+# байта помещаются в один IPv6 пакет без фрагментации
+EDNS_PAYLOAD_SIZE = 1232
+
+# Буфер приёма UDP ответа: вмещает любую датаграмму, чтобы ответ больше
+# объявленного размера был виден целиком, а не обрезался recvfrom
+_MAX_UDP_SIZE = 65535
+
+# Коды ответа сервера, не поддерживающего EDNS0 либо его версию: запрос
+# повторяется без OPT записи (RFC 6891, 6.2.2 и 7)
+_EDNS_ERRORS = (ResponseType.FORMAT_ERROR, ResponseType.NOT_IMPLEMENTED,
+                ResponseType.BAD_VERSION)
+
+_udp_transport = UDPTransport()
+_tcp_transport = TCPTransport()
+_udp_multiplexer = None
+_tcp_fallbacks = collections.Counter()
+_coalescing = collections.Counter()
+
+# Одинаковые одновременные запросы get_answer из разных потоков уходят к
+# серверу один раз (см. get_coalescing_stats)
+_in_flight = InFlightRequests(_coalescing)
+
+# Кэш положительных и отрицательных ответов get_answer. Размер
+# настраивается через answer_cache.max_entries, очистка -
+# answer_cache.clear()
+answer_cache = AnswerCache()
+
+# Кэш делегирований, по которому find_name_servers начинает спуск с
+# ближайшей известной зоны, а не с корня
+delegation_cache = DelegationCache()
+
+# Время ответа и таймауты серверов: по ним выбирается самый быстрый
+# сервер и вычисляется таймаут запроса к нему
+infra_cache = InfrastructureCache()
+
+# Ограничения спуска по делегированиям: число переходов по ним за один
+# поиск и глубина вложенных поисков адресов Name Server'ов без glue
+_MAX_REFERRALS = 16
+_MAX_DEPTH = 4
+
+# Наибольшая длина цепочки CNAME/DNAME, по которой идёт resolve_iterative
+_MAX_ALIASES = 8
+
+# Исходы разбора одного ответа в resolve_iterative
+_FINAL, _ALIAS, _REFERRAL, _LAME = range(4)
+
 
 def get_root_servers():
     return dns_servers.root_servers
@@ -23,24 +81,257 @@ def find_name_servers(hostname,
     :param protocol: протокол сетевого уровня
     :param port: порт
     :param timeout: время ожидания ответа от сервера
-    :return: список ip адресов name server'ов
+    :return: список IPv4 адресов name server'ов (пустой, если домен не
+    существует либо не делегирован). Адреса берутся из glue записей, а
+    для серверов без glue находятся через lookup_addresses, так что
+    системный резолвер не используется
+    """
+
+    args = {'protocol': protocol, 'port': port, 'timeout': timeout}
+    zone, names, addresses = _get_start_servers(hostname)
+    servers = _resolve_servers(names, addresses, **args)
+    for _ in range(_MAX_REFERRALS):
+        if not servers:
+            return []
+
+        answer = _query_fastest(hostname, RRType.NS, servers, lazy=True,
+                                **args)
+        status, value = _interpret(hostname, RRType.NS, answer, zone, [])
+        if status == _LAME:
+            return []
+        if status in (_REFERRAL, _FINAL):
+            _cache_delegation(hostname, answer, zone)
+
+        if status != _REFERRAL:
+            # NXDOMAIN/NODATA дают пустой список
+            names = [r.data.name for r in answer.answers
+                     if r.type_ == RRType.NS]
+            return _resolve_all_servers(
+                names, _get_glue(answer, names, hostname), **args)
+
+        zone, names, addresses = value
+        servers = _resolve_servers(names, addresses, **args)
+
+    return []
+
+
+def lookup_addresses(hostname, *, protocol, port, timeout,
+                     _depth=0) -> list:
+    """
+    Находит IPv4 адреса узла спуском по делегированиям от ближайшей
+    известной зоны, не обращаясь к системному резолверу. Используется для
+    адресов Name Server'ов, для которых в ответе нет glue записей
+
+    :param hostname: доменное имя
+    :param protocol: протокол сетевого уровня
+    :param port: порт
+    :param timeout: время ожидания ответа от сервера
+    :return: список IPv4 адресов (пустой, если их найти не удалось)
+    """
+    records = answer_cache.get(hostname, RRType.A)
+    if records is not None:
+        return [r.data.ip for r in records if r.type_ == RRType.A]
+
+    args = {'protocol': protocol, 'port': port, 'timeout': timeout}
+    zone, names, addresses = _get_start_servers(hostname)
+    servers = _resolve_servers(names, addresses, _depth=_depth, **args)
+    for _ in range(_MAX_REFERRALS):
+        if not servers:
+            return []
+
+        answer = _query_fastest(hostname, RRType.A, servers, lazy=True,
+                                **args)
+        status, value = _interpret(hostname, RRType.A, answer, zone, [])
+        if status == _LAME:
+            return []
+        if status in (_REFERRAL, _FINAL):
+            _cache_delegation(hostname, answer, zone)
+
+        if status != _REFERRAL:
+            return [r.data.ip for r in answer.answers
+                    if r.type_ == RRType.A]
+
+        zone, names, addresses = value
+        servers = _resolve_servers(names, addresses, _depth=_depth, **args)
+
+    return []
+
+
+def _query_fastest(hostname, record_type, servers, *, protocol, port,
+                   timeout, **kwargs):
     """
+    Отправляет запрос самому быстрому из серверов (см. infra_cache) с
+    адаптивным таймаутом; если сервер не ответил, пробует остальные
 
-    server = random.choice(list(get_root_servers()))
+    :param hostname: доменное имя
+    :param record_type: тип требуемой DNS-записи
+    :param servers: непустой список адресов серверов
+    :param protocol: протокол сетевого уровня
+    :param port: порт
+    :param timeout: наибольшее время ожидания ответа от сервера
+    :param kwargs: прочие аргументы get_answer
+    :raise socket.timeout: если не ответил ни один сервер
+    :raise ConnectionError: если соединиться не удалось ни с одним
+    сервером
+    :raise InvalidServerResponse: если последний из серверов прислал
+    некорректный ответ
+    :return: объект Answer
+    """
+    servers = list(servers)
     while True:
-        answer = get_answer(hostname, RRType.NS,
-                            protocol=protocol, server=server,
-                            port=port, timeout=timeout)
+        server = infra_cache.choose(servers)
+        try:
+            return get_answer(hostname, record_type, protocol=protocol,
+                              server=server, port=port,
+                              timeout=infra_cache.timeout(server, timeout),
+                              **kwargs)
+        except (socket.timeout, ConnectionError, InvalidServerResponse):
+            servers.remove(server)
+            if not servers:
+                raise
+
+
+def _resolve_servers(names, addresses, *, protocol, port, timeout,
+                     _depth=0) -> list:
+    """
+    Возвращает адреса Name Server'ов: адреса из glue, а если их нет -
+    адреса первого из names, который удалось найти через lookup_addresses
 
-        if answer.header.answer_count:
-            break
+    :param names: имена Name Server'ов
+    :param addresses: их адреса из glue записей
+    :return: список IPv4 адресов (пустой, если их нет)
+    """
+    if addresses or _depth >= _MAX_DEPTH:
+        return addresses
+
+    for name in names:
+        found = lookup_addresses(name, protocol=protocol, port=port,
+                                 timeout=timeout, _depth=_depth + 1)
+        if found:
+            return found
+
+    return []
+
+
+def _resolve_all_servers(names, glue, *, protocol, port, timeout) -> list:
+    """
+    Возвращает адреса всех Name Server'ов names: из glue, а для серверов
+    без glue - найденные через lookup_addresses
+
+    :param names: имена Name Server'ов
+    :param glue: словарь имя в нижнем регистре -> список IPv4 адресов
+    :return: список IPv4 адресов без повторов
+    """
+    addresses = []
+    for name in names:
+        found = glue.get(name.lower()) or lookup_addresses(
+            name, protocol=protocol, port=port, timeout=timeout)
+        addresses.extend(ip for ip in found if ip not in addresses)
+
+    return addresses
+
+
+def _get_glue(answer, names, zone) -> dict:
+    """
+    Достаёт из additions ответа glue A записи для Name Server'ов names.
+    Glue для имён вне зоны zone не берётся: сервер не отвечает за их
+    адреса
+
+    :param answer: объект Answer
+    :param names: имена Name Server'ов
+    :param zone: делегированная зона
+    :return: словарь имя в нижнем регистре -> список IPv4 адресов
+    """
+    glue = {name.lower(): [] for name in names
+            if _is_subdomain(name, zone)}
+    for r in answer.additions:
+        if r.type_ == RRType.A and r.name.lower() in glue:
+            glue[r.name.lower()].append(r.data.ip)
+
+    return glue
+
+
+def _get_referral(answer, zone):
+    """
+    Достаёт из ответа-делегирования имена Name Server'ов (authorities) и
+    их адреса из glue A записей (additions)
+
+    :param answer: объект Answer
+    :param zone: делегированная зона
+    :return: кортеж (список имён, список IPv4 адресов)
+    """
+    names = [r.data.name for r in answer.authorities
+             if r.type_ == RRType.NS]
+    addresses = [ip for ips in _get_glue(answer, names, zone).values()
+                 for ip in ips]
+
+    return names, addresses
+
+
+def _is_subdomain(hostname, zone):
+    """
+    Проверяет, что hostname лежит в зоне zone (или совпадает с ней)
+    """
+    hostname = hostname.rstrip('.').lower()
+    zone = zone.rstrip('.').lower()
+    return not zone or hostname == zone or hostname.endswith('.' + zone)
+
+
+def _is_below(hostname, zone):
+    """
+    Проверяет, что hostname лежит в зоне zone и не совпадает с ней
+    """
+    return (_is_subdomain(hostname, zone)
+            and hostname.rstrip('.').lower() != zone.rstrip('.').lower())
 
-        if (not answer.header.answer_count
-                and any(ns for ns in answer.authorities
-                        if ns.type_ == RRType.NS)):
-            server = random.choice(answer.authorities).data.name
 
-    return [answer.data.name for answer in answer.answers]
+def _get_start_servers(hostname):
+    """
+    Возвращает серверы, с которых начинается спуск к hostname: серверы
+    ближайшей закэшированной зоны, затем известные серверы домена верхнего
+    уровня, иначе корневые серверы
+
+    :param hostname: доменное имя
+    :return: кортеж (зона, список имён, список IPv4 адресов)
+    """
+    delegation = delegation_cache.find(hostname)
+    if delegation is not None:
+        zone, names, glue = delegation
+        return zone, names, [ip for ips in glue.values() for ip in ips]
+
+    tld = hostname.rstrip('.').rsplit('.', 1)[-1].lower()
+    if dns_servers.tld_servers.get(tld):
+        return tld, [], list(dns_servers.tld_servers[tld])
+    return '', [], list(get_root_servers())
+
+
+def _cache_delegation(hostname, answer, zone):
+    """
+    Сохраняет в delegation_cache NS записи ответа сервера зоны zone:
+    делегирование из authorities либо NS записи самого hostname из
+    answers, вместе с glue из additions. Игнорируются зоны, не являющиеся
+    предками hostname, делегирования не вглубь zone и NS записи вне zone;
+    glue для имён вне делегированной зоны отбрасывается
+
+    :param hostname: доменное имя запроса
+    :param answer: объект Answer
+    :param zone: зона, которую обслуживает ответивший сервер
+    """
+    if answer.header.answer_count:
+        section, in_bailiwick = answer.answers, _is_subdomain
+    else:
+        section, in_bailiwick = answer.authorities, _is_below
+    ns_records = [r for r in section if r.type_ == RRType.NS]
+    if not ns_records:
+        return
+
+    child = ns_records[0].name
+    if not (_is_subdomain(hostname, child) and in_bailiwick(child, zone)):
+        return
+
+    delegation_cache.put(
+        child, [r for r in ns_records if r.name.lower() == child.lower()],
+        [r for r in answer.additions if _is_subdomain(r.name, child)])
 
 
 def get_primary_name_server(hostname,
@@ -69,10 +360,197 @@ def get_primary_name_server(hostname,
     return None
 
 
+def resolve_iterative(hostname, record_type, *, protocol, port, timeout,
+                      payload_size=EDNS_PAYLOAD_SIZE) -> Answer:
+    """
+    Итеративно разрешает доменное имя: спускается по делегированиям от
+    ближайшей известной зоны (см. delegation_cache) и идёт по цепочке
+    CNAME/DNAME, в том числе в другие зоны, пока не получит записи
+    требуемого типа либо отрицательный ответ. Серверы, которые отвечают
+    ошибкой, не отвечают или ссылаются не вглубь зоны (lame delegation),
+    пропускаются
+
+    :param hostname: доменное имя
+    :param record_type: тип требуемой DNS-записи
+    :param protocol: протокол сетевого уровня
+    :param port: порт
+    :param timeout: время ожидания ответа от сервера
+    :param payload_size: размер UDP ответа, объявляемый через EDNS0
+    :raise ResolutionFailed: если ни один сервер не дал ответа, цепочка
+    псевдонимов зациклилась или превысила _MAX_ALIASES
+    :return: объект Answer с исходным вопросом; в answers - пройденные
+    CNAME/DNAME записи и записи последнего имени цепочки
+    """
+    args = {'protocol': protocol, 'port': port, 'timeout': timeout,
+            'payload_size': payload_size}
+    chain = []
+    seen = set()
+    qname = hostname
+    while True:
+        if qname.rstrip('.').lower() in seen or len(seen) > _MAX_ALIASES:
+            raise ResolutionFailed
+        seen.add(qname.rstrip('.').lower())
+
+        answer = _get_cached_answer(qname, record_type)
+        if answer is not None:
+            status, value = _interpret(qname, record_type, answer, '', chain)
+        else:
+            answer, status, value = _resolve_name(qname, record_type, chain,
+                                                  **args)
+
+        if status != _ALIAS:
+            return _make_final_answer(hostname, record_type, answer, chain)
+        qname = value
+
+
+def _resolve_name(qname, record_type, chain, *, protocol, port, timeout,
+                  payload_size, start=None):
+    """
+    Спуск по делегированиям к одному имени цепочки resolve_iterative
+
+    :param start: кортеж (зона, список имён, список IPv4 адресов) серверов,
+    с которых начинается спуск; по умолчанию _get_start_servers(qname)
+    :return: кортеж (Answer, исход _FINAL либо _ALIAS, имя из _interpret)
+    """
+    args = {'protocol': protocol, 'port': port, 'timeout': timeout}
+    zone, names, addresses = start or _get_start_servers(qname)
+    servers = list(_resolve_servers(names, addresses, **args))
+    error = None
+    for _ in range(_MAX_REFERRALS):
+        if not servers:
+            break
+
+        server = infra_cache.choose(servers)
+        try:
+            answer = get_answer(qname, record_type, server=server,
+                                protocol=protocol, port=port,
+                                timeout=infra_cache.timeout(server, timeout),
+                                payload_size=payload_size)
+        except (socket.timeout, ConnectionError,
+                InvalidServerResponse) as e:
+            error = e
+            servers.remove(server)
+            continue
+
+        status, value = _interpret(qname, record_type, answer, zone, chain)
+        if status in (_REFERRAL, _FINAL):
+            _cache_delegation(qname, answer, zone)
+        if status == _LAME:
+            servers.remove(server)
+        elif status == _REFERRAL:
+            zone, names, addresses = value
+            servers = list(_resolve_servers(names, addresses, **args))
+        else:
+            return answer, status, value
+
+    if error is not None:
+        raise error
+    raise ResolutionFailed
+
+
+def _interpret(qname, record_type, answer, zone, chain):
+    """
+    Разбирает ответ сервера зоны zone на запрос qname. Пройденные
+    CNAME/DNAME записи ответа добавляются в chain
+
+    :return: кортеж (исход, значение): (_FINAL, None) - окончательный
+    ответ (записи либо NXDOMAIN/NODATA); (_ALIAS, имя) - цепочка
+    псевдонимов ведёт к имени, которого в ответе нет; (_REFERRAL, (зона,
+    имена, адреса)) - делегирование вглубь; (_LAME, None) - сервер не
+    годится
+    """
+    header = answer.header
+    if header.response_type not in (ResponseType.NO_ERROR,
+                                    ResponseType.NAME_ERROR):
+        return _LAME, None
+
+    if header.answer_count:
+        name = _follow_aliases(qname, record_type, answer, chain)
+        if (name.lower() == qname.lower()
+                or header.response_type == ResponseType.NAME_ERROR
+                or any(r.type_ == record_type
+                       and r.name.lower() == name.lower()
+                       for r in answer.answers)):
+            return _FINAL, None
+        return _ALIAS, name
+
+    if (header.response_type == ResponseType.NAME_ERROR
+            or any(r.type_ == RRType.SOA for r in answer.authorities)):
+        return _FINAL, None
+
+    child = next((r.name for r in answer.authorities
+                  if r.type_ == RRType.NS), None)
+    if (child is not None and _is_subdomain(qname, child)
+            and _is_below(child, zone)):
+        child = child.rstrip('.').lower()
+        return _REFERRAL, (child,) + _get_referral(answer, child)
+
+    return _LAME, None
+
+
+def _follow_aliases(qname, record_type, answer, chain):
+    """
+    Идёт по CNAME и DNAME записям ответа начиная с qname, добавляя их в
+    chain
+
+    :raise ResolutionFailed: если цепочка длиннее _MAX_ALIASES
+    :return: последнее имя цепочки
+    """
+    name = qname
+    for _ in range(_MAX_ALIASES):
+        key = name.rstrip('.').lower()
+        record = target = None
+        for r in answer.answers:
+            if (r.type_ == RRType.CNAME and record_type != RRType.CNAME
+                    and r.name.rstrip('.').lower() == key):
+                record, target = r, r.data.cname
+                break
+        else:
+            for r in answer.answers:
+                owner = r.name.rstrip('.').lower()
+                if (r.type_ == RRType.DNAME and owner != key
+                        and _is_subdomain(key, owner)):
+                    # Суффикс-владелец DNAME заменяется на его цель
+                    # (RFC 6672, 2.2)
+                    prefix = name.rstrip('.')[:len(key) - len(owner)]
+                    record, target = r, prefix + r.data.dname
+                    break
+
+        if record is None:
+            return name
+        chain.append(record)
+        name = target
+
+    raise ResolutionFailed
+
+
+def _make_final_answer(hostname, record_type, answer, chain):
+    """
+    Собирает ответ resolve_iterative: исходный вопрос, пройденная цепочка
+    псевдонимов и записи последнего ответа
+    """
+    if not chain:
+        return answer
+
+    chained = {id(r) for r in chain}
+    answers = chain + [r for r in answer.answers if id(r) not in chained]
+    header = _Header(answer.header.identifier, MessageType.RESPONSE,
+                     question_count=1, is_recursion_desired=True,
+                     response_type=answer.header.response_type,
+                     answer_count=len(answers),
+                     authority_count=len(answer.authorities),
+                     additional_count=len(answer.additions))
+    return Answer(header, [_Question(hostname, record_type)], answers,
+                  answer.authorities, answer.additions)
+
+
 def tcp_query(query: bytes, *, server, port, timeout) -> bytes:
     """
     Отправляет dns-запрос представленный в виде байт через TCP протокол
 
+    Соединения переиспользуются между запросами, а запросы к одному серверу
+    отправляются конвейером по одному соединению (см. TCPTransport)
+
     :param server: адрес сервера
     :param port: порт
     :param timeout: время ожидания ответа от сервера
@@ -81,56 +559,34 @@ def tcp_query(query: bytes, *, server, port, timeout) -> bytes:
     :raise socket.gaierror: ошибки связанные с адресом
     :return: объект bytes содержащий ответ от сервера
     """
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.settimeout(timeout)
-        s.connect((server, port))
-
-        qsize = struct.pack('!H', len(query))
-
-        try:
-            s.sendall(qsize + query)
-
-            receive_size = struct.unpack('!H', s.recv(2))[0]
-
-            response = s.recv(receive_size)
-        except socket.timeout:
-            raise
-        except socket.gaierror:
-            raise
-        except ConnectionError:
-            raise
-
-    return response
+    return _tcp_transport.query(query, server=server, port=port,
+                                timeout=timeout)
 
 
-def udp_query(query: bytes, *, server, port, timeout) -> bytes:
+def udp_query(query: bytes, *, server, port, timeout,
+              bufsize=_MAX_UDP_SIZE) -> bytes:
     """
     Отправляет dns-запрос представленный в виде байт через UDP протокол
 
+    Сокеты переиспользуются между запросами (см. UDPTransport), а ответ
+    принимается только с идентификатором запроса и от адреса сервера
+
     :param bytes query: объект bytes, содержащий запрос
     :param server: адрес сервера
     :param port: порт
     :param timeout: время ожидания ответа от сервера
+    :param bufsize: размер буфера приёма
     :raise socket.timeout: превышено время ожидания
     :raise socket.gaierror: ошибки связанные с адресом
     :return: объект bytes содержащий ответ от сервера
     """
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-        s.settimeout(timeout)
-
-        try:
-            s.sendto(query, (server, port))
-            response = s.recv(1024)
-        except socket.timeout:
-            raise
-        except socket.gaierror:
-            raise
-
-    return response
+    return _udp_transport.query(query, server=server, port=port,
+                                timeout=timeout, bufsize=bufsize)
 
 
 def send_query(*, hostname, record_type: RRType,
-               protocol: str, server: ipaddress, port, timeout) -> bytes:
+               protocol: str, server: ipaddress, port, timeout,
+               payload_size=EDNS_PAYLOAD_SIZE) -> bytes:
     """
     Формирует пакет запроса, отправляет его и возвращает ответ от сервера
 
@@ -140,15 +596,20 @@ def send_query(*, hostname, record_type: RRType,
     :param server: адрес DNS-сервера
     :param port: порт DNS-сервера
     :param timeout: время ожидания ответа от сервера
-    :return: объект Answer представляющий ответ от сервера
+    :param payload_size: размер UDP ответа, объявляемый через EDNS0 (None -
+    без EDNS0, ответ не больше 512 байт)
+    :raise InvalidServerResponse: если UDP ответ больше объявленного размера
+    :return: объект bytes содержащий ответ от сервера
     """
 
-    query = Query(hostname, rr_type=record_type)
-    query = query.to_bytes()
+    query = get_query_template(hostname, record_type,
+                               payload_size=payload_size).render()
+    limit = max(payload_size or 0, 512)
 
     try:
         args = {'server': server, 'port': port, 'timeout': timeout}
-        response = (udp_query(query, **args) if protocol.lower() == 'udp'
+        response = (udp_query(query, **args)
+                    if protocol.lower() == 'udp'
                     else tcp_query(query, **args))
     except socket.timeout:
         raise
@@ -157,7 +618,7 @@ def send_query(*, hostname, record_type: RRType,
     except ConnectionError:
         raise
 
-    if protocol == 'udp' and len(response) > 512:
+    if protocol == 'udp' and len(response) > limit:
         raise InvalidServerResponse
 
     return response
@@ -182,46 +643,510 @@ def get_ip_reverse_notation(ip, *, ipv6=False):
     return '.'.join(hostname) + suffix
 
 
+def _transfer_messages(query, *, server, port, timeout):
+    """
+    Отправляет запрос передачи зоны (AXFR/IXFR) и отдаёт записи раздела
+    answers каждого сообщения ответа по мере их прихода из TCP потока
+
+    :param bytes query: объект bytes, содержащий запрос
+    :param server: адрес DNS-сервера
+    :param port: порт DNS-сервера
+    :param timeout: время ожидания каждого сообщения от сервера
+    :raise ZoneTransferRefused: если сервер отказал в передаче
+    :raise InvalidServerResponse: если сообщение не удалось декодировать
+    :raise socket.timeout: превышено время ожидания
+    :return: генератор списков _ResourceRecord (по одному на сообщение)
+    """
+    messages = stream_query(query, server=server, port=port,
+                            timeout=timeout)
+
+    with contextlib.closing(messages):
+        for message in messages:
+            yield _decode_transfer_message(message)
+
+
+def _decode_transfer_message(message) -> list:
+    """
+    Декодирует одно сообщение передачи зоны
+
+    :param bytes message: объект bytes, содержащий сообщение
+    :raise ZoneTransferRefused: если сервер отказал в передаче
+    :raise InvalidServerResponse: если сообщение не удалось декодировать
+    :return: список _ResourceRecord раздела answers
+    """
+    try:
+        answer = Answer.from_bytes(message, lazy=True)
+        records = answer.answers
+    except InvalidAnswer as e:
+        raise InvalidServerResponse from e
+
+    if answer.header.response_type != ResponseType.NO_ERROR:
+        raise ZoneTransferRefused
+
+    return records
+
+
+def transfer_zone(hostname, *, server, port, timeout):
+    """
+    Запрашивает у сервера передачу зоны (AXFR) и отдаёт записи по мере
+    декодирования сообщений из TCP потока. Передача заканчивается на
+    повторной SOA записи (RFC 5936, 2.2), которая не отдаётся
+
+    :param hostname: домен (зона)
+    :param server: адрес DNS-сервера
+    :param port: порт DNS-сервера
+    :param timeout: время ожидания каждого сообщения от сервера
+    :raise ZoneTransferRefused: если сервер отказал в передаче
+    :raise InvalidServerResponse: если сообщение не удалось декодировать
+    либо поток оборвался до конца передачи
+    :raise socket.timeout: превышено время ожидания
+    :return: генератор _ResourceRecord
+    """
+    query = get_query_template(hostname, RRType.AXFR).render()
+    messages = _transfer_messages(query, server=server, port=port,
+                                  timeout=timeout)
+
+    soa_count = 0
+    with contextlib.closing(messages):
+        for records in messages:
+            for record in records:
+                if record.type_ == RRType.SOA:
+                    soa_count += 1
+                    if soa_count == 2:
+                        return
+                elif not soa_count:
+                    raise InvalidServerResponse
+                yield record
+
+    if soa_count:
+        raise InvalidServerResponse
+    raise ZoneTransferRefused
+
+
+def _record_key(record):
+    """
+    Ключ для сравнения записей зоны: имя без учёта регистра, тип, класс и
+    данные записи в несжатом виде
+
+    :param _ResourceRecord record: запись зоны
+    :return: кортеж (имя, тип, класс, RDATA)
+    """
+    return (record.name.lower(), record.type_, record.class_,
+            bytes(record.data.to_bytes()))
+
+
+def update_zone(hostname, records, *, server, port, timeout) -> list:
+    """
+    Обновляет снимок зоны инкрементальной передачей (IXFR, RFC 1995):
+    сервер получает SOA снимка и присылает только изменения после его
+    версии, которые применяются к снимку. Если сервер вместо изменений
+    прислал зону целиком, то возвращается она
+
+    :param hostname: домен (зона)
+    :param records: снимок зоны - список _ResourceRecord, начинающийся с
+    SOA записи (как отдаёт stream_zone_dump)
+    :param server: адрес DNS-сервера
+    :param port: порт DNS-сервера
+    :param timeout: время ожидания каждого сообщения от сервера
+    :raise ValueError: если снимок не начинается с SOA записи
+    :raise ZoneTransferRefused: если сервер отказал в передаче
+    :raise InvalidServerResponse: если сообщение не удалось декодировать
+    либо поток оборвался до конца передачи
+    :raise socket.timeout: превышено время ожидания
+    :return: новый снимок зоны
+    """
+    if not records or records[0].type_ != RRType.SOA:
+        raise ValueError("Снимок зоны должен начинаться с SOA записи")
+
+    query = Query(hostname, RRType.IXFR, is_recursion_desired=False)
+    query.authorities.append(records[0])
+    messages = _transfer_messages(query.to_bytes(), server=server,
+                                  port=port, timeout=timeout)
+
+    with contextlib.closing(messages):
+        first_message = next(messages, None)
+        if not first_message:
+            raise ZoneTransferRefused
+        if first_message[0].type_ != RRType.SOA:
+            raise InvalidServerResponse
+
+        soa = first_message[0]
+        serial = soa.data.serial_number
+        if (len(first_message) == 1
+                and serial == records[0].data.serial_number):
+            # Одна SOA запись с версией снимка: у клиента актуальная
+            # версия зоны. Если версия другая, то это начало передачи,
+            # и её формат определяется по следующей записи
+            return list(records)
+
+        stream = itertools.chain(
+            first_message[1:],
+            (record for message in messages for record in message))
+        second = next(stream, None)
+        if second is None:
+            raise InvalidServerResponse
+
+        if second.type_ != RRType.SOA or second.data.serial_number == serial:
+            # Ответ в формате AXFR: зона целиком до повторной SOA
+            zone = [soa]
+            for record in itertools.chain([second], stream):
+                if record.type_ == RRType.SOA:
+                    return zone
+                zone.append(record)
+            raise InvalidServerResponse
+
+        # Последовательности изменений: SOA старой версии и удалённые
+        # записи, затем SOA новой версии и добавленные записи
+        zone = {_record_key(r): r for r in records[1:]}
+        adding = True
+        for record in itertools.chain([second], stream):
+            if record.type_ == RRType.SOA:
+                if adding and record.data.serial_number == serial:
+                    return [soa] + list(zone.values())
+                adding = not adding
+            elif adding:
+                zone[_record_key(record)] = record
+            else:
+                zone.pop(_record_key(record), None)
+
+    raise InvalidServerResponse
+
+
+def stream_zone_dump(hostname, *, port, timeout):
+    """
+    Отдаёт записи зоны домена по мере их получения, запрашивая передачу
+    зоны у Name Server'ов домена по очереди, пока один из них не начнёт
+    передачу
+
+    :param hostname: домен
+    :param port: порт
+    :param timeout: время ожидания ответа от сервера
+    :raise ZoneTransferRefused: если ни один сервер не передал зону
+    :return: генератор _ResourceRecord
+    """
+    name_servers = find_name_servers(hostname,
+                                     protocol='udp', port=port,
+                                     timeout=timeout)
+
+    yield from _transfer_from_any(hostname, name_servers, port=port,
+                                  timeout=timeout)
+
+
+def _transfer_from_any(hostname, name_servers, *, port, timeout):
+    """
+    Запрашивает передачу зоны у name_servers в порядке их скорости (см.
+    infra_cache), пока один из них не начнёт передачу. Сервер, ответивший
+    ошибкой до первой записи (например NOTAUTH), пропускается
+
+    :raise ZoneTransferRefused: если ни один сервер не передал зону
+    :return: генератор _ResourceRecord
+    """
+    for ns in infra_cache.sort(name_servers):
+        records = transfer_zone(hostname, server=ns, port=port,
+                                timeout=timeout)
+        started = time.monotonic()
+        try:
+            first = next(records)
+        except (ZoneTransferRefused, InvalidServerResponse):
+            continue
+        except (socket.timeout, ConnectionError):
+            infra_cache.record_timeout(ns)
+            continue
+        infra_cache.record_rtt(ns, time.monotonic() - started)
+
+        yield first
+        yield from records
+        return
+
+    raise ZoneTransferRefused
+
+
 def get_zone_dump(hostname, *, port, timeout):
     """
     Возвращает все поддомены в домене используя axfr запрос к Name Server'у
-    домена
+    домена (все записи передачи собираются в памяти, для потоковой
+    обработки см. stream_zone_dump)
     :param hostname: домен
     :param port: порт
     :param timeout: время ожидания ответа от сервера
-    :return: ответ от сервера со всеми поддоменами домена
+    :return: ответ со всеми поддоменами домена (без записей и с кодом
+    REFUSED, если ни один сервер не передал зону) либо None, если у домена
+    нет Name Server'ов
+    """
+    name_servers = find_name_servers(hostname,
+                                     protocol='udp', port=port,
+                                     timeout=timeout)
+    if not name_servers:
+        return None
+
+    try:
+        records = list(_transfer_from_any(hostname, name_servers, port=port,
+                                          timeout=timeout))
+    except ZoneTransferRefused:
+        return _make_zone_dump(hostname, [], ResponseType.REFUSED)
+
+    return _make_zone_dump(hostname, records)
+
+
+def _make_zone_dump(hostname, records, response_type=ResponseType.NO_ERROR):
+    """
+    Собирает ответ get_zone_dump из записей передачи зоны
     """
+    header = _Header(0, MessageType.RESPONSE, question_count=1,
+                     response_type=response_type, answer_count=len(records))
+    return Answer(header, [_Question(hostname, RRType.AXFR)], records,
+                  [], [])
 
+
+def get_zone_update(hostname, records, *, port, timeout) -> list:
+    """
+    Обновляет снимок зоны домена: запрашивает у Name Server'ов домена по
+    очереди только изменения (IXFR), а если сервер отказал в IXFR -
+    передачу зоны целиком (AXFR)
+
+    :param hostname: домен
+    :param records: снимок зоны - список _ResourceRecord, начинающийся с
+    SOA записи
+    :param port: порт
+    :param timeout: время ожидания ответа от сервера
+    :raise ZoneTransferRefused: если ни один сервер не передал зону
+    :return: новый снимок зоны
+    """
     name_servers = find_name_servers(hostname,
                                      protocol='udp', port=port,
                                      timeout=timeout)
 
-    answer = None
-    for ns in name_servers:
-        answer = get_answer(hostname, RRType.AXFR, protocol='tcp',
-                            server=ns, port=port, timeout=timeout)
+    for ns in infra_cache.sort(name_servers):
+        args = {'server': ns, 'port': port, 'timeout': timeout}
+        try:
+            return update_zone(hostname, records, **args)
+        except (ZoneTransferRefused, InvalidServerResponse):
+            pass
+        except (socket.timeout, ConnectionError):
+            infra_cache.record_timeout(ns)
+            continue
 
-        if answer.header.answer_count:
-            break
+        try:
+            return list(transfer_zone(hostname, **args))
+        except (ZoneTransferRefused, InvalidServerResponse, socket.timeout,
+                ConnectionError):
+            continue
 
-    return answer
+    raise ZoneTransferRefused
 
 
 def get_answer(hostname, record_type,
-               *, inverse=False, ipv6=False, protocol, server, port, timeout):
+               *, inverse=False, ipv6=False, protocol, server, port, timeout,
+               lazy=False, payload_size=EDNS_PAYLOAD_SIZE):
+    """
+    Отправляет запрос и декодирует ответ от сервера
+
+    :param hostname: доменное имя (или ip, если inverse)
+    :param record_type: тип требуемой DNS-записи
+    :param inverse: флаг обратного запроса (PTR)
+    :param ipv6: флаг для IPv6
+    :param protocol: протокол сетевого уровня
+    :param server: адрес DNS-сервера
+    :param port: порт DNS-сервера
+    :param timeout: время ожидания ответа от сервера
+    :param lazy: декодировать ли разделы ответа только по требованию
+    :param payload_size: размер UDP ответа, объявляемый через EDNS0 (None -
+    без EDNS0)
+    :raise InvalidServerResponse: если ответ не удалось декодировать (для
+    lazy=True - и при первом обращении к разделу ответа)
+    :return: объект Answer
+    """
     if inverse:
         hostname = get_ip_reverse_notation(hostname, ipv6=ipv6)
 
-    response = send_query(hostname=hostname, record_type=record_type,
-                          protocol=protocol, server=server,
-                          port=port, timeout=timeout)
+    answer = _get_cached_answer(hostname, record_type)
+    if answer is not None:
+        return answer
+
+    key = (hostname.rstrip('.').lower(), record_type, protocol.lower(),
+           server, port, payload_size, lazy)
+    return _in_flight.run(key, lambda: _query_answer(
+        hostname, record_type, protocol=protocol, server=server, port=port,
+        timeout=timeout, lazy=lazy, payload_size=payload_size))
+
 
+def _query_answer(hostname, record_type, *, protocol, server, port, timeout,
+                  lazy, payload_size):
+    """
+    Отправляет запрос, при ошибке EDNS0 повторяет его без OPT записи, при
+    обрезанном UDP ответе - через TCP, и кэширует ответ (сетевая часть
+    get_answer)
+
+    :return: объект Answer
+    """
+    args = {'hostname': hostname, 'record_type': record_type,
+            'server': server, 'port': port, 'timeout': timeout,
+            'payload_size': payload_size}
+    started = time.monotonic()
+    try:
+        response = send_query(protocol=protocol, **args)
+    except (socket.timeout, ConnectionError):
+        infra_cache.record_timeout(server)
+        raise
+    infra_cache.record_rtt(server, time.monotonic() - started)
+    answer = _decode_response(response, lazy=lazy)
+
+    if payload_size is not None and answer.response_code in _EDNS_ERRORS:
+        # Сервер не понял OPT запись: повторяем запрос без EDNS0
+        args['payload_size'] = None
+        answer = _decode_response(send_query(protocol=protocol, **args),
+                                  lazy=lazy)
+
+    if answer.header.is_truncated and protocol.lower() == 'udp':
+        # Ответ не поместился в датаграмму (флаг TC): повторяем запрос
+        # через TCP транспорт
+        _tcp_fallbacks[server] += 1
+        answer = _decode_response(send_query(protocol='tcp', **args),
+                                  lazy=lazy)
+
+    _cache_answer(hostname, record_type, answer)
+    return answer
+
+
+def _get_cached_answer(hostname, record_type):
+    """
+    Собирает Answer из закэшированных записей (см. answer_cache). Для
+    отрицательного ответа раздел answers пуст, а в authorities лежит SOA
+
+    :param hostname: доменное имя
+    :param record_type: тип DNS-записи
+    :return: объект Answer либо None, если записей в кэше нет
+    """
+    questions = [_Question(hostname, record_type)]
+    records = answer_cache.get(hostname, record_type)
+    if records is not None:
+        header = _Header(0, MessageType.RESPONSE, question_count=1,
+                         is_recursion_desired=True,
+                         answer_count=len(records))
+        return Answer(header, questions, records, [], [])
+
+    negative = answer_cache.get_negative(hostname, record_type)
+    if negative is not None:
+        response_type, soa = negative
+        header = _Header(0, MessageType.RESPONSE, question_count=1,
+                         is_recursion_desired=True,
+                         response_type=response_type, authority_count=1)
+        return Answer(header, questions, [], [soa], [])
+
+    return None
+
+
+def _cache_answer(hostname, record_type, answer):
+    """
+    Сохраняет в answer_cache записи полного положительного ответа либо
+    отрицательный ответ (NXDOMAIN/NODATA с SOA в authorities)
+    """
+    header = answer.header
+    if header.is_truncated or header.response_type not in (
+            ResponseType.NO_ERROR, ResponseType.NAME_ERROR):
+        return
+
+    if header.answer_count:
+        if header.response_type == ResponseType.NO_ERROR:
+            answer_cache.put(hostname, record_type, answer.answers)
+        return
+
+    for record in answer.authorities:
+        if record.type_ == RRType.SOA:
+            answer_cache.put_negative(hostname, record_type,
+                                      header.response_type, record)
+            return
+
+
+class _ServerAnswer(Answer):
+    """
+    Answer, полученный от сервера: ошибки ленивого декодирования разделов
+    выдаются как InvalidServerResponse, как и ошибки самого get_answer
+    """
+
+    __slots__ = ()
+
+    def _decode_section(self, section):
+        try:
+            return super()._decode_section(section)
+        except InvalidAnswer as e:
+            raise InvalidServerResponse from e
+
+
+def _decode_response(response, *, lazy=False):
+    """
+    Декодирует ответ от сервера
+
+    :param bytes response: объект bytes, содержащий ответ
+    :param lazy: декодировать ли разделы ответа только по требованию
+    :raise InvalidServerResponse: если ответ не удалось декодировать (для
+    ленивого ответа - и при первом обращении к разделу)
+    :return: объект Answer
+    """
     try:
-        answer = Answer.from_bytes(response)
+        return _ServerAnswer.from_bytes(response, lazy=lazy)
     except InvalidAnswer as e:
         raise InvalidServerResponse from e
 
-    return answer
+
+def get_coalescing_stats() -> dict:
+    """
+    Возвращает, сколько запросов get_answer ушло к серверам ('queries') и
+    сколько одновременных дубликатов дождались их ответа вместо отправки
+    своего ('coalesced'). Учитываются и вызовы async_resolver.get_answer
+
+    :return: словарь с ключами 'queries' и 'coalesced'
+    """
+    return {'queries': _coalescing['queries'],
+            'coalesced': _coalescing['coalesced']}
+
+
+def get_tcp_fallback_counts() -> dict:
+    """
+    Возвращает, сколько раз по каждому серверу обрезанный UDP ответ
+    (флаг TC) пришлось повторять через TCP
+
+    :return: словарь адрес сервера -> количество повторов
+    """
+    return dict(_tcp_fallbacks)
+
+
+def _get_udp_multiplexer():
+    global _udp_multiplexer
+    if _udp_multiplexer is None:
+        _udp_multiplexer = UDPMultiplexer()
+    return _udp_multiplexer
+
+
+def get_answers(hostnames, record_type, *, server, port, timeout) -> list:
+    """
+    Отправляет запросы по всем hostnames одновременно через один UDP
+    сокет (см. UDPMultiplexer) и собирает ответы
+
+    :param hostnames: доменные имена
+    :param record_type: тип требуемой DNS-записи
+    :param server: адрес DNS-сервера
+    :param port: порт DNS-сервера
+    :param timeout: время ожидания ответа на каждый запрос
+    :return: список Answer в порядке hostnames (None, если ответа нет или
+    он невалиден)
+    """
+    multiplexer = _get_udp_multiplexer()
+    futures = [
+        multiplexer.submit(
+            get_query_template(hostname, record_type,
+                               payload_size=EDNS_PAYLOAD_SIZE).render(),
+            server=server, port=port, timeout=timeout)
+        for hostname in hostnames]
+
+    answers = []
+    for future in futures:
+        try:
+            answers.append(Answer.from_bytes(future.result()))
+        except (socket.timeout, OSError, InvalidAnswer):
+            answers.append(None)
+
+    return answers
 
 
 def resolve(args):
@@ -237,41 +1162,44 @@ def resolve(args):
     if args.dump:
         return get_zone_dump(hostname, port=port, timeout=timeout)
 
-    if server is None:
-        server = get_primary_name_server(
-            hostname, protocol=protocol, port=port, timeout=timeout)
-
     record_type = (RRType.AAAA if args.ipv6
                    else RRType.A)
 
+    if server is None:
+        return resolve_iterative(hostname, record_type, protocol=protocol,
+                                 port=port, timeout=timeout,
+                                 payload_size=args.payload_size)
+
     return get_answer(hostname, record_type, inverse=False,
                       ipv6=args.ipv6, protocol=protocol, server=server,
-                      port=port, timeout=timeout)
+                      port=port, timeout=timeout,
+                      payload_size=args.payload_size)
 
 
 def resolve_reverse_lookup(args):
-    hostname = args.hostname
-    protocol = args.protocol
-    server = args.server
-    port = args.port
-    timeout = args.timeout
-
-    if server is None:
-        servers = (dns_servers.revers_lookup_servers_ip6 if args.ipv6
-                   else dns_servers.revers_lookup_servers)
-        server = random.choice(list(servers))
-
-    answer = get_answer(hostname, RRType.PTR, inverse=True,
-                        ipv6=args.ipv6, protocol=protocol, server=server,
-                        port=port, timeout=timeout)
-
-    while (not answer.header.answer_count
-           and any(ns for ns in answer.authorities
-                   if ns.type_ == RRType.NS)):
-        server = random.choice(answer.authorities).data.name
-        answer = get_answer(hostname, RRType.PTR, inverse=True,
-                            ipv6=args.ipv6, protocol=protocol,
-                            server=server,
-                            port=port, timeout=timeout)
+    """
+    Находит PTR записи для ip спуском по делегированиям от серверов
+    in-addr.arpa (ip6.arpa) либо от заданного сервера
 
+    :param args: аргументы командной строки (см. arg_parser)
+    :raise ResolutionFailed: если ни один сервер не дал ответа
+    :return: объект Answer
+    """
+    answer, _, _ = _resolve_name(
+        get_ip_reverse_notation(args.hostname, ipv6=args.ipv6), RRType.PTR,
+        [], protocol=args.protocol, port=args.port, timeout=args.timeout,
+        payload_size=args.payload_size, start=_get_reverse_servers(args))
     return answer
+
+
+def _get_reverse_servers(args):
+    """
+    Возвращает серверы, с которых начинается обратный запрос
+
+    :return: кортеж (зона, список имён, список IPv4 адресов)
+    """
+    if args.server is not None:
+        return '', [], [args.server]
+    if args.ipv6:
+        return 'ip6.arpa', [], list(dns_servers.revers_lookup_servers_ip6)
+    return 'in-addr.arpa', [], list(dns_servers.revers_lookup_servers)
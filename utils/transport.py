@@ -0,0 +1,560 @@
+import random
+import select
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from dns.dns_message import _UNSIGNED_SHORT, _skip_name
+
+
+class UDPTransport:
+    """
+    UDP транспорт, переиспользующий открытые сокеты между запросами
+    """
+
+    def __init__(self, pool_size=4):
+        """
+        Инициализирует UDPTransport
+
+        :param int pool_size: сколько свободных сокетов держать открытыми
+        """
+        self._pool_size = pool_size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _release(self, s):
+        with self._lock:
+            if len(self._idle) < self._pool_size:
+                self._idle.append(s)
+                return
+        s.close()
+
+    def close(self):
+        """
+        Закрывает все свободные сокеты
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for s in idle:
+            s.close()
+
+    def query(self, query: bytes, *, server, port, timeout,
+              bufsize=4096) -> bytes:
+        """
+        Отправляет dns-запрос и ждёт ответ с тем же идентификатором от того
+        же адреса. Прочие датаграммы (например, запоздавшие ответы на
+        прошлые запросы через этот сокет) отбрасываются
+
+        :param bytes query: объект bytes, содержащий запрос
+        :param server: адрес сервера
+        :param port: порт
+        :param timeout: время ожидания ответа от сервера
+        :param bufsize: размер буфера приёма
+        :raise socket.timeout: превышено время ожидания
+        :raise socket.gaierror: ошибки связанные с адресом
+        :return: объект bytes содержащий ответ от сервера
+        """
+        address = (socket.gethostbyname(server), port)
+        identifier = bytes(query[:2])
+        deadline = time.monotonic() + timeout
+
+        s = self._acquire()
+        try:
+            s.sendto(query, address)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise socket.timeout('timed out')
+                s.settimeout(remaining)
+
+                response, source = s.recvfrom(bufsize)
+                if source[:2] == address and response[:2] == identifier:
+                    break
+        except BaseException:
+            s.close()
+            raise
+
+        self._release(s)
+        return response
+
+
+def _question_key(message) -> bytes:
+    """
+    Возвращает раздел первого вопроса сообщения в нижнем регистре (для
+    сопоставления ответа с запросом)
+
+    :param message: байтовое представление Query/Answer
+    :raise IndexError: если сообщение обрезано
+    :return: объект bytes
+    """
+    end = _skip_name(message, 12) + 4
+    if end > len(message):
+        raise IndexError('Вопрос выходит за границы сообщения')
+    return bytes(message[12:end]).lower()
+
+
+class _TimerWheel:
+    """
+    Колесо таймеров: срок каждого элемента округляется до тика, элементы
+    хранятся в слотах по номеру тика, так что добавление - O(1), а за
+    продвижение просматриваются только слоты прошедших тиков. add и
+    advance можно вызывать из разных потоков
+    """
+
+    def __init__(self, tick=0.01, size=1024):
+        """
+        Инициализирует _TimerWheel
+
+        :param float tick: длительность тика в секундах
+        :param int size: количество слотов
+        """
+        self._tick = tick
+        self._slots = [[] for _ in range(size)]
+        self._current = int(time.monotonic() / tick)
+        self._lock = threading.Lock()
+
+    def add(self, deadline, item):
+        """
+        Добавляет элемент со сроком deadline (по time.monotonic())
+        """
+        with self._lock:
+            tick = max(int(deadline / self._tick), self._current)
+            self._slots[tick % len(self._slots)].append((tick, item))
+
+    def advance(self, now) -> list:
+        """
+        Продвигает колесо до момента now
+
+        :return: список элементов, срок которых истёк
+        """
+        now_tick = int(now / self._tick)
+        expired = []
+        with self._lock:
+            steps = min(now_tick - self._current + 1, len(self._slots))
+            for tick in range(self._current, self._current + steps):
+                slot = self._slots[tick % len(self._slots)]
+                if not slot:
+                    continue
+                keep = []
+                for entry in slot:
+                    if entry[0] <= now_tick:
+                        expired.append(entry[1])
+                    else:
+                        keep.append(entry)
+                slot[:] = keep
+
+            self._current = max(self._current, now_tick)
+        return expired
+
+
+class UDPMultiplexer:
+    """
+    UDP транспорт, который держит тысячи запросов в полёте на одном
+    сокете. Ответы раздаются ожидающим по ключу (идентификатор, адрес
+    сервера, вопрос), сроки запросов отслеживает колесо таймеров
+    """
+
+    def __init__(self, *, bufsize=4096, tick=0.01,
+                 receive_buffer=4 * 1024 * 1024):
+        """
+        Инициализирует UDPMultiplexer
+
+        :param bufsize: размер буфера приёма одной датаграммы
+        :param tick: точность таймаутов в секундах
+        :param receive_buffer: желаемый размер буфера приёма сокета
+        """
+        self._bufsize = bufsize
+        self._tick = tick
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                    receive_buffer)
+        except OSError:  # pragma: no cover
+            pass
+        self._socket.bind(('0.0.0.0', 0))
+        self._socket.setblocking(False)
+
+        self._pending = {}
+        self._wheel = _TimerWheel(tick)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._receive_loop,
+                                        daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def close(self):
+        """
+        Останавливает приём, незавершённые запросы получают ConnectionError
+        """
+        self._closed = True
+        self._thread.join()
+        self._socket.close()
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(ConnectionError('Транспорт закрыт'))
+
+    def submit(self, query: bytes, *, server, port, timeout) -> Future:
+        """
+        Отправляет dns-запрос, не дожидаясь ответа. Идентификатор запроса
+        заменяется свободным для этого сервера и вопроса
+
+        :param bytes query: объект bytes, содержащий запрос
+        :param server: адрес сервера
+        :param port: порт
+        :param timeout: время ожидания ответа от сервера
+        :raise socket.gaierror: ошибки связанные с адресом
+        :return: Future, который завершится ответом (bytes) либо
+        исключением socket.timeout
+        """
+        if self._closed:
+            raise ConnectionError('Транспорт закрыт')
+
+        address = (socket.gethostbyname(server), port)
+        question = _question_key(query)
+        query = bytearray(query)
+        future = Future()
+
+        with self._lock:
+            while True:
+                identifier = random.getrandbits(16)
+                key = (identifier, address, question)
+                if key not in self._pending:
+                    break
+            self._pending[key] = future
+            self._wheel.add(time.monotonic() + timeout, (key, future))
+
+        struct.pack_into('!H', query, 0, identifier)
+        try:
+            self._socket.sendto(query, address)
+        except OSError as e:
+            self._finish(key, future, exception=e)
+
+        return future
+
+    def query(self, query: bytes, *, server, port, timeout) -> bytes:
+        """
+        Отправляет dns-запрос и ждёт ответ (блокирующая обёртка над submit)
+
+        :raise socket.timeout: превышено время ожидания
+        :return: объект bytes содержащий ответ от сервера
+        """
+        return self.submit(query, server=server, port=port,
+                           timeout=timeout).result()
+
+    def _finish(self, key, future, *, result=None, exception=None):
+        with self._lock:
+            if self._pending.get(key) is not future:
+                return
+            del self._pending[key]
+
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def _dispatch(self, data, source):
+        try:
+            key = (struct.unpack_from('!H', data)[0], source[:2],
+                   _question_key(data))
+        except (IndexError, struct.error):
+            return
+
+        future = self._pending.get(key)
+        if future is not None:
+            self._finish(key, future, result=data)
+
+    def _receive_loop(self):
+        while not self._closed:
+            readable, _, _ = select.select([self._socket], [], [],
+                                           self._tick)
+            while readable:
+                try:
+                    data, source = self._socket.recvfrom(self._bufsize)
+                except OSError:
+                    break
+                self._dispatch(data, source)
+
+            for key, future in self._wheel.advance(time.monotonic()):
+                self._finish(key, future,
+                             exception=socket.timeout('timed out'))
+
+
+class _FrameReader:
+    """
+    Буферизованное чтение dns-сообщений с двухбайтовым префиксом длины
+    (RFC 1035, 4.2.2) из TCP сокета. Данные читаются через recv_into в
+    заранее выделенный буфер большими порциями, так что одно сообщение
+    может прийти несколькими сегментами, а один recv может вернуть сразу
+    несколько сообщений
+    """
+
+    _MIN_CAPACITY = 2 + 65535
+
+    def __init__(self, s, capacity=_MIN_CAPACITY):
+        """
+        Инициализирует _FrameReader
+
+        :param s: TCP сокет
+        :param capacity: размер буфера (не меньше максимального сообщения)
+        """
+        self._socket = s
+        self._buffer = bytearray(max(capacity, self._MIN_CAPACITY))
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+    def _fill(self):
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buffer):
+            size = self._end - self._start
+            self._buffer[:size] = self._view[self._start:self._end]
+            self._start, self._end = 0, size
+
+        received = self._socket.recv_into(self._view[self._end:])
+        if not received:
+            raise ConnectionError('Соединение закрыто сервером')
+        self._end += received
+
+    def read_frame(self) -> bytes:
+        """
+        Читает следующее сообщение целиком
+
+        :raise ConnectionError: если соединение закрыто посреди сообщения
+        :return: объект bytes, содержащий сообщение без префикса длины
+        """
+        while self._end - self._start < 2:
+            self._fill()
+        size = _UNSIGNED_SHORT.unpack_from(self._buffer, self._start)[0]
+        while self._end - self._start < 2 + size:
+            self._fill()
+
+        begin = self._start + 2
+        self._start = begin + size
+        return bytes(self._view[begin:self._start])
+
+    def __iter__(self):
+        """
+        Читает сообщения, пока соединение не закроется
+        """
+        while True:
+            try:
+                yield self.read_frame()
+            except ConnectionError:
+                if self._start != self._end:
+                    raise
+                return
+
+
+class _TCPConnection:
+    """
+    Одно TCP соединение, по которому запросы отправляются конвейером:
+    не дожидаясь предыдущих ответов. Ответы (в любом порядке) раздаёт
+    поток чтения по идентификатору
+    """
+
+    def __init__(self, address, timeout):
+        """
+        Устанавливает соединение
+
+        :param address: кортеж (адрес, порт)
+        :param timeout: время ожидания установки соединения
+        :raise socket.timeout: превышено время ожидания
+        :raise socket.gaierror: ошибки связанные с адресом
+        """
+        self._socket = socket.create_connection(address, timeout)
+        self._socket.settimeout(None)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = _FrameReader(self._socket)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self.closed = False
+        self.used = False
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, query: bytes) -> Future:
+        """
+        Отправляет запрос, заменив идентификатор свободным на этом
+        соединении
+
+        :raise ConnectionError: если соединение закрыто
+        :return: Future, который завершится ответом (bytes)
+        """
+        query = bytearray(query)
+        future = Future()
+
+        with self._lock:
+            if self.closed:
+                raise ConnectionError('Соединение закрыто')
+            while True:
+                identifier = random.getrandbits(16)
+                if identifier not in self._pending:
+                    break
+            self._pending[identifier] = future
+            self.used = True
+
+        struct.pack_into('!H', query, 0, identifier)
+        try:
+            with self._send_lock:
+                self._socket.sendall(struct.pack('!H', len(query)) + query)
+        except OSError as e:
+            self.close(e)
+
+        return future
+
+    def cancel(self, future):
+        """
+        Забывает о запросе, ответ на который больше не нужен
+        """
+        with self._lock:
+            for identifier, pending in self._pending.items():
+                if pending is future:
+                    del self._pending[identifier]
+                    break
+
+    def close(self, exception=None):
+        """
+        Закрывает соединение, незавершённые запросы получают exception
+        (по умолчанию ConnectionError)
+        """
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            pending, self._pending = self._pending, {}
+
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+
+        if not isinstance(exception, ConnectionError):
+            exception = ConnectionError(exception or 'Соединение закрыто')
+        for future in pending.values():
+            future.set_exception(exception)
+
+    def _read_loop(self):
+        while True:
+            try:
+                response = self._reader.read_frame()
+                identifier = _UNSIGNED_SHORT.unpack_from(response)[0]
+            except (OSError, struct.error) as e:
+                self.close(e)
+                return
+
+            with self._lock:
+                future = self._pending.pop(identifier, None)
+            if future is not None:
+                future.set_result(response)
+
+
+class TCPTransport:
+    """
+    TCP транспорт, который держит по одному соединению на (сервер, порт)
+    и отправляет по нему запросы конвейером. Если сервер закрыл простаивающее
+    соединение, запрос прозрачно повторяется через новое
+    """
+
+    def __init__(self):
+        self._connections = {}
+        self._connecting = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        """
+        Закрывает все соединения
+        """
+        with self._lock:
+            connections, self._connections = self._connections, {}
+        for connection in connections.values():
+            connection.close()
+
+    def _connect(self, address, timeout, stale=None) -> _TCPConnection:
+        with self._lock:
+            connecting = self._connecting.setdefault(address,
+                                                     threading.Lock())
+
+        with connecting:
+            connection = self._connections.get(address)
+            if (connection is None or connection.closed
+                    or connection is stale):
+                connection = _TCPConnection(address, timeout)
+                with self._lock:
+                    self._connections[address] = connection
+        return connection
+
+    def query(self, query: bytes, *, server, port, timeout) -> bytes:
+        """
+        Отправляет dns-запрос через TCP соединение из пула и ждёт ответ
+
+        :param bytes query: объект bytes, содержащий запрос
+        :param server: адрес сервера
+        :param port: порт
+        :param timeout: время ожидания ответа от сервера
+        :raise socket.timeout: превышено время ожидания
+        :raise socket.gaierror: ошибки связанные с адресом
+        :raise ConnectionError: если сервер закрыл новое соединение
+        :return: объект bytes содержащий ответ от сервера
+        """
+        address = (server, port)
+        deadline = time.monotonic() + timeout
+
+        connection = self._connect(address, timeout)
+        reused = connection.used
+        while True:
+            try:
+                future = connection.submit(query)
+                return future.result(max(0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                connection.cancel(future)
+                raise socket.timeout('timed out') from None
+            except ConnectionError:
+                if not reused:
+                    raise
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout('timed out')
+            connection = self._connect(address, remaining, stale=connection)
+            reused = False
+
+
+def stream_query(query: bytes, *, server, port, timeout):
+    """
+    Отправляет dns-запрос через отдельное TCP соединение и отдаёт все
+    сообщения ответа по мере их прихода (для передачи зоны, где ответ
+    занимает много сообщений). Соединение закрывается, когда генератор
+    закрыт или исчерпан
+
+    :param bytes query: объект bytes, содержащий запрос
+    :param server: адрес сервера
+    :param port: порт
+    :param timeout: время ожидания каждой порции данных от сервера
+    :raise socket.timeout: превышено время ожидания
+    :raise socket.gaierror: ошибки связанные с адресом
+    :return: генератор объектов bytes с идентификатором запроса
+    """
+    identifier = bytes(query[:2])
+    with socket.create_connection((server, port), timeout) as s:
+        s.sendall(_UNSIGNED_SHORT.pack(len(query)) + query)
+        for message in _FrameReader(s):
+            if message[:2] == identifier:
+                yield message
@@ -11,3 +11,13 @@ class InvalidServerResponse(DNSClientException):  # pragma: no cover
 class InvalidAnswer(DNSClientException):  # pragma: no cover
     def __init__(self):
         Exception.__init__(self, "Невалидные данные для создания Answer")
+
+
+class ZoneTransferRefused(DNSClientException):  # pragma: no cover
+    def __init__(self):
+        Exception.__init__(self, "Сервер отказал в передаче зоны")
+
+
+class ResolutionFailed(DNSClientException):  # pragma: no cover
+    def __init__(self):
+        Exception.__init__(self, "Не удалось разрешить доменное имя")